@@ -13,4 +13,29 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, the consumer touches models and settings.
+from chat.consumers import chat_socket  # noqa: E402
+
+
+async def lifespan(receive, send):
+    # Nothing to set up or tear down; acknowledge so servers that send lifespan events start cleanly.
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    # Plain HTTP goes through Django, websockets to the chat push channel.
+    if scope['type'] == 'websocket':
+        await chat_socket(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        # Django's ASGIHandler only serves http and raises on lifespan scopes
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,168 @@
+"""
+Per-endpoint SQL query budgets.
+
+QueryBudgetMiddleware counts the queries each request runs, on every
+database alias, and groups them by normalized SQL so an N+1 loop shows up as
+one statement repeated N times. A request goes over budget when it runs more
+queries than QUERY_BUDGETS allows for its view (keyed by URL name), or
+repeats one statement QUERY_BUDGET_REPEAT_THRESHOLD times or more.
+
+Over-budget requests raise QueryBudgetExceeded when QUERY_BUDGET_STRICT is
+on (the default under `manage.py test`), so a regression fails the test that
+hit the endpoint; otherwise they are logged as warnings.
+
+Queries are attributed to a request through a context variable rather than
+to the connections of the thread that started it, so the ones async views
+run in sync_to_async threads, on those threads' own connections, count too.
+
+For budgets inside a single test, use the context manager:
+
+    with query_budget(3):
+        client.get(url)
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize_sql(sql):
+    """Strip what differs between the iterations of a loop: literals and the length of IN lists."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return ' '.join(sql.split())
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.statements = Counter()
+
+    def record(self, sql):
+        self.count += 1
+        self.statements[normalize_sql(sql)] += 1
+
+    def repeated(self, threshold):
+        return [(sql, times) for sql, times in self.statements.most_common() if times >= threshold]
+
+    def problems(self, budget, threshold):
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f"{self.count} queries, budget is {budget}")
+        for sql, times in self.repeated(threshold):
+            problems.append(f"repeated {times}x (N+1?): {sql[:200]}")
+        return problems
+
+
+# the recorders of the blocks being measured, innermost last; sync_to_async and
+# async_to_sync carry it into the threads and tasks they run code in
+_recorders = ContextVar('query_budget_recorders', default=())
+
+
+def _record(execute, sql, params, many, context):
+    for recorder in _recorders.get():
+        recorder.record(sql)
+    return execute(sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    # every connection carries the wrapper; it does nothing outside record_queries()
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+connection_created.connect(_install)
+
+
+def _install_all():
+    # this thread's connections opened before this module was imported never sent connection_created
+    for connection in connections.all():
+        _install(connection)
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    _install_all()
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+@contextmanager
+def query_budget(budget, repeat_threshold = None):
+    """Fail with QueryBudgetExceeded if the block runs more than `budget` queries or repeats one."""
+    threshold = repeat_threshold or settings.QUERY_BUDGET_REPEAT_THRESHOLD
+    with record_queries() as recorder:
+        yield recorder
+    problems = recorder.problems(budget, threshold)
+    if problems:
+        raise QueryBudgetExceeded('; '.join(problems))
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.QUERY_BUDGET_ENABLED:
+            return self.get_response(request)
+
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.check(request, response, recorder)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_BUDGET_ENABLED:
+            return await self.get_response(request)
+
+        with record_queries() as recorder:
+            # async views query through sync_to_async, on that thread's connections
+            await sync_to_async(_install_all)()
+            response = await self.get_response(request)
+        return self.check(request, response, recorder)
+
+    def check(self, request, response, recorder):
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else None
+        if view_name is None:
+            return response
+
+        budget = settings.QUERY_BUDGETS.get(view_name, settings.QUERY_BUDGET_DEFAULT)
+        problems = recorder.problems(budget, settings.QUERY_BUDGET_REPEAT_THRESHOLD)
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(recorder.count)
+        if problems:
+            message = f"{request.method} {request.path} ({view_name}) over query budget: " + '; '.join(problems)
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
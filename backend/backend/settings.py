@@ -3,6 +3,7 @@
 from datetime import timedelta
 from pathlib import Path
 import os
+import sys
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,6 +24,8 @@ ALLOWED_HOSTS = ['.vercel.app', '.now.sh', '127.0.0.1', 'localhost']
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:5173',"http://localhost:5174"  # Allow your frontend origin
 ]
+# the client names downloaded insurance files after it
+CORS_EXPOSE_HEADERS = ['Content-Disposition']
 
 # Application definition
 
@@ -99,6 +102,8 @@ SIMPLE_JWT = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # first, so it counts every query the rest of the stack makes
+    'backend.query_budget.QueryBudgetMiddleware',
 
     "corsheaders.middleware.CorsMiddleware",
 
@@ -129,6 +134,30 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Chat push channel (websockets served by backend.asgi).
+# The in-process broker only reaches sockets held by the same worker process;
+# point CHAT_PUBSUB_BACKEND at a shared implementation when running several.
+CHAT_PUBSUB_BACKEND = 'chat.pubsub.InProcessBroker'
+CHAT_PUBSUB_OPTIONS = {
+    'queue_size': 100,  # pending messages per socket before dropping
+}
+
+# Chat history pagination (?limit=, ?before=, ?after=)
+CHAT_PAGE_SIZE = 50
+CHAT_MAX_PAGE_SIZE = 200
+
+# Largest array accepted by chat_messages/batch/
+CHAT_BATCH_MAX_SIZE = 100
+
+# Write-through cache of the newest messages per conversation.
+# 'alias' names a CACHES entry shared by all workers; None keeps an in-process LRU.
+CHAT_RECENT_CACHE = {
+    'max_conversations': 1000,
+    'tail_size': 200,
+    'alias': None,
+}
 
 
 # Database
@@ -138,7 +167,147 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # cold tier for old chat messages: python manage.py migrate --database=chat_archive
+    'chat_archive': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'chat_archive.sqlite3',
+    },
+}
+
+DATABASE_ROUTERS = ['chat.routers.ChatArchiveRouter']
+
+# manage.py archive_chat_messages moves messages older than this to the archive
+CHAT_ARCHIVE_DATABASE = 'chat_archive'
+CHAT_ARCHIVE_AFTER_DAYS = 180
+
+# userauth.authentication.ClaimsJWTAuthentication, used by read endpoints, takes the
+# user from the access token's claims instead of loading the row per request. Whether
+# the account is active, its staff flags, role and password hash are cached per process
+# for 'ttl' seconds, so a deactivation made in another worker applies within that window.
+JWT_USER_STATUS_CACHE = {
+    'ttl': 30,
+    'max_users': 10000,
+}
+
+# Bloom filter in front of the refresh token blacklist (userauth.blacklist). Tokens
+# blacklisted by other workers reach it every 'sync_seconds', each sync re-reading
+# the last 'sync_overlap' ids for rows committed out of id order; it is rebuilt,
+# sized to the table, every 'rebuild_seconds'. Expired tokens are removed by
+# manage.py prune_token_blacklist, which should run daily.
+TOKEN_BLACKLIST_FILTER = {
+    'false_positive_rate': 0.01,
+    'sync_seconds': 5,
+    'rebuild_seconds': 60 * 60,
+    'sync_overlap': 1000,
+}
+
+# Physician directory served by user/physicians/ (userauth.directory). Each worker
+# checks its version against the physician table at most every 'check_seconds', so
+# changes made through other workers show within that window; the pre-serialized
+# JSON is kept per version in this CACHES alias.
+PHYSICIAN_DIRECTORY_CACHE = {
+    'alias': 'default',
+    'timeout': 24 * 60 * 60,
+    'check_seconds': 5,
+}
+
+# user/physicians/search/ (userauth.search) page sizes
+PHYSICIAN_SEARCH_PAGE_SIZE = 20
+PHYSICIAN_SEARCH_MAX_PAGE_SIZE = 100
+
+# Chunked insurance uploads (insurance/uploads/). Chunks wait here until the
+# upload is completed; manage.py purge_upload_sessions clears abandoned ones.
+INSURANCE_UPLOAD_DIR = BASE_DIR / 'insurance_uploads'
+INSURANCE_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+INSURANCE_UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+INSURANCE_UPLOAD_SESSION_TTL_HOURS = 24
+
+# Most files accepted by one insurance/files/batch/ request
+INSURANCE_BATCH_MAX_FILES = 20
+
+# insurance/file/<id>/download/ streams through Django by default. Set to
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile, lighttpd) to
+# have the proxy send the bytes after Django has checked permissions; for nginx,
+# INSURANCE_DOWNLOAD_ACCEL_PREFIX is an `internal` location aliased to the storage root.
+INSURANCE_DOWNLOAD_ACCEL = None
+INSURANCE_DOWNLOAD_ACCEL_PREFIX = '/protected/'
+
+# Post-processing of uploaded files, run by `manage.py process_insurance_files`.
+# Stages run in order; each is a function (file, context) -> dict of metadata.
+INSURANCE_PROCESSING_STAGES = [
+    'insurance.processing.checksum',
+    'insurance.processing.page_count',
+    'insurance.processing.extract_text',
+    'insurance.processing.thumbnail',
+]
+INSURANCE_PROCESSING_LEASE_SECONDS = 600  # a job held longer than this is taken over by another worker
+INSURANCE_PROCESSING_MAX_ATTEMPTS = 3
+INSURANCE_PROCESSING_MAX_TEXT = 1_000_000  # characters of extracted text kept per file
+INSURANCE_THUMBNAIL_SIZE = (320, 320)
+
+# Compression at rest for stored insurance blobs: 'auto' (zstd when the
+# zstandard package is installed, else gzip), 'zstd', 'gzip', or None to store
+# files as uploaded. A file is only kept compressed if that saves at least
+# INSURANCE_STORAGE_MIN_SAVING of its size. manage.py compress_insurance_files
+# compresses blobs stored before this was turned on.
+INSURANCE_STORAGE_COMPRESSION = 'auto'
+INSURANCE_STORAGE_MIN_SAVING = 0.1
+
+# SQL query budgets (backend/query_budget.py). Requests that run more queries than
+# their view's budget, or repeat one statement QUERY_BUDGET_REPEAT_THRESHOLD times
+# (an N+1 loop), fail under `manage.py test` and are logged as warnings otherwise.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+QUERY_BUDGET_ENABLED = True
+QUERY_BUDGET_STRICT = TESTING
+QUERY_BUDGET_REPEAT_THRESHOLD = 5
+QUERY_BUDGET_DEFAULT = 10
+# by URL name, counted on a cold worker (empty caches; backend/tests.py hits every
+# route). Counts include authentication and savepoints. Batch uploads
+# cost the same however many files they carry (see BlobManager.acquire_many).
+QUERY_BUDGETS = {
+    # userauth.urls
+    'userauth.views.getRoutes': 0,
+    'user-register': 3,
+    'token_obtain_pair': 2,
+    'token_refresh': 10,
+    'create_physician_profile': 5,
+    'create_patient_profile': 6,
+    'update_physician_profile': 5,
+    'update_patient_profile': 7,
+    'list_physicians': 2,
+    'search_physicians': 3,
+    'physician_directory_stats': 1,
+    'patient': 3,
+    'physician': 3,
+    'physician-caseload': 2,
+    'physician-patient': 3,
+    'physician-illness': 3,
+    'illness-create': 3,
+    'illness-update': 4,
+    'patient-illness-list': 2,
+    # chat.urls
+    'messages': 5,
+    'create_message': 11,
+    'create_messages_batch': 9,
+    'inbox': 2,
+    'conversation_read': 2,
+    'messages_async': 5,
+    'create_message_async': 9,
+    'search_messages': 4,
+    'recent_cache_stats': 1,
+    # insurance.urls
+    'file-list-create': 11,
+    'file-batch-create': 11,
+    'file-list': 2,
+    'doc-detail': 2,
+    'doc-download': 3,
+    'file-search': 2,
+    'file-delete': 15,
+    'upload-create': 2,
+    'upload-detail': 3,
+    'upload-chunk': 3,
+    'upload-complete': 13,
 }
 
 
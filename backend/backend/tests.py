@@ -0,0 +1,144 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from chat import cache
+from chat.models import ChatMessage, Conversation
+from userauth import authentication, blacklist, directory, search
+from userauth.models import Patient, Physician, User
+from .query_budget import record_queries
+
+
+def reset_process_caches():
+    # what a freshly started worker, after a cache flush, holds: nothing
+    for shared in caches.all():
+        shared.clear()
+    cache._cache = None
+    authentication._cache = None
+    blacklist._filter = None
+    directory._directory = None
+    search._index = None
+
+
+@override_settings(QUERY_BUDGET_STRICT=False)
+class QueryBudgetCoverageTests(TestCase):
+    """Every budgeted route, once, on a cold worker and with real JWT authentication."""
+    databases = {'default', 'chat_archive'}
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        storage = override_settings(MEDIA_ROOT=media_root, INSURANCE_UPLOAD_DIR=f'{media_root}/uploads')
+        storage.enable()
+        self.addCleanup(storage.disable)
+
+        self.physician = Physician.objects.create(
+            user=User.objects.create_user('doctor', password='x', role='physician'), first_name='Ada', last_name='Doc',
+        )
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user('patient', password='x'), physician=self.physician,
+            first_name='Pat', last_name='Ient', age_category='adult',
+        )
+        self.staff = User.objects.create_user('admin', password='x', is_staff=True)
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(user_id=self.patient.user_id, patient=self.patient, physician=self.physician, content=f'message {n}')
+            for n in range(3)
+        ])
+        Conversation.objects.record_messages(messages)
+        self.counts = {}
+
+    def hit(self, name, method, url, data=None, user=None, **kwargs):
+        reset_process_caches()
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        with record_queries() as recorder:
+            response = getattr(client, method)(url, data, **kwargs)
+        self.assertLess(response.status_code, 400, f'{method.upper()} {url}: {getattr(response, "data", response)}')
+        self.assertEqual(recorder.repeated(settings.QUERY_BUDGET_REPEAT_THRESHOLD), [], f'{method.upper()} {url}')
+        self.counts[name] = max(self.counts.get(name, 0), recorder.count)
+        return response
+
+    def test_every_budgeted_route_fits_its_budget_cold(self):
+        patient, physician, doctor = self.patient.user, self.physician.user, self.physician.user_id
+        conversation = f'{self.patient.pk}/{doctor}'
+
+        # userauth
+        self.hit('userauth.views.getRoutes', 'get', '/user/')
+        self.hit('user-register', 'post', '/user/register/', {
+            'username': 'newcomer', 'email': 'new@example.com', 'password': 'long-enough',
+        }, format='json')
+        self.hit('token_obtain_pair', 'post', '/user/token/', {'username': 'patient', 'password': 'x'}, format='json')
+        self.hit('token_refresh', 'post', '/user/token/refresh/', {'refresh': str(RefreshToken.for_user(patient))}, format='json')
+        self.hit('create_physician_profile', 'post', '/user/create-profile/physician/', {
+            'username': 'second-doctor', 'first_name': 'Bo', 'last_name': 'Doc', 'specialisation': 'Cardiology',
+        }, user=User.objects.create_user('unprofiled-doctor', password='x', role='physician'), format='json')
+        self.hit('create_patient_profile', 'post', '/user/create-profile/patient/', {
+            'physician': doctor, 'first_name': 'New', 'last_name': 'Comer', 'age_category': 'adult',
+        }, user=User.objects.get(username='newcomer'), format='json')
+        self.hit('update_physician_profile', 'patch', f'/user/update-profile/physician/{doctor}/',
+                 {'specialisation': 'Oncology'}, user=physician, format='json')
+        self.hit('update_patient_profile', 'patch', f'/user/update-profile/patient/{patient.pk}/',
+                 {'first_name': 'Patty', 'physician': doctor}, user=patient, format='json')
+        self.hit('list_physicians', 'get', '/user/physicians/', user=patient)
+        self.hit('search_physicians', 'get', '/user/physicians/search/?q=ad', user=patient)
+        self.hit('physician_directory_stats', 'get', '/user/physicians/stats/', user=self.staff)
+        self.hit('illness-create', 'post', '/user/create/illness/', {
+            'title': 'Flu', 'description': 'Fever', 'physician': doctor,
+        }, user=patient, format='json')
+        self.hit('illness-update', 'patch', f'/user/update/illness/{patient.pk}/', {'title': 'Cold'}, user=patient, format='json')
+        self.hit('patient', 'get', f'/user/patient/{patient.pk}/', user=patient)
+        self.hit('physician', 'get', f'/user/physician/{doctor}/', user=patient)
+        self.hit('physician-caseload', 'get', f'/user/physician/{doctor}/caseload/', user=physician)
+        self.hit('physician-patient', 'get', f'/user/physician-patient/{doctor}/patients/', user=physician)
+        self.hit('physician-illness', 'get', f'/user/physician-illness/{doctor}/illness/', user=physician)
+        self.hit('patient-illness-list', 'get', f'/user/patients/{patient.pk}/illnesses/', user=patient)
+
+        # chat
+        message = {'patient': self.patient.pk, 'physician': doctor, 'content': 'hello'}
+        self.hit('messages', 'get', f'/chat/chat_messages/{conversation}/', user=patient)
+        self.hit('create_message', 'post', '/chat/chat_messages/create/', message, user=patient, format='json')
+        self.hit('create_messages_batch', 'post', '/chat/chat_messages/batch/', [message, message], user=patient, format='json')
+        self.hit('inbox', 'get', '/chat/inbox/', user=patient)
+        self.hit('conversation_read', 'post', f'/chat/conversations/{conversation}/read/', user=patient)
+        self.hit('messages_async', 'get', f'/chat/async/chat_messages/{conversation}/', user=patient)
+        self.hit('create_message_async', 'post', '/chat/async/chat_messages/create/', message, user=patient, format='json')
+        self.hit('search_messages', 'get', '/chat/search/?q=message', user=patient)
+        self.hit('recent_cache_stats', 'get', '/chat/cache/stats/', user=self.staff)
+
+        # insurance
+        content = b'policy number 42'
+        upload = self.hit('upload-create', 'post', '/insurance/uploads/', {
+            'insurance_company': 'Acme', 'file_name': 'Policy', 'original_name': 'policy.txt',
+            'total_size': len(content), 'chunk_size': len(content),
+        }, user=patient, format='json').data['upload_id']
+        self.hit('upload-chunk', 'put', f'/insurance/uploads/{upload}/chunks/0/', content,
+                 user=patient, content_type='application/octet-stream')
+        self.hit('upload-detail', 'get', f'/insurance/uploads/{upload}/', user=patient)
+        file_id = self.hit('upload-complete', 'post', f'/insurance/uploads/{upload}/complete/', user=patient).data['id']
+        self.hit('file-list-create', 'post', '/insurance/files/create/', {
+            'insurance_company': 'Acme', 'file_name': 'Card', 'file': SimpleUploadedFile('card.txt', b'member card'),
+        }, user=patient)
+        self.hit('file-list-create', 'get', '/insurance/files/create/', user=patient)
+        self.hit('file-batch-create', 'post', '/insurance/files/batch/', {
+            'insurance_company': 'Acme',
+            'files': [SimpleUploadedFile('a.txt', b'first claim'), SimpleUploadedFile('b.txt', b'second claim')],
+        }, user=patient)
+        self.hit('file-list', 'get', f'/insurance/files_list/{patient.pk}/', user=patient)
+        self.hit('doc-detail', 'get', f'/insurance/file/{file_id}/', user=patient)
+        self.hit('doc-download', 'get', f'/insurance/file/{file_id}/download/', user=patient)
+        self.hit('file-search', 'get', '/insurance/files/search/?q=policy', user=patient)
+        self.hit('file-delete', 'delete', f'/insurance/file/delete/{file_id}/', user=patient)
+
+        self.assertEqual(set(self.counts), set(settings.QUERY_BUDGETS), 'a budgeted route is not exercised here')
+        over = {
+            name: f'{count} queries, budget is {settings.QUERY_BUDGETS[name]}'
+            for name, count in self.counts.items() if count > settings.QUERY_BUDGETS[name]
+        }
+        self.assertEqual(over, {})
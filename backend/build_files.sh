@@ -5,4 +5,5 @@ python3 -m pip install -r requirements.txt
 # python3 manage.py tailwind build
 python3 manage.py makemigrations 
 python3 manage.py migrate
+python3 manage.py migrate --database=chat_archive
 python3  manage.py collectstatic --noinput
\ No newline at end of file
@@ -0,0 +1,68 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from userauth.models import User
+
+from .models import ArchivedChatMessage, ChatMessage, Conversation
+
+
+def archive_before(cutoff, batch_size=1000):
+    """
+    Move messages created before `cutoff` from the hot table to the archive
+    database, oldest first, one batch at a time. Yields the size of each batch.
+
+    Rows are copied before they are deleted, and copies are idempotent, so an
+    interrupted run can simply be started again.
+    """
+    archive_db = settings.CHAT_ARCHIVE_DATABASE
+    while True:
+        batch = list(
+            ChatMessage.objects.filter(created_at__lt=cutoff).order_by('id')[:batch_size]
+        )
+        if not batch:
+            return
+
+        with transaction.atomic(using=archive_db):
+            ArchivedChatMessage.objects.using(archive_db).bulk_create(
+                [ArchivedChatMessage.from_chat_message(m) for m in batch],
+                ignore_conflicts=True,
+            )
+
+        moved = Counter((m.patient_id, m.physician_id) for m in batch)
+        with transaction.atomic():
+            ChatMessage.objects.filter(id__in=[m.id for m in batch]).delete()
+            for (patient_id, physician_id), count in moved.items():
+                Conversation.objects.filter(patient_id=patient_id, physician_id=physician_id).update(
+                    archived_count=F('archived_count') + count,
+                )
+        yield len(batch)
+
+
+def archived_conversation(patient_id, physician_id):
+    return ArchivedChatMessage.objects.filter(patient_id=patient_id, physician_id=physician_id)
+
+
+def as_message_rows(archived_queryset):
+    """Archive rows in the shape of chat.serializers.message_rows, authors fetched in one query."""
+    archived_rows = list(archived_queryset.values(
+        'id', 'patient_id', 'physician_id', 'content', 'created_at', 'modified_at', 'user_id',
+    ))
+    users = {
+        user['id']: user
+        for user in User.objects.filter(id__in={row['user_id'] for row in archived_rows}).values(
+            'id', 'username', 'email', 'role',
+        )
+    }
+    for row in archived_rows:
+        user = users.get(row['user_id'])
+        if user is None:
+            # author account is gone
+            row['user_id'] = None
+            continue
+        row['user__username'] = user['username']
+        row['user__email'] = user['email']
+        row['user__role'] = user['role']
+    return archived_rows
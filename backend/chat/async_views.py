@@ -0,0 +1,116 @@
+"""
+Native async versions of the chat list and create endpoints.
+
+DRF's @api_view only runs synchronously, so under ASGI every request of
+chat.views holds a worker thread while it waits on the database. These are
+plain Django async views: authentication and reads go through the async
+ORM, and only the transactional write (Django transactions are not
+async-aware yet) is handed to a thread.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+
+from userauth.models import Patient, Physician
+from .archive import archived_conversation, as_message_rows
+from .authentication import AsyncJWTAuthentication
+from .models import ChatMessage, Conversation
+from .pagination import ConversationWindow, InvalidPageRequest
+from .serializers import ChatMessageSerializer, ChatMessageBatchItemSerializer, message_rows, serialize_message_row
+from .views import EMPTY_MARK, announce_messages, conversation_etag, etag_matches
+
+
+async def _authenticate(request):
+    try:
+        result = await AsyncJWTAuthentication().aauthenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+    return result[0] if result else None
+
+
+def _unauthorized():
+    return JsonResponse(
+        {'detail': 'Authentication credentials were not provided or are invalid.'},
+        status = status.HTTP_401_UNAUTHORIZED,
+        headers = {'WWW-Authenticate': 'Bearer realm="api"'},
+    )
+
+
+@require_GET
+async def get_chat_messages(request, patient_id, physician_id):
+    if await _authenticate(request) is None:
+        return _unauthorized()
+
+    try:
+        window = ConversationWindow.from_params(request.GET)
+    except InvalidPageRequest as e:
+        return JsonResponse({'detail': str(e)}, status = status.HTTP_400_BAD_REQUEST)
+
+    conversation = ChatMessage.objects.filter(patient = patient_id, physician = physician_id)
+    high_water_mark = await Conversation.objects.high_water_mark(patient_id, physician_id).afirst() or EMPTY_MARK
+    etag = conversation_etag(patient_id, physician_id, high_water_mark)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(request, etag):
+        return HttpResponse(status = status.HTTP_304_NOT_MODIFIED, headers = headers)
+
+    chat_messages = [row async for row in message_rows(window.apply(conversation))]
+
+    if window.runs_past_end(chat_messages) and high_water_mark['archived_count'] > 0:
+        older = await sync_to_async(as_message_rows)(window.apply(archived_conversation(patient_id, physician_id)))
+        chat_messages = window.merge_older(chat_messages, older)
+
+    chat_messages, before, after = window.page(chat_messages)
+    return JsonResponse({
+        'results': [serialize_message_row(row) for row in chat_messages],
+        'before': before,
+        'after': after,
+    }, headers = headers)
+
+
+def _save_message(user, data):
+    with transaction.atomic():
+        chat_message = ChatMessage.objects.create(user = user, **data)
+        Conversation.objects.record_messages([chat_message])
+    announce_messages([chat_message])
+    return ChatMessageSerializer(chat_message).data
+
+
+@csrf_exempt
+@require_POST
+async def create_chat_message(request):
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'Malformed JSON.'}, status = status.HTTP_400_BAD_REQUEST)
+
+    serializer = ChatMessageBatchItemSerializer(data = body)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status = status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+
+    errors = {}
+    does_not_exist = PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+    if not await Patient.objects.filter(pk = data['patient']).aexists():
+        errors['patient'] = [does_not_exist.format(pk_value = data['patient'])]
+    if not await Physician.objects.filter(pk = data['physician']).aexists():
+        errors['physician'] = [does_not_exist.format(pk_value = data['physician'])]
+    if errors:
+        return JsonResponse(errors, status = status.HTTP_400_BAD_REQUEST)
+
+    payload = await sync_to_async(_save_message)(user, {
+        'patient_id': data['patient'],
+        'physician_id': data['physician'],
+        'content': data['content'],
+    })
+    return JsonResponse(payload, status = status.HTTP_201_CREATED)
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class RecentMessageCache:
+    """
+    The newest rows of recently read conversations, as chat.serializers.message_rows dicts.
+
+    Every entry carries the conversation's high-water mark (newest message id,
+    archived count, from Conversation.objects.high_water_mark), the same probe
+    that builds the list endpoint's ETag. A lookup only hits when the mark
+    still matches, so a tail written to by another worker process just misses
+    and gets refilled.
+
+    New messages are appended after their transaction commits, under the lock
+    that guards the entries. A reader may have refilled the tail in between,
+    with the new rows in it already, so rows the tail holds are skipped, and
+    the rest are merged in (created_at, id) order.
+
+    Entries live in an in-process LRU, or in a Django cache backend when
+    CHAT_RECENT_CACHE['alias'] names one shared between workers. Nothing
+    locks an entry across processes, so with a shared backend an append
+    drops the entry instead of extending it; the next read refills it.
+    """
+
+    def __init__(self, max_conversations=1000, tail_size=200, alias=None):
+        self.max_conversations = max_conversations
+        self.tail_size = tail_size
+        self.backend = caches[alias] if alias else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(patient_id, physician_id):
+        return f"chat:tail:{patient_id}:{physician_id}"
+
+    def _load(self, key):
+        if self.backend is not None:
+            return self.backend.get(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        if self.backend is not None:
+            self.backend.set(key, entry)
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def rows_for(self, patient_id, physician_id, high_water_mark, window):
+        """Rows answering `window` (see ConversationWindow.from_tail), or None on a miss."""
+        entry = self._load(self.key(patient_id, physician_id))
+        rows = None
+        if entry is not None and entry['mark'] == (high_water_mark['last_message_id'], high_water_mark['archived_count']):
+            rows = window.from_tail(entry['rows'], entry['complete'])
+        if rows is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return rows
+
+    def put(self, patient_id, physician_id, high_water_mark, rows, complete):
+        """Store a freshly read tail; `complete` means it holds the whole hot conversation."""
+        rows = list(rows)
+        self._store(self.key(patient_id, physician_id), {
+            'mark': (high_water_mark['last_message_id'], high_water_mark['archived_count']),
+            'rows': rows[-self.tail_size:],
+            'complete': complete and len(rows) <= self.tail_size,
+        })
+
+    def append(self, patient_id, physician_id, new_rows):
+        """Write-through for new messages; only extends tails that are already cached."""
+        key = self.key(patient_id, physician_id)
+        if self.backend is not None:
+            self.backend.delete(key)
+            return
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            cached = {row['id'] for row in entry['rows']}
+            added = [row for row in new_rows if row['id'] not in cached]
+            if not added:
+                return
+            rows = sorted([*entry['rows'], *added], key=lambda row: (row['created_at'], row['id']))
+            last_id, archived_count = entry['mark']
+            self._entries[key] = {
+                'mark': (max([last_id or 0, *(row['id'] for row in added)]), archived_count),
+                'rows': rows[-self.tail_size:],
+                'complete': entry['complete'] and len(rows) <= self.tail_size,
+            }
+            self._entries.move_to_end(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'conversations': len(self._entries) if self.backend is None else None,
+            'max_conversations': self.max_conversations,
+            'tail_size': self.tail_size,
+            'backend': 'shared' if self.backend is not None else 'local',
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_recent_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RecentMessageCache(**getattr(settings, 'CHAT_RECENT_CACHE', {}))
+    return _cache
@@ -0,0 +1,96 @@
+import asyncio
+import re
+from urllib.parse import parse_qs
+
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import AsyncJWTAuthentication
+from .pubsub import conversation_channel, get_broker
+
+
+# ws://host/ws/chat/<patient_id>/<physician_id>/?token=<access token>
+CHAT_SOCKET_PATH = re.compile(r'^/ws/chat/(?P<patient_id>\d+)/(?P<physician_id>\d+)/$')
+
+# Application close codes (4000-4999 are free for application use)
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+
+
+async def _authenticate(raw_token):
+    try:
+        authenticator = AsyncJWTAuthentication()
+        validated_token = authenticator.get_validated_token(raw_token)
+        return await authenticator.aget_user(validated_token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+def _token_from_scope(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    token = query.get('token', [None])[0]
+    if token:
+        return token
+
+    # Non-browser clients can send the usual Authorization header instead.
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0] == 'Bearer':
+                return parts[1]
+    return None
+
+
+async def chat_socket(scope, receive, send):
+    """
+    Push new chat messages of one patient/physician conversation to the client.
+
+    The socket is receive-only for the client: messages are still created
+    through the REST endpoint, which publishes them here once saved.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    match = CHAT_SOCKET_PATH.match(scope['path'])
+    if not match:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    patient_id = int(match['patient_id'])
+    physician_id = int(match['physician_id'])
+
+    raw_token = _token_from_scope(scope)
+    user = await _authenticate(raw_token) if raw_token else None
+    if user is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    # Only the two participants may listen to a conversation.
+    if user.id not in (patient_id, physician_id):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    subscription = get_broker().subscribe(conversation_channel(patient_id, physician_id))
+    await send({'type': 'websocket.accept'})
+
+    async def pump():
+        while True:
+            payload = await subscription.get()
+            await send({'type': 'websocket.send', 'text': payload})
+
+    async def wait_for_disconnect():
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                return
+
+    pump_task = asyncio.ensure_future(pump())
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait([pump_task, disconnect_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        subscription.close()
+        for task in (pump_task, disconnect_task):
+            task.cancel()
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_before
+from chat.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = "Move chat messages older than the retention window into the chat_archive database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help="Archive messages created more than this many days ago.",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many messages would move.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+
+        if options['dry_run']:
+            count = ChatMessage.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f"{count} messages created before {cutoff:%Y-%m-%d} would be archived.")
+            return
+
+        total = 0
+        for moved in archive_before(cutoff, batch_size=options['batch_size']):
+            total += moved
+            self.stdout.write(f"Archived {total} messages...")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} messages created before {cutoff:%Y-%m-%d}."))
@@ -0,0 +1,207 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat import views
+from chat.models import ChatMessage, Conversation
+from chat.pagination import get_page_size
+from chat.search import search_messages
+from chat.serializers import ChatMessageSerializer
+from userauth.models import Patient
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the chat endpoints against this database and count their queries. "
+        "Everything written runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50,100', help="Comma-separated batch sizes.")
+        parser.add_argument('--limits', default='10,50,100', help="Comma-separated history page sizes.")
+        parser.add_argument('--history', type=int, default=1000, help="Messages to add to the conversation first.")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=1000, help="Concurrent reads per history view.")
+        parser.add_argument(
+            '--search', type=int, metavar='N',
+            help="Instead, add N messages to the conversation and time search_messages over them.",
+        )
+
+    def handle(self, *args, **options):
+        patient = Patient.objects.select_related('user').first()
+        if patient is None:
+            raise CommandError("Needs at least one patient with a physician.")
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        limits = [int(limit) for limit in options['limits'].split(',')]
+
+        try:
+            with transaction.atomic():
+                if options['search'] is not None:
+                    self.search(patient, options['search'], options['repeat'])
+                else:
+                    self.batch(patient, sizes, options['repeat'])
+                    self.history(patient, options['history'], limits, options['repeat'])
+                    self.concurrent_history(patient, options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def batch(self, patient, sizes, repeat):
+        # chat_messages/batch/ against the same number of single creates
+        factory = APIRequestFactory()
+        self.stdout.write(f"{'messages':>9}{'batch ms':>11}{'queries':>9}{'singles ms':>12}{'queries':>9}")
+        for size in sizes:
+            items = [
+                {'patient': patient.pk, 'physician': patient.physician_id, 'content': f'benchmark {number}'}
+                for number in range(size)
+            ]
+            batch_ms, batch_queries = self.measure(repeat, lambda: self.call(
+                views.create_chat_messages_batch, factory.post('/', items, format='json'), patient.user,
+            ))
+            single_ms, single_queries = self.measure(repeat, lambda: [
+                self.call(views.create_chat_message, factory.post('/', item, format='json'), patient.user)
+                for item in items
+            ])
+            self.stdout.write(f"{size:>9}{batch_ms:>11.2f}{batch_queries:>9}{single_ms:>12.2f}{single_queries:>9}")
+
+    def history(self, patient, count, limits, repeat):
+        # chat_messages/<patient>/<physician>/: newest page (recent cache) and one page back (table)
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(user_id=patient.user_id, patient=patient, physician_id=patient.physician_id, content=f'history {number}')
+            for number in range(count)
+        ])
+        Conversation.objects.record_messages(messages)
+
+        factory = APIRequestFactory()
+        url = f'/chat/chat_messages/{patient.pk}/{patient.physician_id}/'
+        args = (patient.pk, patient.physician_id)
+        # "serializer ms": the same page through ChatMessageSerializer, the listing before message_rows
+        self.stdout.write(
+            f"\n{'page':>9}{'newest ms':>11}{'queries':>9}{'serializer ms':>15}"
+            f"{'older ms':>12}{'queries':>9}{'serializer ms':>15}"
+        )
+        for limit in limits:
+            newest = self.call(views.get_chat_messages, factory.get(url, {'limit': limit}), patient.user, *args)
+            older = self.call(
+                views.get_chat_messages, factory.get(url, {'limit': limit, 'before': newest.data['before']}),
+                patient.user, *args,
+            )
+            newest_ms, newest_queries = self.measure(repeat, lambda: self.call(
+                views.get_chat_messages, factory.get(url, {'limit': limit}), patient.user, *args,
+            ))
+            older_ms, older_queries = self.measure(repeat, lambda: self.call(
+                views.get_chat_messages, factory.get(url, {'limit': limit, 'before': newest.data['before']}),
+                patient.user, *args,
+            ))
+            newest_serializer_ms, _ = self.measure(repeat, lambda: self.serialize(newest))
+            older_serializer_ms, _ = self.measure(repeat, lambda: self.serialize(older))
+            self.stdout.write(
+                f"{limit:>9}{newest_ms:>11.2f}{newest_queries:>9}{newest_serializer_ms:>15.2f}"
+                f"{older_ms:>12.2f}{older_queries:>9}{older_serializer_ms:>15.2f}"
+            )
+
+    @staticmethod
+    def serialize(page):
+        ids = [message['id'] for message in page.data['results']]
+        queryset = ChatMessage.objects.filter(pk__in=ids).order_by('created_at', 'id')
+        return ChatMessageSerializer(queryset.select_related('user'), many=True).data
+
+    def concurrent_history(self, patient, requests):
+        # the newest page, `requests` reads in flight at once through backend.asgi: the sync
+        # view runs them one by one in the ASGI handler's thread, the async view interleaves
+        conversation = f'{patient.pk}/{patient.physician_id}/'
+        authorization = f'Bearer {AccessToken.for_user(patient.user)}'.encode()
+        self.stdout.write(f"\n{'view':>9}{'requests':>10}{'seconds':>10}{'req/s':>10}")
+        for name, path in (
+            ('sync', f'/chat/chat_messages/{conversation}'),
+            ('async', f'/chat/async/chat_messages/{conversation}'),
+        ):
+            seconds = async_to_sync(self.gather)(path, authorization, requests)
+            self.stdout.write(f"{name:>9}{requests:>10}{seconds:>10.2f}{requests / seconds:>10.0f}")
+
+    @staticmethod
+    async def gather(path, authorization, requests):
+        from backend.asgi import application
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': 'GET', 'path': path, 'raw_path': path.encode(), 'query_string': b'limit=50', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'authorization', authorization)],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+
+        async def get():
+            events = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            statuses = []
+
+            async def receive():
+                if events:
+                    return events.pop()
+                # the client never hangs up; the handler stops listening once it has answered
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            await application(scope, receive, send)
+            if statuses != [200]:
+                raise CommandError(f"{path} answered {statuses}")
+
+        # as Django's test client does: the connection holds the rolled-back transaction
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(get() for _ in range(requests)))
+            return time.perf_counter() - started
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    def search(self, patient, count, repeat):
+        # search/: one page of ranked hits, from terms in every message down to none
+        words = ['appointment', 'prescription', 'headache', 'insurance', 'results', 'fever', 'allergy', 'dosage']
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(
+                user_id=patient.user_id, patient=patient, physician_id=patient.physician_id,
+                content=f"message about {words[number % len(words)]}{' refill' if number % 100 == 0 else ''} {number}",
+            )
+            for number in range(count)
+        ], batch_size=1000)
+        Conversation.objects.record_messages(messages)
+
+        limit = get_page_size(None)
+        self.stdout.write(f"{'query':>16}{'hits':>7}{'ms':>9}{'queries':>9}")
+        for query in ('message', 'headache', 'refill', 'presc', 'fever message', 'nothing'):
+            hits = len(search_messages(patient.user_id, query, limit))
+            search_ms, search_queries = self.measure(repeat, lambda: search_messages(patient.user_id, query, limit))
+            self.stdout.write(f"{query:>16}{hits:>7}{search_ms:>9.2f}{search_queries:>9}")
+
+    @staticmethod
+    def call(view, request, user, *args):
+        force_authenticate(request, user=user)
+        response = view(request, *args)
+        if response.status_code >= 300:
+            raise CommandError(f"{view.__name__} answered {response.status_code}: {response.data}")
+        return response
+
+    @staticmethod
+    def measure(repeat, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        return (time.perf_counter() - started) / repeat * 1000, len(queries)
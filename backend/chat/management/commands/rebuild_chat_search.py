@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from chat.search import ARCHIVE_TABLE, install_search_index
+
+
+class Command(BaseCommand):
+    help = "Recreate the chat full-text indexes and their triggers, then reindex every message, hot and archived."
+
+    def handle(self, *args, **options):
+        archive = connections[settings.CHAT_ARCHIVE_DATABASE]
+        if connection.vendor != 'sqlite' or archive.vendor != 'sqlite':
+            raise CommandError("Chat search uses SQLite FTS5 and needs a SQLite database.")
+
+        install_search_index(connection, rebuild=True)
+        install_search_index(archive, rebuild=True, table=ARCHIVE_TABLE)
+        self.stdout.write(self.style.SUCCESS("Chat search indexes rebuilt."))
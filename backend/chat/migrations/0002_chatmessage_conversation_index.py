@@ -0,0 +1,20 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        ('userauth', '0004_patientillness_physician'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['patient', 'physician', 'created_at'], name='chat_conversation_idx'),
+        ),
+    ]
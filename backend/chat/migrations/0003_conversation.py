@@ -0,0 +1,51 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    # Summaries for threads that predate the table; history counts as read.
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    Conversation = apps.get_model('chat', 'Conversation')
+    pairs = ChatMessage.objects.order_by().values_list('patient_id', 'physician_id').distinct()
+    for patient_id, physician_id in pairs.iterator():
+        last = ChatMessage.objects.filter(
+            patient_id=patient_id, physician_id=physician_id,
+        ).order_by('-created_at', '-id').first()
+        Conversation.objects.create(
+            patient_id=patient_id,
+            physician_id=physician_id,
+            last_message=last,
+            last_message_preview=last.content[:120],
+            last_activity_at=last.created_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage_conversation_index'),
+        ('userauth', '0004_patientillness_physician'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_preview', models.CharField(blank=True, max_length=120)),
+                ('last_activity_at', models.DateTimeField()),
+                ('patient_unread', models.PositiveIntegerField(default=0)),
+                ('physician_unread', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.chatmessage')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='userauth.patient')),
+                ('physician', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='userauth.physician')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['physician', 'last_activity_at'], name='chat_inbox_physician_idx'), models.Index(fields=['patient', 'last_activity_at'], name='chat_inbox_patient_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'physician'), name='chat_conversation_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from chat.search import ARCHIVE_TABLE, install_search_index
+    install_search_index(schema_editor.connection, table=ARCHIVE_TABLE)
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from chat.search import ARCHIVE_TABLE, drop_search_index
+    drop_search_index(schema_editor.connection, table=ARCHIVE_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chat_archive'),
+    ]
+
+    operations = [
+        # the model_name hint sends this to the archive database (chat.routers)
+        migrations.RunPython(install, uninstall, hints={'model_name': 'archivedchatmessage'}),
+    ]
@@ -1,4 +1,8 @@
+import operator
+from functools import reduce
+
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
 
 # Create your models here.
 from userauth.models import Patient, User, Physician
@@ -14,4 +18,157 @@ class ChatMessage(models.Model):
     
     class Meta:
         ordering = ['-modified_at']
-    
\ No newline at end of file
+        indexes = [
+            # conversation history is always read as a (created_at, id) range;
+            # SQLite appends the rowid to every index entry, covering the id tiebreak
+            models.Index(fields=['patient', 'physician', 'created_at'], name='chat_conversation_idx'),
+        ]
+
+
+PREVIEW_LENGTH = 120
+
+
+class ConversationManager(models.Manager):
+    def record_messages(self, chat_messages):
+        """
+        Fold freshly created messages into their conversation summaries, in two
+        queries however many conversations they span: one insert of the missing
+        summary rows, one update of them all.
+        """
+        by_conversation = {}
+        for chat_message in chat_messages:
+            key = (chat_message.patient_id, chat_message.physician_id)
+            by_conversation.setdefault(key, []).append(chat_message)
+        if not by_conversation:
+            return
+
+        latest = {key: max(batch, key=lambda m: (m.created_at, m.id)) for key, batch in by_conversation.items()}
+        # a summary created concurrently by another write is left alone, then updated below
+        self.bulk_create([
+            Conversation(patient_id=patient_id, physician_id=physician_id, last_activity_at=last.created_at)
+            for (patient_id, physician_id), last in latest.items()
+        ], ignore_conflicts=True)
+
+        pairs = {key: Q(patient_id=key[0], physician_id=key[1]) for key in by_conversation}
+
+        def per_conversation(field, value, output_field):
+            # Never move the summary backwards if a concurrent write got there first
+            return Case(
+                *(
+                    When(
+                        pair & (Q(last_message__isnull=True) | Q(last_activity_at__lte=latest[key].created_at)),
+                        then=Value(value(latest[key])),
+                    )
+                    for key, pair in pairs.items()
+                ),
+                default=F(field),
+                output_field=output_field,
+            )
+
+        def unread(field, side):
+            # each side has unread whatever the other side wrote
+            return Case(
+                *(
+                    When(pair, then=F(field) + sum(1 for m in by_conversation[key] if m.user_id != key[side]))
+                    for key, pair in pairs.items()
+                ),
+                default=F(field),
+                output_field=models.PositiveIntegerField(),
+            )
+
+        self.filter(reduce(operator.or_, pairs.values())).update(
+            last_message_id=per_conversation('last_message_id', lambda m: m.id, models.BigIntegerField()),
+            last_message_preview=per_conversation(
+                'last_message_preview', lambda m: m.content[:PREVIEW_LENGTH], models.CharField(),
+            ),
+            last_activity_at=per_conversation('last_activity_at', lambda m: m.created_at, models.DateTimeField()),
+            patient_unread=unread('patient_unread', 0),
+            physician_unread=unread('physician_unread', 1),
+        )
+
+    def high_water_mark(self, patient_id, physician_id):
+        """
+        The state of a conversation's history, as a values() query: its newest
+        message and how many messages were archived. Every write path moves one
+        of them (record_messages(), chat.archive.archive_before()), so it is a
+        complete validator for the list endpoint, read with one unique-index
+        lookup however long the thread. .first() is None before the first message.
+        """
+        return self.filter(patient_id=patient_id, physician_id=physician_id).values('last_message_id', 'archived_count')
+
+    def mark_read(self, patient_id, physician_id, user):
+        conversations = self.filter(patient_id=patient_id, physician_id=physician_id)
+        if user.id == patient_id:
+            return conversations.update(patient_unread=0)
+        if user.id == physician_id:
+            return conversations.update(physician_unread=0)
+        return 0
+
+
+# Denormalized inbox row per (patient, physician), kept current on every message write
+class Conversation(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="conversations")
+    physician = models.ForeignKey(Physician, on_delete=models.CASCADE, related_name="conversations")
+    last_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_activity_at = models.DateTimeField()
+    patient_unread = models.PositiveIntegerField(default=0)
+    physician_unread = models.PositiveIntegerField(default=0)
+    # messages moved to the cold tier; the read path only looks there when > 0
+    archived_count = models.PositiveIntegerField(default=0)
+
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'physician'], name='chat_conversation_unique'),
+        ]
+        indexes = [
+            # inbox listings, newest activity first
+            models.Index(fields=['physician', 'last_activity_at'], name='chat_inbox_physician_idx'),
+            models.Index(fields=['patient', 'last_activity_at'], name='chat_inbox_patient_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient} <-> {self.physician}"
+
+
+# Cold tier: messages older than CHAT_ARCHIVE_AFTER_DAYS, kept in the chat_archive
+# database (see chat.routers). Plain id columns, foreign keys cannot cross databases.
+class ArchivedChatMessage(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user_id = models.BigIntegerField()
+    patient_id = models.BigIntegerField()
+    physician_id = models.BigIntegerField()
+    content = models.TextField(max_length=500)
+    created_at = models.DateTimeField()
+    modified_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient_id', 'physician_id', 'created_at'], name='chat_archive_conversation_idx'),
+        ]
+
+    @classmethod
+    def from_chat_message(cls, chat_message):
+        return cls(
+            id=chat_message.id,
+            user_id=chat_message.user_id,
+            patient_id=chat_message.patient_id,
+            physician_id=chat_message.physician_id,
+            content=chat_message.content,
+            created_at=chat_message.created_at,
+            modified_at=chat_message.modified_at,
+        )
+
+    def to_chat_message(self):
+        return ChatMessage(
+            id=self.id,
+            user_id=self.user_id,
+            patient_id=self.patient_id,
+            physician_id=self.physician_id,
+            content=self.content,
+            created_at=self.created_at,
+            modified_at=self.modified_at,
+        )
@@ -0,0 +1,194 @@
+import base64
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+# Cursors are opaque to clients: "<created_at iso>|<id>" in urlsafe base64.
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidPageRequest("Invalid cursor.")
+    if created_at is None:
+        raise InvalidPageRequest("Invalid cursor.")
+    return created_at, pk
+
+
+def get_page_size(value):
+    if value in (None, ''):
+        return settings.CHAT_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise InvalidPageRequest("limit must be an integer.")
+    if size < 1:
+        raise InvalidPageRequest("limit must be positive.")
+    return min(size, settings.CHAT_MAX_PAGE_SIZE)
+
+
+class ConversationWindow:
+    """
+    One page of a conversation, walked with keyset pagination on (created_at, id).
+
+    `before` pages backwards into history, `after` fetches what came later;
+    with neither, the newest page is returned. Every mode is a range scan on
+    the (patient, physician, created_at) index, so the cost does not grow with
+    the length of the thread. Rows are the dicts produced by
+    chat.serializers.message_rows.
+
+    `since_id` / `since_ts` are the delta-sync forms of `after` for clients
+    that remember the last message id or sync time rather than a cursor.
+    """
+
+    def __init__(self, before=None, after=None, since_id=None, since_ts=None, limit=None):
+        if sum(1 for value in (before, after, since_id, since_ts) if value) > 1:
+            raise InvalidPageRequest("Use only one of before, after, since_id and since_ts.")
+        self.before = decode_cursor(before) if before else None
+        self.after = decode_cursor(after) if after else None
+        self.after_raw = after
+        self.since_id = None
+        self.since_ts = None
+        if since_id:
+            try:
+                self.since_id = int(since_id)
+            except (TypeError, ValueError):
+                raise InvalidPageRequest("since_id must be an integer.")
+        if since_ts:
+            self.since_ts = parse_datetime(since_ts)
+            if self.since_ts is None:
+                raise InvalidPageRequest("since_ts must be an ISO 8601 datetime.")
+            if timezone.is_naive(self.since_ts):
+                self.since_ts = timezone.make_aware(self.since_ts, datetime.timezone.utc)
+        self.limit = get_page_size(limit)
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(
+            before=params.get('before'),
+            after=params.get('after'),
+            since_id=params.get('since_id'),
+            since_ts=params.get('since_ts'),
+            limit=params.get('limit'),
+        )
+
+    @property
+    def is_newest_page(self):
+        return self.newest_first and self.before is None
+
+    @property
+    def newest_first(self):
+        return self.after is None and self.since_id is None and self.since_ts is None
+
+    def apply(self, queryset):
+        # One extra row tells whether there is more beyond this page.
+        if self.since_id is not None:
+            return queryset.filter(id__gt=self.since_id).order_by('created_at', 'id')[:self.limit + 1]
+
+        if self.since_ts is not None:
+            return queryset.filter(created_at__gt=self.since_ts).order_by('created_at', 'id')[:self.limit + 1]
+
+        if self.after is not None:
+            created_at, pk = self.after
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            return queryset.order_by('created_at', 'id')[:self.limit + 1]
+
+        if self.before is not None:
+            created_at, pk = self.before
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return queryset.order_by('-created_at', '-id')[:self.limit + 1]
+
+    def from_tail(self, tail, complete):
+        """
+        Answer from a cached tail of the conversation (oldest first), returning
+        rows the way apply() would, or None if the window reaches past the tail.
+        """
+        if self.before is not None:
+            return None
+
+        covered = complete or not tail
+        if self.newest_first:
+            if covered or len(tail) > self.limit:
+                return tail[::-1][:self.limit + 1]
+            return None
+
+        if self.since_id is not None:
+            covered = covered or tail[0]['id'] <= self.since_id
+            rows = [row for row in tail if row['id'] > self.since_id]
+        elif self.since_ts is not None:
+            covered = covered or tail[0]['created_at'] <= self.since_ts
+            rows = [row for row in tail if row['created_at'] > self.since_ts]
+        else:
+            covered = covered or (tail[0]['created_at'], tail[0]['id']) <= self.after
+            rows = [row for row in tail if (row['created_at'], row['id']) > self.after]
+        return rows[:self.limit + 1] if covered else None
+
+    def runs_past_end(self, rows):
+        """True when a newest-first page ran out of rows, so older ones may live in the archive."""
+        return self.newest_first and len(rows) <= self.limit
+
+    def merge_older(self, rows, older_rows):
+        rows = sorted([*rows, *older_rows], key=lambda row: (row['created_at'], row['id']), reverse=True)
+        return rows[:self.limit + 1]
+
+    def page(self, rows):
+        """Trim the extra row and return (rows oldest first, before cursor, after cursor)."""
+        rows = list(rows)
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+
+        if self.newest_first:
+            rows.reverse()
+            has_older = has_more
+        else:
+            has_older = True
+
+        before = encode_cursor(rows[0]['created_at'], rows[0]['id']) if rows and has_older else None
+        if rows:
+            after = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        else:
+            # Nothing new yet: hand the same cursor back so clients can keep polling.
+            after = self.after_raw
+        return rows, before, after
+
+
+class InboxWindow:
+    """Conversations by most recent activity, keyset-paginated on (last_activity_at, id)."""
+
+    def __init__(self, before=None, limit=None):
+        self.before = decode_cursor(before) if before else None
+        self.limit = get_page_size(limit)
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(before=params.get('before'), limit=params.get('limit'))
+
+    def apply(self, queryset):
+        if self.before is not None:
+            last_activity_at, pk = self.before
+            queryset = queryset.filter(
+                Q(last_activity_at__lt=last_activity_at) | Q(last_activity_at=last_activity_at, id__lt=pk)
+            )
+        return queryset.order_by('-last_activity_at', '-id')[:self.limit + 1]
+
+    def page(self, rows):
+        rows = list(rows)
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        before = encode_cursor(rows[-1].last_activity_at, rows[-1].id) if has_more else None
+        return rows, before
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_channel(patient_id, physician_id):
+    return f"chat.{patient_id}.{physician_id}"
+
+
+class Subscription:
+    """A single subscriber's mailbox, bound to the event loop that created it."""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, message):
+        # Called from any thread; the queue itself is only touched on its own loop.
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow consumer: drop rather than grow without bound.
+            logger.warning("Dropping chat message for slow subscriber on %s", self.channel)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Fan-out of chat events to subscribers living in this process.
+
+    Only works when every web worker shares one process; swap
+    CHAT_PUBSUB_BACKEND for a shared broker when running several.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.deliver(message)
+            except RuntimeError:
+                # The subscriber's loop has already shut down.
+                self.unsubscribe(subscription)
+        return len(subscribers)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = import_string(getattr(settings, 'CHAT_PUBSUB_BACKEND', 'chat.pubsub.InProcessBroker'))
+                _broker = backend(**getattr(settings, 'CHAT_PUBSUB_OPTIONS', {}))
+    return _broker
+
+
+def publish_chat_message(data):
+    """Send a serialized ChatMessage to everyone watching its conversation."""
+    payload = json.dumps({'type': 'chat.message', 'data': data}, cls=DjangoJSONEncoder)
+    return get_broker().publish(conversation_channel(data['patient'], data['physician']), payload)
@@ -0,0 +1,23 @@
+from django.conf import settings
+
+
+def _is_archive(app_label, model_name):
+    return app_label == 'chat' and model_name == 'archivedchatmessage'
+
+
+class ChatArchiveRouter:
+    """Send the chat cold tier to its own database and keep everything else out of it."""
+
+    def db_for_read(self, model, **hints):
+        if _is_archive(model._meta.app_label, model._meta.model_name):
+            return settings.CHAT_ARCHIVE_DATABASE
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.CHAT_ARCHIVE_DATABASE:
+            return _is_archive(app_label, model_name)
+        if _is_archive(app_label, model_name):
+            return False
+        return None
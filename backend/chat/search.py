@@ -0,0 +1,177 @@
+"""
+Full-text search over chat history with SQLite FTS5.
+
+chat_chatmessage_fts is an external-content index over the
+chat_chatmessage_search view, so message text is not stored twice. Besides
+the text it indexes a `participants` column ("u<patient_id> u<physician_id>")
+so scoping a search to the caller's conversations happens inside the index
+instead of filtering every hit afterwards. Triggers keep it in sync on insert,
+update and delete.
+
+Messages moved to the cold tier (chat.archive) leave that index with their
+hot row; the archive database has the same index over
+chat_archivedchatmessage, and search_messages queries it too for users with
+archived conversations.
+
+Django rebuilds a SQLite table (dropping its triggers) when a migration alters
+it; run `manage.py rebuild_chat_search` after such a migration.
+"""
+import datetime
+import html
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+MESSAGE_TABLE = 'chat_chatmessage'
+ARCHIVE_TABLE = 'chat_archivedchatmessage'
+
+# every statement below is formatted with the message table it indexes
+SOURCE_VIEW_SQL = """
+CREATE VIEW IF NOT EXISTS {table}_search AS
+SELECT id, content, 'u' || patient_id || ' u' || physician_id AS participants
+FROM {table}
+"""
+
+INDEX_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+    content, participants,
+    content='{table}_search', content_rowid='id',
+    tokenize='porter unicode61'
+)
+"""
+
+TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts(rowid, content, participants)
+        VALUES (new.id, new.content, 'u' || new.patient_id || ' u' || new.physician_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, 'u' || old.patient_id || ' u' || old.physician_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_update
+    AFTER UPDATE OF content, patient_id, physician_id ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, 'u' || old.patient_id || ' u' || old.physician_id);
+        INSERT INTO {table}_fts(rowid, content, participants)
+        VALUES (new.id, new.content, 'u' || new.patient_id || ' u' || new.physician_id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS {table}_fts_insert",
+    "DROP TRIGGER IF EXISTS {table}_fts_delete",
+    "DROP TRIGGER IF EXISTS {table}_fts_update",
+    "DROP TABLE IF EXISTS {table}_fts",
+    "DROP VIEW IF EXISTS {table}_search",
+]
+
+SEARCH_SQL = """
+SELECT m.id, m.user_id, m.patient_id, m.physician_id, m.created_at,
+       snippet({table}_fts, 0, char(1), char(2), '…', 12),
+       bm25({table}_fts, 1.0, 0.0) AS rank
+FROM {table}_fts
+JOIN {table} m ON m.id = {table}_fts.rowid
+WHERE {table}_fts MATCH %s
+ORDER BY rank
+LIMIT %s
+"""
+
+# snippet() markers, swapped for <mark> once the text has been escaped
+HIGHLIGHT_START = '\x01'
+HIGHLIGHT_END = '\x02'
+
+
+def install_search_index(db_connection=connection, rebuild=True, table=MESSAGE_TABLE):
+    with db_connection.cursor() as cursor:
+        cursor.execute(SOURCE_VIEW_SQL.format(table=table))
+        cursor.execute(INDEX_SQL.format(table=table))
+        for statement in TRIGGERS_SQL:
+            cursor.execute(statement.format(table=table))
+        if rebuild:
+            cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def drop_search_index(db_connection=connection, table=MESSAGE_TABLE):
+    with db_connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement.format(table=table))
+
+
+def fts_match_expression(text):
+    """
+    Turn free text into a safe FTS5 query: every word must appear, the last
+    one as a prefix so results show up while the user is still typing.
+    """
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(snippet_text):
+    return (
+        html.escape(snippet_text)
+        .replace(HIGHLIGHT_START, '<mark>')
+        .replace(HIGHLIGHT_END, '</mark>')
+    )
+
+
+def as_datetime(value):
+    """An aware datetime from a raw cursor's timestamp, which SQLite returns as a naive UTC string."""
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def _search(db_connection, table, match, limit):
+    with db_connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL.format(table=table), [match, limit])
+        return cursor.fetchall()
+
+
+def has_archived_conversations(user_id):
+    from .models import Conversation
+
+    return Conversation.objects.filter(
+        Q(patient_id=user_id) | Q(physician_id=user_id), archived_count__gt=0,
+    ).exists()
+
+
+def search_messages(user_id, text, limit):
+    expression = fts_match_expression(text)
+    if expression is None:
+        return []
+    match = f'participants : "u{int(user_id)}" AND content : ({expression})'
+
+    rows = _search(connection, MESSAGE_TABLE, match, limit)
+    if has_archived_conversations(user_id):
+        # both indexes score with bm25, so their best hits merge by rank
+        archive = connections[settings.CHAT_ARCHIVE_DATABASE]
+        rows = sorted(rows + _search(archive, ARCHIVE_TABLE, match, limit), key=lambda row: row[-1])[:limit]
+
+    return [
+        {
+            'id': message_id,
+            'user': author_id,
+            'patient': patient_id,
+            'physician': physician_id,
+            'created_at': as_datetime(created_at),
+            'snippet': highlight(snippet_text),
+        }
+        for message_id, author_id, patient_id, physician_id, created_at, snippet_text, _ in rows
+    ]
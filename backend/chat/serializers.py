@@ -4,7 +4,54 @@ from rest_framework import serializers
 from userauth.models import User, Patient, Physician
 from userauth.serializers import UserSerializer
 
-from .models import ChatMessage
+from .models import ChatMessage, Conversation
+
+
+# Fast read path for listings: one query with the author joined in, then plain
+# dicts shaped exactly like ChatMessageSerializer output.
+MESSAGE_COLUMNS = (
+    'id', 'patient_id', 'physician_id', 'content', 'created_at', 'modified_at',
+    'user_id', 'user__username', 'user__email', 'user__role',
+)
+
+_datetime_field = serializers.DateTimeField()
+
+
+def message_rows(queryset):
+    return queryset.values(*MESSAGE_COLUMNS)
+
+
+def row_from_message(chat_message):
+    """The message_rows dict for a ChatMessage that is already in memory, author included."""
+    return {
+        'id': chat_message.id,
+        'patient_id': chat_message.patient_id,
+        'physician_id': chat_message.physician_id,
+        'content': chat_message.content,
+        'created_at': chat_message.created_at,
+        'modified_at': chat_message.modified_at,
+        'user_id': chat_message.user.id,
+        'user__username': chat_message.user.username,
+        'user__email': chat_message.user.email,
+        'user__role': chat_message.user.role,
+    }
+
+
+def serialize_message_row(row):
+    return {
+        'id': row['id'],
+        'user': {
+            'id': row['user_id'],
+            'username': row['user__username'],
+            'email': row['user__email'],
+            'role': row['user__role'],
+        } if row['user_id'] is not None else None,
+        'patient': row['patient_id'],
+        'physician': row['physician_id'],
+        'content': row['content'],
+        'created_at': _datetime_field.to_representation(row['created_at']),
+        'modified_at': _datetime_field.to_representation(row['modified_at']),
+    }
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
@@ -28,4 +75,20 @@ class ChatMessageSerializer(serializers.ModelSerializer):
             content = validated_data.get('content'),
         )
         
-        return chat_message
\ No newline at end of file
+        return chat_message
+
+
+# One entry of a batch upload; FK targets are checked in bulk by the view
+class ChatMessageBatchItemSerializer(serializers.Serializer):
+    patient = serializers.IntegerField()
+    physician = serializers.IntegerField()
+    content = serializers.CharField(max_length = 500)
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = [
+            'id', 'patient', 'physician', 'last_message', 'last_message_preview',
+            'last_activity_at', 'patient_unread', 'physician_unread',
+        ]
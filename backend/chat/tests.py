@@ -1,3 +1,588 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import threading
+import tracemalloc
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from backend.query_budget import QueryBudgetExceeded, normalize_sql, query_budget
+from userauth.models import Patient, Physician, User
+from . import cache, pubsub
+from .archive import archive_before
+from .cache import RecentMessageCache
+from .models import ArchivedChatMessage, ChatMessage, Conversation
+from .pagination import ConversationWindow
+from .pubsub import InProcessBroker, conversation_channel
+from .search import search_messages
+
+
+def create_conversation():
+    physician = Physician.objects.create(
+        user=User.objects.create_user('doctor', password='x'), first_name='Ada', last_name='Doc',
+    )
+    patient = Patient.objects.create(
+        user=User.objects.create_user('patient', password='x'), physician=physician,
+        first_name='Pat', last_name='Ient', age_category='adult',
+    )
+    return patient, physician
+
+
+def add_messages(patient, physician, count):
+    # the way the write endpoints do it: rows plus their conversation summary
+    messages = ChatMessage.objects.bulk_create([
+        ChatMessage(user_id=patient.user_id, patient=patient, physician=physician, content=f'message {number}')
+        for number in range(count)
+    ])
+    Conversation.objects.record_messages(messages)
+    return messages
+
+
+def reset_recent_cache():
+    # test transactions roll back, so message ids (and cache marks) repeat between tests
+    cache._cache = None
+
+
+async def drain(subscription):
+    # deliveries are scheduled with call_soon_threadsafe; let them run first
+    await asyncio.sleep(0)
+    messages = []
+    while not subscription.queue.empty():
+        messages.append(await subscription.get())
+    return messages
+
+
+class InProcessBrokerTests(SimpleTestCase):
+    async def test_delivers_to_every_subscriber_of_the_channel(self):
+        broker = InProcessBroker()
+        first = broker.subscribe(conversation_channel(1, 2))
+        second = broker.subscribe(conversation_channel(1, 2))
+        other = broker.subscribe(conversation_channel(1, 3))
+
+        self.assertEqual(broker.publish(conversation_channel(1, 2), 'hello'), 2)
+
+        self.assertEqual(await drain(first), ['hello'])
+        self.assertEqual(await drain(second), ['hello'])
+        self.assertEqual(await drain(other), [])
+
+    async def test_slow_subscriber_drops_overflow(self):
+        broker = InProcessBroker(queue_size=2)
+        subscription = broker.subscribe('chat.1.2')
+
+        for number in range(5):
+            broker.publish('chat.1.2', number)
+
+        with self.assertLogs('chat.pubsub', 'WARNING'):
+            messages = await drain(subscription)
+        self.assertEqual(messages, [0, 1])
+
+    async def test_closed_subscription_gets_nothing(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe('chat.1.2')
+        subscription.close()
+
+        self.assertEqual(broker.publish('chat.1.2', 'hello'), 0)
+        self.assertEqual(await drain(subscription), [])
+        self.assertEqual(broker._subscribers, {})
+
+
+class LifespanTests(SimpleTestCase):
+    async def test_lifespan_events_are_acknowledged(self):
+        from backend.asgi import application
+
+        incoming = asyncio.Queue()
+        sent = []
+        for event in ('lifespan.startup', 'lifespan.shutdown'):
+            incoming.put_nowait({'type': event})
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await asyncio.wait_for(application({'type': 'lifespan'}, incoming.get, send), timeout=1)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+class IdleSocketLoadTests(TestCase):
+    # thousands of open, quiet chat sockets in one process, as a busy worker holds them
+    sockets = 2000
+
+    def setUp(self):
+        pubsub._broker = None
+        self.patient, self.physician = create_conversation()
+        self.token = str(AccessToken.for_user(self.patient.user)).encode()
+
+    def open_socket(self, application, path):
+        incoming = asyncio.Queue()
+        incoming.put_nowait({'type': 'websocket.connect'})
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'websocket', 'path': path, 'query_string': b'token=' + self.token, 'headers': []}
+        return incoming, sent, asyncio.ensure_future(application(scope, incoming.get, send))
+
+    async def wait_until(self, condition, timeout=60):
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+    async def test_one_publish_reaches_every_idle_socket(self):
+        from backend.asgi import application
+
+        path = f'/ws/chat/{self.patient.pk}/{self.physician.pk}/'
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        baseline = tracemalloc.get_traced_memory()[0]
+
+        sockets = [self.open_socket(application, path) for _ in range(self.sockets)]
+        await self.wait_until(lambda: all(sent for _, sent, _ in sockets))
+        self.assertEqual({sent[0]['type'] for _, sent, _ in sockets}, {'websocket.accept'})
+        per_socket = (tracemalloc.get_traced_memory()[0] - baseline) / self.sockets
+
+        delivered = pubsub.publish_chat_message({'patient': self.patient.pk, 'physician': self.physician.pk, 'content': 'hi'})
+        self.assertEqual(delivered, self.sockets)
+        await self.wait_until(lambda: all(len(sent) == 2 for _, sent, _ in sockets))
+        for _, sent, _ in sockets:
+            self.assertEqual(json.loads(sent[1]['text'])['data']['content'], 'hi')
+
+        for incoming, _, _ in sockets:
+            incoming.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(asyncio.gather(*(task for _, _, task in sockets)), timeout=60)
+        self.assertEqual(pubsub.get_broker()._subscribers, {})
+
+        # an idle socket is two parked tasks and a subscription queue, about 15 KiB with the
+        # test's own queue and scope; a buffer allocated per socket would show up here
+        self.assertLess(per_socket, 32 * 1024, f'{per_socket:.0f} bytes per idle socket')
+
+
+class ConversationETagTests(TestCase):
+    def setUp(self):
+        reset_recent_cache()
+        self.patient, self.physician = create_conversation()
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+        self.url = f'/chat/chat_messages/{self.patient.pk}/{self.physician.pk}/'
+
+    def test_not_modified_until_a_new_message(self):
+        add_messages(self.patient, self.physician, 3)
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        add_messages(self.patient, self.physician, 1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_validator_is_one_query_whatever_the_history(self):
+        for count in (5, 300):
+            add_messages(self.patient, self.physician, count)
+            etag = self.client.get(self.url)['ETag']
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        reset_recent_cache()
+        self.patient, self.physician = create_conversation()
+        self.messages = add_messages(self.patient, self.physician, 250)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+        self.url = f'/chat/chat_messages/{self.patient.pk}/{self.physician.pk}/'
+
+    def test_query_count_does_not_depend_on_the_page_size(self):
+        for limit in (5, 50, 100):
+            newest = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(len(newest.data['results']), limit)
+            # paging back misses the recent-message cache and reads the table
+            with self.assertNumQueries(2):
+                older = self.client.get(self.url, {'limit': limit, 'before': newest.data['before']})
+            self.assertEqual(len(older.data['results']), limit)
+
+    def test_pages_walk_the_whole_history_once(self):
+        seen = []
+        before = None
+        while True:
+            params = {'limit': 100} if before is None else {'limit': 100, 'before': before}
+            response = self.client.get(self.url, params)
+            seen.extend(message['id'] for message in response.data['results'])
+            before = response.data['before']
+            if before is None:
+                break
+        self.assertEqual(sorted(seen), [message.id for message in self.messages])
+
+
+class ArchiveFallbackTests(TestCase):
+    databases = {'default', 'chat_archive'}
+
+    def setUp(self):
+        reset_recent_cache()
+        self.patient, self.physician = create_conversation()
+        start = timezone.now() - datetime.timedelta(days=1)
+        for number, message in enumerate(add_messages(self.patient, self.physician, 30)):
+            ChatMessage.objects.filter(pk=message.pk).update(created_at=start + datetime.timedelta(seconds=number))
+        # messages 0-11 go to the cold tier, 12-29 stay hot
+        list(archive_before(start + datetime.timedelta(seconds=12)))
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+        self.url = f'/chat/chat_messages/{self.patient.pk}/{self.physician.pk}/'
+
+    def walk(self, limit):
+        pages = []
+        params = {'limit': limit}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([int(message['content'].split()[1]) for message in response.data['results']])
+            if response.data['before'] is None:
+                return pages
+            params = {'limit': limit, 'before': response.data['before']}
+
+    def test_paging_back_continues_into_the_archive(self):
+        self.assertEqual((ChatMessage.objects.count(), ArchivedChatMessage.objects.count()), (18, 12))
+
+        pages = self.walk(10)
+        self.assertEqual(pages, [list(range(20, 30)), list(range(10, 20)), list(range(0, 10))])
+
+    def test_page_ending_on_the_boundary(self):
+        # the second page uses up the hot tier exactly; the next one is all archive
+        pages = self.walk(9)
+        self.assertEqual(pages[1], list(range(12, 21)))
+        self.assertEqual([number for page in reversed(pages) for number in page], list(range(30)))
+
+    def test_archived_authors_are_joined(self):
+        message = self.client.get(self.url, {'limit': 25}).data['results'][0]
+        self.assertEqual(message['content'], 'message 5')
+        self.assertEqual(message['user'], {
+            'id': self.patient.user_id, 'username': 'patient', 'email': '', 'role': self.patient.user.role,
+        })
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.patient, self.physician = create_conversation()
+        add_messages(self.patient, self.physician, 3)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.patient.user)}'}
+        self.url = f'/chat/async/chat_messages/{self.patient.pk}/{self.physician.pk}/'
+
+    async def test_rejects_missing_invalid_and_inactive_credentials(self):
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 401)
+        response = await self.async_client.get(self.url, headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, 401)
+
+        await User.objects.filter(pk=self.patient.user_id).aupdate(is_active=False)
+        self.assertEqual((await self.async_client.get(self.url, headers=self.headers)).status_code, 401)
+
+    async def test_reads_the_conversation(self):
+        response = await self.async_client.get(self.url, {'limit': 2}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['content'] for row in response.json()['results']], ['message 1', 'message 2'])
+
+        headers = {**self.headers, 'If-None-Match': response['ETag']}
+        self.assertEqual((await self.async_client.get(self.url, headers=headers)).status_code, 304)
+
+    async def test_creates_a_message(self):
+        url = '/chat/async/chat_messages/create/'
+        item = {'patient': self.patient.pk, 'physician': self.physician.pk, 'content': 'async hello'}
+
+        response = await self.async_client.post(url, item, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['content'], 'async hello')
+        self.assertEqual(await ChatMessage.objects.acount(), 4)
+
+        response = await self.async_client.post(
+            url, {**item, 'patient': 999}, content_type='application/json', headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('patient', response.json())
+
+
+def tail_rows(*ids):
+    start = timezone.now()
+    return [{'id': row_id, 'created_at': start + datetime.timedelta(seconds=row_id)} for row_id in ids]
+
+
+class RecentMessageCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = RecentMessageCache(tail_size=5)
+        self.mark = {'last_message_id': 3, 'archived_count': 0}
+        self.window = ConversationWindow(limit=10)
+
+    def ids(self, mark=None):
+        rows = self.cache.rows_for(1, 2, mark or self.mark, self.window)
+        return None if rows is None else [row['id'] for row in rows]
+
+    def test_hits_and_misses_are_counted(self):
+        self.assertIsNone(self.ids())
+        self.cache.put(1, 2, self.mark, tail_rows(1, 2, 3), complete=True)
+        self.assertEqual(self.ids(), [3, 2, 1])
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 1))
+
+    def test_a_moved_mark_misses(self):
+        self.cache.put(1, 2, self.mark, tail_rows(1, 2, 3), complete=True)
+        self.assertIsNone(self.ids({'last_message_id': 4, 'archived_count': 0}))
+        self.assertIsNone(self.ids({'last_message_id': 3, 'archived_count': 1}))
+
+    def test_append_extends_the_tail_and_its_mark(self):
+        self.cache.append(1, 2, tail_rows(4))
+        self.assertIsNone(self.ids({'last_message_id': 4, 'archived_count': 0}))
+
+        self.cache.put(1, 2, self.mark, tail_rows(1, 2, 3), complete=True)
+        self.cache.append(1, 2, tail_rows(4, 5, 6))
+        # trimmed to tail_size, so only pages that fit in it are answered
+        self.assertIsNone(self.ids({'last_message_id': 6, 'archived_count': 0}))
+        self.window = ConversationWindow(limit=3)
+        self.assertEqual(self.ids({'last_message_id': 6, 'archived_count': 0}), [6, 5, 4, 3])
+
+    def test_append_skips_rows_the_tail_has_and_keeps_order(self):
+        self.cache.put(1, 2, {'last_message_id': 4, 'archived_count': 0}, tail_rows(1, 2, 4), complete=True)
+        self.cache.append(1, 2, tail_rows(4))
+        self.cache.append(1, 2, tail_rows(3))
+        self.assertEqual(self.ids({'last_message_id': 4, 'archived_count': 0}), [4, 3, 2, 1])
+
+    def test_shared_backend_drops_the_entry_on_append(self):
+        self.cache = RecentMessageCache(alias='default')
+        self.cache.put(1, 2, self.mark, tail_rows(1, 2, 3), complete=True)
+        self.assertEqual(self.ids(), [3, 2, 1])
+        self.cache.append(1, 2, tail_rows(4))
+        self.assertIsNone(self.ids({'last_message_id': 4, 'archived_count': 0}))
+
+    def test_concurrent_appends_lose_nothing(self):
+        self.cache = RecentMessageCache(tail_size=1000)
+        self.cache.put(1, 2, {'last_message_id': 0, 'archived_count': 0}, [], complete=True)
+        rows = tail_rows(*range(1, 401))
+        threads = [
+            threading.Thread(target=lambda part=part: [self.cache.append(1, 2, [row]) for row in part])
+            for part in (rows[0::4], rows[1::4], rows[2::4], rows[3::4])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        entry = self.cache._entries[self.cache.key(1, 2)]
+        self.assertEqual([row['id'] for row in entry['rows']], list(range(1, 401)))
+        self.assertEqual(entry['mark'], (400, 0))
+
+
+class RecentMessageCacheRaceTests(TestCase):
+    def setUp(self):
+        reset_recent_cache()
+        self.patient, self.physician = create_conversation()
+        add_messages(self.patient, self.physician, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+        self.url = f'/chat/chat_messages/{self.patient.pk}/{self.physician.pk}/'
+
+    def ids(self):
+        return [message['id'] for message in self.client.get(self.url).data['results']]
+
+    def test_refill_before_the_write_through_does_not_duplicate(self):
+        self.ids()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/chat/chat_messages/create/', {
+                'patient': self.patient.pk, 'physician': self.physician.pk, 'content': 'new',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        # a reader refills the tail, new row included, before the append runs
+        refilled = self.ids()
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(self.ids(), refilled)
+        self.assertEqual(len(set(refilled)), 4)
+
+    def test_write_through_serves_new_messages_from_the_cache(self):
+        self.ids()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/chat/chat_messages/create/', {
+                'patient': self.patient.pk, 'physician': self.physician.pk, 'content': 'new',
+            }, format='json')
+
+        hits = cache.get_recent_cache().hits
+        self.assertEqual(len(self.ids()), 4)
+        self.assertEqual(cache.get_recent_cache().hits, hits + 1)
+
+
+class BatchCreateTests(TestCase):
+    url = '/chat/chat_messages/batch/'
+
+    def setUp(self):
+        self.patient, self.physician = create_conversation()
+        add_messages(self.patient, self.physician, 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def items(self, count):
+        return [
+            {'patient': self.patient.pk, 'physician': self.physician.pk, 'content': f'offline {number}'}
+            for number in range(count)
+        ]
+
+    def test_requires_authentication(self):
+        response = APIClient().post(self.url, self.items(2), format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        counts = []
+        for size in (1, 50):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, self.items(size), format='json')
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(ChatMessage.objects.count(), 52)
+        self.assertEqual(Conversation.objects.get().physician_unread, 52)
+
+    def test_invalid_items_are_reported_per_index(self):
+        items = self.items(2) + [{'patient': 999, 'physician': self.physician.pk, 'content': 'lost'}, {'content': ''}]
+        response = self.client.post(self.url, items, format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201, 400, 400])
+        self.assertIn('patient', response.data['results'][2]['errors'])
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+
+class ConversationSummaryTests(TestCase):
+    def setUp(self):
+        self.patient, self.physician = create_conversation()
+        self.patients = [self.patient] + [
+            Patient.objects.create(
+                user=User.objects.create_user(f'patient{number}', password='x'), physician=self.physician,
+                first_name='Pat', last_name=str(number), age_category='adult',
+            )
+            for number in range(5)
+        ]
+
+    def test_batch_across_conversations_is_two_queries(self):
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(user_id=self.physician.user_id, patient=patient, physician=self.physician, content=f'to {patient.pk}')
+            for patient in self.patients for _ in range(2)
+        ])
+        with self.assertNumQueries(2):
+            Conversation.objects.record_messages(messages)
+
+        summaries = Conversation.objects.order_by('patient_id')
+        self.assertEqual(len(summaries), 6)
+        for patient, summary in zip(self.patients, summaries):
+            self.assertEqual(summary.patient_id, patient.pk)
+            self.assertEqual(summary.patient_unread, 2)
+            self.assertEqual(summary.physician_unread, 0)
+            self.assertEqual(summary.last_message_preview, f'to {patient.pk}')
+
+        add_messages(self.patient, self.physician, 1)
+        summary = Conversation.objects.get(patient=self.patient)
+        self.assertEqual(summary.physician_unread, 1)
+        self.assertEqual(summary.last_message_id, ChatMessage.objects.latest('id').id)
+
+    def test_batch_endpoint_across_new_conversations_is_within_budget(self):
+        client = APIClient()
+        client.force_authenticate(self.physician.user)
+        items = [{'patient': patient.pk, 'physician': self.physician.pk, 'content': 'hello'} for patient in self.patients]
+
+        response = client.post('/chat/chat_messages/batch/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Conversation.objects.count(), 6)
+
+    def test_inbox_and_mark_read_require_authentication(self):
+        client = APIClient()
+        self.assertEqual(client.get('/chat/inbox/').status_code, 401)
+        url = f'/chat/conversations/{self.patient.pk}/{self.physician.pk}/read/'
+        self.assertEqual(client.post(url).status_code, 401)
+
+
+class SearchTests(TestCase):
+    url = '/chat/search/'
+
+    def setUp(self):
+        self.patient, self.physician = create_conversation()
+        add_messages(self.patient, self.physician, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get(self.url, {'q': 'message'}).status_code, 401)
+
+    def test_finds_the_callers_messages_with_highlights(self):
+        response = self.client.get(self.url, {'q': 'messa'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIn('<mark>message</mark>', response.data['results'][0]['snippet'])
+
+    def test_other_users_see_nothing(self):
+        outsider = User.objects.create_user('outsider', password='x')
+        client = APIClient()
+        client.force_authenticate(outsider)
+        self.assertEqual(client.get(self.url, {'q': 'message'}).data['results'], [])
+
+
+class ArchivedSearchTests(TestCase):
+    databases = {'default', 'chat_archive'}
+
+    def test_archived_messages_stay_searchable(self):
+        patient, physician = create_conversation()
+        add_messages(patient, physician, 2)
+        list(archive_before(timezone.now() + datetime.timedelta(seconds=1)))
+        ChatMessage.objects.create(user=patient.user, patient=patient, physician=physician, content='message 2')
+        self.assertEqual(ChatMessage.objects.count(), 1)
+        self.assertEqual(ArchivedChatMessage.objects.count(), 2)
+
+        results = search_messages(patient.user_id, 'message', 10)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sorted(result['id'] for result in results), sorted(
+            list(ArchivedChatMessage.objects.values_list('id', flat=True)) + list(ChatMessage.objects.values_list('id', flat=True))
+        ))
+        self.assertEqual(len(search_messages(patient.user_id, 'message', 2)), 2)
+        self.assertEqual(search_messages(physician.user_id + patient.user_id + 1, 'message', 10), [])
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.patient, self.physician = create_conversation()
+        add_messages(self.patient, self.physician, 3)
+
+    def test_normalized_sql_ignores_literals_and_in_list_length(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id = 12 AND name = 'it''s' AND x IN (%s, %s, %s)"),
+            normalize_sql("SELECT  * FROM t WHERE id = 7 AND name = 'b' AND x IN (%s)"),
+        )
+
+    def test_repeated_statement_is_reported(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'repeated 5x (N+1?)'):
+            with query_budget(100):
+                for user_id in range(5):
+                    User.objects.filter(pk=user_id).exists()
+
+    def test_nested_budgets_both_count(self):
+        with query_budget(2) as outer:
+            with query_budget(1) as inner:
+                User.objects.exists()
+            User.objects.exists()
+        self.assertEqual((outer.count, inner.count), (2, 1))
+
+    def test_request_over_budget_fails(self):
+        client = APIClient()
+        client.force_authenticate(self.patient.user)
+        with override_settings(QUERY_BUDGETS={'inbox': 0}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, '(inbox) over query budget'):
+                client.get('/chat/inbox/')
+
+    async def test_async_view_queries_are_counted(self):
+        # every query of the async views runs in a sync_to_async thread
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.patient.user)}'}
+        url = f'/chat/async/chat_messages/{self.patient.pk}/{self.physician.pk}/'
+        with override_settings(QUERY_BUDGETS={'messages_async': 0}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, '3 queries, budget is 0'):
+                await self.async_client.get(url, headers=headers)
@@ -1,6 +1,6 @@
 
 from django.urls import path
-from . import views
+from . import views, async_views
 
 
 
@@ -10,4 +10,21 @@ urlpatterns = [
     
     # Create messages
     path('chat_messages/create/', views.create_chat_message, name = 'create_message'),
+    
+    # Create several messages at once (offline replay)
+    path('chat_messages/batch/', views.create_chat_messages_batch, name = 'create_messages_batch'),
+    
+    # Inbox: one summary row per conversation
+    path('inbox/', views.get_inbox, name = 'inbox'),
+    path('conversations/<int:patient_id>/<int:physician_id>/read/', views.mark_conversation_read, name = 'conversation_read'),
+    
+    # Native async list/create, for ASGI deployments
+    path('async/chat_messages/<int:patient_id>/<int:physician_id>/', async_views.get_chat_messages, name = 'messages_async'),
+    path('async/chat_messages/create/', async_views.create_chat_message, name = 'create_message_async'),
+    
+    # Full-text search over the caller's conversations
+    path('search/', views.search_chat_messages, name = 'search_messages'),
+    
+    # Recent-message cache counters (staff only)
+    path('cache/stats/', views.recent_cache_stats, name = 'recent_cache_stats'),
 ]
\ No newline at end of file
@@ -1,19 +1,59 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils.http import parse_etags
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.response import Response
-from .serializers import ChatMessageSerializer
-from .models import ChatMessage
+from userauth.authentication import ClaimsJWTAuthentication
+from userauth.models import Patient, Physician
+from .serializers import (
+    ChatMessageSerializer,
+    ChatMessageBatchItemSerializer,
+    ConversationSerializer,
+    message_rows,
+    row_from_message,
+    serialize_message_row,
+)
+from .models import ChatMessage, Conversation
+from .pagination import ConversationWindow, InboxWindow, InvalidPageRequest, get_page_size
+from .search import search_messages
+from .archive import archived_conversation, as_message_rows
+from .cache import get_recent_cache
+from .pubsub import publish_chat_message
 # Create your views here.
 
 
+def announce_messages(chat_messages):
+    # Once the rows are visible to readers: extend cached tails, push to open websockets
+    rows = [row_from_message(chat_message) for chat_message in chat_messages]
+
+    def announce():
+        by_conversation = {}
+        for row in rows:
+            by_conversation.setdefault((row['patient_id'], row['physician_id']), []).append(row)
+        recent = get_recent_cache()
+        for (patient_id, physician_id), conversation_rows in by_conversation.items():
+            recent.append(patient_id, physician_id, conversation_rows)
+        for row in rows:
+            publish_chat_message(serialize_message_row(row))
+
+    transaction.on_commit(announce)
+
+
 @api_view(['POST'])
+@permission_classes([IsAuthenticated])
 def create_chat_message(request):
     if request.method == 'POST':
         # passing request object
         serializer = ChatMessageSerializer(data = request.data, context  = {'request': request})
         
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                chat_message = serializer.save()
+                Conversation.objects.record_messages([chat_message])
+            announce_messages([chat_message])
             
             return Response(serializer.data, status = status.HTTP_201_CREATED )
 
@@ -21,15 +61,185 @@ def create_chat_message(request):
     
     
     
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_chat_messages_batch(request):
+    # Replay of messages queued offline: one auth, one query per FK table, one insert
+    items = request.data
+    if not isinstance(items, list) or not items:
+        return Response({'detail': 'Expected a non-empty list of messages.'}, status = status.HTTP_400_BAD_REQUEST)
+    if len(items) > settings.CHAT_BATCH_MAX_SIZE:
+        return Response(
+            {'detail': f'A batch can hold at most {settings.CHAT_BATCH_MAX_SIZE} messages.'},
+            status = status.HTTP_400_BAD_REQUEST,
+        )
+
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        serializer = ChatMessageBatchItemSerializer(data = item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+
+    patient_ids = set(Patient.objects.filter(pk__in = {data['patient'] for _, data in valid}).values_list('pk', flat = True))
+    physician_ids = set(Physician.objects.filter(pk__in = {data['physician'] for _, data in valid}).values_list('pk', flat = True))
+    does_not_exist = PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+
+    pending = []
+    for index, data in valid:
+        errors = {}
+        if data['patient'] not in patient_ids:
+            errors['patient'] = [does_not_exist.format(pk_value = data['patient'])]
+        if data['physician'] not in physician_ids:
+            errors['physician'] = [does_not_exist.format(pk_value = data['physician'])]
+        if errors:
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': errors}
+            continue
+        pending.append((index, ChatMessage(
+            user = request.user,
+            patient_id = data['patient'],
+            physician_id = data['physician'],
+            content = data['content'],
+        )))
+
+    with transaction.atomic():
+        created = ChatMessage.objects.bulk_create([message for _, message in pending])
+        Conversation.objects.record_messages(created)
+    announce_messages(created)
+
+    for (index, _), chat_message in zip(pending, created):
+        data = ChatMessageSerializer(chat_message).data
+        results[index] = {'index': index, 'status': status.HTTP_201_CREATED, 'data': data}
+
+    if not created:
+        response_status = status.HTTP_400_BAD_REQUEST
+    elif len(created) < len(items):
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_201_CREATED
+    return Response({'results': results}, status = response_status)
+
+
+# high-water mark of a conversation with no summary row yet, i.e. no messages
+EMPTY_MARK = {'last_message_id': None, 'archived_count': 0}
+
+
+def conversation_etag(patient_id, physician_id, high_water_mark):
+    # A new message moves the newest id, an archive run the archived count.
+    return 'W/"chat-{}-{}-{}-{}"'.format(
+        patient_id, physician_id, high_water_mark['last_message_id'] or 0, high_water_mark['archived_count'],
+    )
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    tags = parse_etags(if_none_match)
+    # weak comparison, as If-None-Match requires
+    return '*' in tags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in tags]
+
+
 @api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
 def get_chat_messages(request, patient_id, physician_id):
     try:
-        # Filtering messages
-        chat_messages = ChatMessage.objects.filter(patient = patient_id, physician = physician_id).order_by('created_at')
-        
-        serializer = ChatMessageSerializer(chat_messages, many = True)
+        window = ConversationWindow.from_params(request.query_params)
+    except InvalidPageRequest as e:
+        return Response({'detail': str(e)}, status = status.HTTP_400_BAD_REQUEST)
+
+    try:
+        conversation = ChatMessage.objects.filter(patient = patient_id, physician = physician_id)
+
+        # One lookup of the summary row first: most polls find nothing new and stop here
+        high_water_mark = Conversation.objects.high_water_mark(patient_id, physician_id).first() or EMPTY_MARK
+        etag = conversation_etag(patient_id, physician_id, high_water_mark)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag_matches(request, etag):
+            return Response(status = status.HTTP_304_NOT_MODIFIED, headers = headers)
+
+        # Recent pages of active threads come from the write-through cache
+        recent = get_recent_cache()
+        chat_messages = None
+        if window.before is None:
+            chat_messages = recent.rows_for(patient_id, physician_id, high_water_mark, window)
+
+        if chat_messages is None:
+            # Filtering messages, one page at a time
+            chat_messages = list(message_rows(window.apply(conversation)))
+            if window.is_newest_page:
+                recent.put(
+                    patient_id, physician_id, high_water_mark, chat_messages[::-1],
+                    complete = len(chat_messages) <= window.limit,
+                )
+
+        # Hot tier exhausted while paging back: continue into the archive
+        if window.runs_past_end(chat_messages) and high_water_mark['archived_count'] > 0:
+            older = as_message_rows(window.apply(archived_conversation(patient_id, physician_id)))
+            chat_messages = window.merge_older(chat_messages, older)
+
+        chat_messages, before, after = window.page(chat_messages)
         
-        return Response( serializer.data, status = status.HTTP_200_OK)
+        return Response({
+            'results': [serialize_message_row(row) for row in chat_messages],
+            'before': before,
+            'after': after,
+        }, status = status.HTTP_200_OK, headers = headers)
     
     except ChatMessage.DoesNotExist:
-        return Response({'detail': 'No Chat Message Found for This conversation..!'}, status  = status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response({'detail': 'No Chat Message Found for This conversation..!'}, status  = status.HTTP_404_NOT_FOUND)
+    
+    
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_inbox(request):
+    # One indexed read of the summary table, whatever the size of the history
+    try:
+        window = InboxWindow.from_params(request.query_params)
+    except InvalidPageRequest as e:
+        return Response({'detail': str(e)}, status = status.HTTP_400_BAD_REQUEST)
+
+    if request.user.role == 'physician':
+        conversations = Conversation.objects.filter(physician_id = request.user.id)
+    else:
+        conversations = Conversation.objects.filter(patient_id = request.user.id)
+
+    conversations, before = window.page(window.apply(conversations))
+    serializer = ConversationSerializer(conversations, many = True)
+    return Response({'results': serializer.data, 'before': before}, status = status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def mark_conversation_read(request, patient_id, physician_id):
+    if request.user.id not in (patient_id, physician_id):
+        return Response({'detail': 'Not a participant of this conversation.'}, status = status.HTTP_403_FORBIDDEN)
+
+    Conversation.objects.mark_read(patient_id, physician_id, request.user)
+    return Response(status = status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def search_chat_messages(request):
+    # Ranked full-text search, limited to conversations the caller takes part in
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'detail': 'q is required.'}, status = status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = get_page_size(request.query_params.get('limit'))
+    except InvalidPageRequest as e:
+        return Response({'detail': str(e)}, status = status.HTTP_400_BAD_REQUEST)
+
+    return Response({'results': search_messages(request.user.id, query, limit)}, status = status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def recent_cache_stats(request):
+    # Hit/miss counters of this worker's recent-message cache, for sizing it
+    return Response(get_recent_cache().stats(), status = status.HTTP_200_OK)
@@ -0,0 +1,164 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from userauth.models import Patient
+
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def can_download(user, file_instance):
+    """The owner, staff, and the physician of the patient who uploaded it."""
+    if user.is_staff or file_instance.user_id == user.id:
+        return True
+    return Patient.objects.filter(user_id = file_instance.user_id, physician_id = user.id).exists()
+
+
+def file_etag(file_instance):
+    if file_instance.blob_id is not None:
+        return f'"{file_instance.blob.sha256}"'
+    # stored before deduplication: the name never changes for a given row
+    return f'"f{file_instance.id}-{file_instance.file.size}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single `bytes=` range, or None to send the
+    whole file. Multi-range requests are answered with the whole file, which
+    RFC 9110 allows.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+class RangeReader:
+    """Reads `length` bytes from `start` of an open file, one block at a time."""
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        fileobj.seek(start)
+
+    def read(self, size = -1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def download_name(file_instance):
+    extension = os.path.splitext(file_instance.file.name)[1]
+    base = file_instance.file_name or 'insurance-document'
+    return base if base.lower().endswith(extension.lower()) else base + extension
+
+
+def _accel_response(file_instance):
+    mode = settings.INSURANCE_DOWNLOAD_ACCEL
+    response = HttpResponse()
+    if mode == 'x-accel-redirect':
+        # nginx: an `internal` location aliased to the storage directory
+        response['X-Accel-Redirect'] = quote(settings.INSURANCE_DOWNLOAD_ACCEL_PREFIX + file_instance.file.name)
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = file_instance.file.path
+    else:
+        raise ValueError(f"Unknown INSURANCE_DOWNLOAD_ACCEL mode: {mode!r}")
+    # the proxy fills in the body, its length, and any Range handling
+    return response
+
+
+def download_response(request, file_instance):
+    etag = file_etag(file_instance)
+    last_modified = int(file_instance.uploaded_at.timestamp())
+
+    not_modified = get_conditional_response(request, etag = etag, last_modified = last_modified)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+
+    filename = download_name(file_instance)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    storage = file_instance.file.storage
+    compressed = hasattr(storage, 'is_compressed') and storage.is_compressed(file_instance.file.name)
+    # the proxy would send compressed blobs as they are on disk, so those stream through Django
+    if settings.INSURANCE_DOWNLOAD_ACCEL and not compressed:
+        response = _accel_response(file_instance)
+        response['Content-Type'] = content_type
+        response['Content-Disposition'] = f"attachment; filename*=utf-8''{quote(filename)}"
+    else:
+        response = _streaming_response(request, file_instance, etag, content_type, filename)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _streaming_response(request, file_instance, etag, content_type, filename):
+    # recorded at upload; a compressed blob's own trailer only holds it modulo 2**32 (gzip)
+    size = file_instance.blob.size if file_instance.blob_id is not None else file_instance.file.size
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # a Range whose If-Range validator no longer matches gets the whole (changed) file
+    if not if_range or if_range == etag or parse_http_date_safe(if_range) == int(file_instance.uploaded_at.timestamp()):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status = 416)
+            response['Content-Range'] = f"bytes */{size}"
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    # Always read through RangeReader and set the length ourselves: a decompressing
+    # stream can't seek to its end, which is how FileResponse would measure it.
+    fileobj = file_instance.file.storage.open(file_instance.file.name, 'rb')
+    start, end = byte_range if byte_range is not None else (0, size - 1)
+    length = end - start + 1
+    response = FileResponse(
+        RangeReader(fileobj, start, length),
+        status = 200 if byte_range is None else 206,
+        as_attachment = True, filename = filename, content_type = content_type,
+    )
+    response['Content-Length'] = str(length)
+    if byte_range is not None:
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    response.block_size = STREAM_BLOCK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    return response
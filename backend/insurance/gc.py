@@ -0,0 +1,141 @@
+"""
+Garbage collection for insurance file storage.
+
+Two sources of garbage:
+
+- Files whose last reference was deleted. Blob.objects.release() and the
+  File post_delete receiver queue these in PendingBlobDeletion, and
+  drain_pending() removes them: cheap enough for the processing worker to run
+  whenever it is idle.
+- Files nothing ever pointed at: uploads whose request failed after the bytes
+  were written, copies left by older code. sweep_storage() walks the storage
+  directories and checks what it finds against File and Blob a batch at a
+  time, so neither the directory listing nor the tables are ever held in
+  memory. Files younger than the age threshold are left alone, since an
+  upload writes its bytes before its rows are committed.
+"""
+import itertools
+import os
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Blob, File, PendingBlobDeletion
+from .storage import cas_storage
+
+
+STORAGE_DIRS = ('insurance_files', 'cas', 'insurance_previews')
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def drain_pending(batch_size = 500, dry_run = False):
+    """Delete queued files that are still unreferenced. Returns (deleted, kept)."""
+    deleted = kept = 0
+    last_id = 0
+    while True:
+        batch = list(PendingBlobDeletion.objects.filter(id__gt = last_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        names = [pending.name for pending in batch]
+        if dry_run:
+            referenced = _referenced(names)
+            kept += len(referenced)
+            deleted += len(names) - len(referenced)
+            continue
+        # Re-checking inside the transaction that drops the queue rows orders this
+        # against a concurrent Blob.objects.acquire() of the same bytes: either it
+        # committed first and the name is referenced again, or it waits for us.
+        with transaction.atomic():
+            PendingBlobDeletion.objects.filter(id__in = [pending.id for pending in batch]).delete()
+            referenced = _referenced(names)
+            for name in names:
+                if name in referenced:
+                    kept += 1
+                    continue
+                cas_storage.delete(name)
+                deleted += 1
+    return deleted, kept
+
+
+def _referenced(names):
+    return (
+        set(File.objects.filter(file__in = names).values_list('file', flat = True))
+        | set(Blob.objects.filter(name__in = names).values_list('name', flat = True))
+    )
+
+
+def _walk(directory):
+    """Yield (storage name, full path, stat) for every file below `directory`, lazily."""
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks = False):
+                yield from _walk(entry.path)
+            elif entry.is_file(follow_symlinks = False):
+                stored_name = os.path.relpath(entry.path, cas_storage.location).replace(os.sep, '/')
+                # compressed blobs are referenced by their uncompressed name
+                yield cas_storage.logical_name(stored_name), entry.path, entry.stat(follow_symlinks = False)
+
+
+def _referenced_previews(names):
+    # previews are named after the blob (insurance_previews/<sha256>.jpg) or the file (file-<id>.jpg)
+    keys = {name: os.path.splitext(os.path.basename(name))[0] for name in names}
+    file_ids = [int(key[5:]) for key in keys.values() if key.startswith('file-') and key[5:].isdigit()]
+    hashes = [key for key in keys.values() if not key.startswith('file-')]
+    live = (
+        {f"file-{pk}" for pk in File.objects.filter(pk__in = file_ids).values_list('pk', flat = True)}
+        | set(Blob.objects.filter(sha256__in = hashes).values_list('sha256', flat = True))
+    )
+    return {name for name, key in keys.items() if key in live}
+
+
+def sweep_storage(older_than = timedelta(hours = 24), batch_size = 500, dry_run = False):
+    """
+    Delete stored files that no File or Blob refers to and that are older than
+    `older_than`. Returns a dict of counts.
+    """
+    cutoff = (timezone.now() - older_than).timestamp()
+    stats = {'scanned': 0, 'too_recent': 0, 'orphaned': 0, 'orphaned_bytes': 0}
+
+    for directory in STORAGE_DIRS:
+        candidates = _walk(os.path.join(cas_storage.location, directory))
+        for batch in _batches(candidates, batch_size):
+            stats['scanned'] += len(batch)
+            old = [(name, path, st) for name, path, st in batch if st.st_mtime < cutoff]
+            stats['too_recent'] += len(batch) - len(old)
+
+            # half-written temp files from ContentAddressedStorage are never referenced
+            names = [name for name, _, _ in old if not os.path.basename(name).startswith('.incoming-')]
+            if directory == 'insurance_previews':
+                referenced = _referenced_previews(names)
+            else:
+                referenced = _referenced(names)
+
+            for name, path, st in old:
+                if name in referenced:
+                    continue
+                stats['orphaned'] += 1
+                stats['orphaned_bytes'] += st.st_size
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+    return stats
+
+
+def missing_files(batch_size = 500):
+    """Yield ids of File rows whose stored file is gone, reading the table in batches."""
+    for file_id, name in File.objects.exclude(file = '').values_list('id', 'file').iterator(chunk_size = batch_size):
+        if not cas_storage.exists(name):
+            yield file_id
@@ -0,0 +1,116 @@
+import io
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from insurance.compression import Gzip, Zstd, available_codecs, get_codec, should_compress, zstandard
+from insurance.models import Blob
+from insurance.storage import cas_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Compress insurance blobs stored before compression at rest was enabled, "
+        "or with --benchmark, compare codecs on a sample without changing anything."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many blobs.")
+        parser.add_argument('--benchmark', action='store_true',
+                            help="Report size saved and CPU time per codec and level on a sample of blobs.")
+        parser.add_argument('--sample', type=int, default=50, help="Blobs sampled by --benchmark.")
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self.benchmark(options['sample'])
+
+        codec = get_codec(settings.INSURANCE_STORAGE_COMPRESSION)
+        if codec is None:
+            raise CommandError("INSURANCE_STORAGE_COMPRESSION is off; nothing to do.")
+
+        compressed = skipped = 0
+        before_total = after_total = 0
+        cpu = 0.0
+        last_id = 0
+        while options['limit'] is None or compressed + skipped < options['limit']:
+            batch = list(Blob.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'name')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            for _, name in batch:
+                if not should_compress(name) or cas_storage.is_compressed(name) or not os.path.exists(cas_storage.path(name)):
+                    skipped += 1
+                    continue
+                started = time.process_time()
+                before, after = cas_storage.compress_existing(name, codec)
+                cpu += time.process_time() - started
+                before_total += before
+                after_total += after
+                if after < before:
+                    compressed += 1
+                else:
+                    skipped += 1
+
+        saved = before_total - after_total
+        self.stdout.write(self.style.SUCCESS(
+            f"Compressed {compressed} blobs with {codec.name}, skipped {skipped}. "
+            f"{before_total} -> {after_total} bytes ({_percent(saved, before_total)} saved) "
+            f"in {cpu:.2f}s CPU."
+        ))
+
+    def benchmark(self, sample):
+        codecs = [Gzip(1), Gzip(6), Gzip(9)]
+        if zstandard is not None:
+            codecs += [Zstd(1), Zstd(3), Zstd(9), Zstd(19)]
+        else:
+            self.stdout.write("zstandard is not installed; benchmarking gzip only.")
+
+        names = [
+            name for name in Blob.objects.order_by('-id').values_list('name', flat=True)[:sample * 4]
+            if should_compress(name) and cas_storage.exists(name)
+        ][:sample]
+        if not names:
+            raise CommandError("No compressible blobs to sample.")
+
+        self.stdout.write(f"{len(names)} blobs sampled. Default codec: {available_codecs()[0].name}.")
+        self.stdout.write(f"{'codec':<10}{'original':>14}{'stored':>14}{'saved':>9}{'compress MB/s':>15}{'read MB/s':>11}")
+        for codec in codecs:
+            original = stored = 0
+            compress_cpu = read_cpu = 0.0
+            for name in names:
+                with cas_storage.open(name, 'rb') as source:
+                    out = io.BytesIO()
+                    started = time.process_time()
+                    codec.compress(source, out)
+                    compress_cpu += time.process_time() - started
+                original += source.size
+                stored += out.tell()
+                read_cpu += _decompress_time(codec, out)
+            self.stdout.write(
+                f"{codec.name + str(codec.level):<10}{original:>14}{stored:>14}{_percent(original - stored, original):>9}"
+                f"{_rate(original, compress_cpu):>15}{_rate(original, read_cpu):>11}"
+            )
+
+
+def _decompress_time(codec, buffer):
+    buffer.seek(0)
+    if codec.name == 'gzip':
+        import gzip
+        reader = gzip.GzipFile(fileobj=buffer, mode='rb')
+    else:
+        reader = zstandard.ZstdDecompressor().stream_reader(buffer)
+    started = time.process_time()
+    while reader.read(64 * 1024):
+        pass
+    return time.process_time() - started
+
+
+def _percent(part, whole):
+    return f"{100 * part / whole:.1f}%" if whole else "n/a"
+
+
+def _rate(size, seconds):
+    return f"{size / seconds / 1e6:.1f}" if seconds else "n/a"
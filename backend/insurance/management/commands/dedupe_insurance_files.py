@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from insurance.models import Blob, File
+from insurance.storage import cas_storage
+
+
+class Command(BaseCommand):
+    help = "Move insurance files stored before deduplication into content-addressed blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many files would move.")
+
+    def handle(self, *args, **options):
+        legacy = File.objects.filter(blob__isnull=True).exclude(file='')
+        if options['dry_run']:
+            self.stdout.write(f"{legacy.count()} files are not deduplicated yet.")
+            return
+
+        moved = missing = freed = 0
+        last_id = 0
+        while True:
+            batch = list(legacy.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for file_instance in batch:
+                old_name = file_instance.file.name
+                if not cas_storage.exists(old_name):
+                    self.stderr.write(f"File {file_instance.id}: {old_name} is missing, skipped.")
+                    missing += 1
+                    continue
+
+                with transaction.atomic():
+                    with cas_storage.open(old_name) as content:
+                        blob = Blob.objects.acquire(content, old_name)
+                    File.objects.filter(pk=file_instance.pk).update(blob=blob, file=blob.name)
+
+                if old_name != blob.name and not File.objects.filter(file=old_name).exists():
+                    freed += cas_storage.size(old_name) if cas_storage.exists(old_name) else 0
+                    cas_storage.delete(old_name)
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deduplicated {moved} files, freed {freed} bytes; {missing} files were missing on disk."
+        ))
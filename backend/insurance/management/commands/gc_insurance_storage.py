@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from insurance.gc import drain_pending, missing_files, sweep_storage
+
+
+class Command(BaseCommand):
+    help = "Delete stored insurance files that no File or Blob refers to any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-hours', type=int, default=24,
+            help="Only sweep unreferenced files last modified more than this many hours ago.",
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted.")
+        parser.add_argument('--pending-only', action='store_true',
+                            help="Only drain the delete queue, don't walk the storage directories.")
+        parser.add_argument('--check-missing', action='store_true',
+                            help="Also report File rows whose stored file is gone.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        verb = "Would delete" if dry_run else "Deleted"
+
+        deleted, kept = drain_pending(batch_size=options['batch_size'], dry_run=dry_run)
+        self.stdout.write(f"Delete queue: {verb.lower()} {deleted} files, {kept} were referenced again.")
+
+        if not options['pending_only']:
+            stats = sweep_storage(
+                older_than=timedelta(hours=options['older_than_hours']),
+                batch_size=options['batch_size'],
+                dry_run=dry_run,
+            )
+            self.stdout.write(
+                f"Sweep: scanned {stats['scanned']} files, {verb.lower()} {stats['orphaned']} orphans "
+                f"({stats['orphaned_bytes']} bytes), skipped {stats['too_recent']} recent ones."
+            )
+
+        if options['check_missing']:
+            missing = list(missing_files(batch_size=options['batch_size']))
+            if missing:
+                self.stderr.write(f"{len(missing)} File rows point at missing files: {missing[:50]}")
+
+        self.stdout.write(self.style.SUCCESS("Done."))
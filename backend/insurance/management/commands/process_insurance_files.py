@@ -0,0 +1,71 @@
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from insurance.gc import drain_pending
+from insurance.processing import claim_next, get_stages, release, run_job, worker_name
+
+
+class Command(BaseCommand):
+    help = "Run the insurance file processing pipeline over queued jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help="Jobs processed at the same time.")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        stages = get_stages()
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            stopping.set()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        def process(job):
+            try:
+                return run_job(job, stages)
+            finally:
+                close_old_connections()
+
+        processed = 0
+        running = set()
+        self.stdout.write(f"Worker {worker} started with {options['threads']} threads.")
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            try:
+                while not stopping.is_set():
+                    if len(running) >= options['threads']:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        processed += len(done)
+                        continue
+
+                    job = claim_next(worker)
+                    if job is not None:
+                        running.add(pool.submit(process, job))
+                        continue
+
+                    if not running:
+                        # idle: clear files queued for deletion by FileDeleteView
+                        drain_pending()
+                    if options['once'] and not running:
+                        break
+                    if running:
+                        done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                        processed += len(done)
+                    else:
+                        stopping.wait(options['poll_interval'])
+            finally:
+                # let jobs in flight finish; anything this process never ran goes back to the queue
+                done, _ = wait(running)
+                processed += len(done)
+                released = release(worker)
+                if released:
+                    self.stdout.write(f"Returned {released} jobs to the queue.")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} files."))
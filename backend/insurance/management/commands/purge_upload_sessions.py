@@ -0,0 +1,61 @@
+import shutil
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from insurance.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete chunked upload sessions that have not received a chunk for a while, and their chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-hours', type=int, default=settings.INSURANCE_UPLOAD_SESSION_TTL_HOURS,
+            help="Purge sessions last touched more than this many hours ago.",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be removed.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['older_than_hours'])
+        dry_run = options['dry_run']
+
+        stale = UploadSession.objects.filter(updated_at__lt=cutoff)
+        purged = 0
+        for upload in stale.iterator():
+            if not dry_run:
+                upload.discard()
+                upload.delete()
+            purged += 1
+
+        # chunk directories whose session row is already gone (e.g. a crash mid-complete)
+        orphans = 0
+        upload_dir = Path(settings.INSURANCE_UPLOAD_DIR)
+        if upload_dir.exists():
+            live = {str(pk) for pk in UploadSession.objects.values_list('id', flat=True)}
+            for path in upload_dir.iterdir():
+                if not path.is_dir() or path.name in live or not _is_uuid(path.name):
+                    continue
+                if path.stat().st_mtime > cutoff.timestamp():
+                    continue
+                if not dry_run:
+                    shutil.rmtree(path, ignore_errors=True)
+                orphans += 1
+
+        verb = "Would purge" if dry_run else "Purged"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {purged} upload sessions idle since before {cutoff:%Y-%m-%d %H:%M} "
+            f"and {orphans} orphaned chunk directories."
+        ))
+
+
+def _is_uuid(name):
+    try:
+        uuid.UUID(name)
+    except ValueError:
+        return False
+    return True
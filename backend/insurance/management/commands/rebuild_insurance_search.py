@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from insurance.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = "Recreate the insurance document full-text index and its triggers, then reindex every file."
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Insurance search uses SQLite FTS5 and needs a SQLite database.")
+
+        install_search_index(connection, rebuild=True)
+        self.stdout.write(self.style.SUCCESS("Insurance search index rebuilt."))
@@ -1,17 +1,246 @@
-from django.db import models
+import shutil
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 
 # Create your models here.
 from userauth.models import User
+from .storage import cas_storage, insurance_storage, sha256_of
+
+
+
+class BlobManager(models.Manager):
+    def acquire(self, content, original_name = ''):
+        """
+        Store `content` once and take a reference to it. Identical bytes
+        uploaded again, by anyone, come back as the existing blob.
+        """
+        return self.acquire_many([(content, original_name)])[0]
+
+    def acquire_many(self, uploads):
+        """
+        acquire() for a list of (content, original_name) pairs, with a fixed
+        number of queries however many there are: one lookup, one insert of
+        the new blobs, one re-read, and one reference UPDATE per distinct
+        increment (usually just one).
+        """
+        digests = [sha256_of(content) for content, _ in uploads]
+        with transaction.atomic():
+            blobs = {blob.sha256: blob for blob in self.select_for_update().filter(sha256__in = set(digests))}
+            new = {}
+            for sha256, (content, original_name) in zip(digests, uploads):
+                if sha256 not in blobs and sha256 not in new:
+                    new[sha256] = Blob(sha256 = sha256, name = cas_storage.blob_name(sha256, original_name), size = content.size)
+            if new:
+                # a concurrent upload may have inserted the same bytes; re-read to get its row
+                self.bulk_create(new.values(), ignore_conflicts = True)
+                blobs = {blob.sha256: blob for blob in self.select_for_update().filter(sha256__in = set(digests))}
+
+            stored = set()
+            for sha256, (content, _) in zip(digests, uploads):
+                blob = blobs[sha256]
+                if sha256 not in stored and (sha256 in new or not cas_storage.exists(blob.name)):
+                    cas_storage.save(blob.name, content)
+                stored.add(sha256)
+
+            increments = {}
+            for sha256, count in Counter(digests).items():
+                increments.setdefault(count, []).append(blobs[sha256].pk)
+                blobs[sha256].ref_count += count
+            for count, pks in increments.items():
+                self.filter(pk__in = pks).update(ref_count = F('ref_count') + count)
+        return [blobs[sha256] for sha256 in digests]
+
+    def release(self, blob_id):
+        """
+        Drop a reference. The last one removes the row and queues the bytes
+        for deletion (see insurance.gc), in the same transaction.
+        """
+        with transaction.atomic():
+            self.filter(pk = blob_id).update(ref_count = F('ref_count') - 1)
+            blob = self.select_for_update().filter(pk = blob_id, ref_count__lte = 0).first()
+            if blob is None:
+                return
+            blob.delete()
+            PendingBlobDeletion.objects.get_or_create(name = blob.name)
+
+
+# DEDUPLICATED STORAGE: one row per distinct document, shared by every File with those bytes
+class Blob(models.Model):
+    sha256 = models.CharField( max_length = 64, unique = True)
+    name = models.CharField( max_length = 255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField( default = 0)
+    created_at = models.DateTimeField( auto_now_add = True)
+
+    objects = BlobManager()
 
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
+
+class FileManager(models.Manager):
+    def bulk_store(self, files):
+        """
+        bulk_create() for new File instances with uploaded content: the uploads
+        go to their blobs together (BlobManager.acquire_many), then all rows and
+        their processing jobs are inserted with one query each, in one transaction.
+        """
+        with transaction.atomic():
+            blobs = Blob.objects.acquire_many([(file_instance.file.file, file_instance.file.name) for file_instance in files])
+            for file_instance, blob in zip(files, blobs):
+                file_instance.blob = blob
+                file_instance.file.name = blob.name
+                file_instance.file._committed = True
+            created = self.bulk_create(files)
+            ProcessingJob.objects.bulk_create([ProcessingJob(file = file_instance) for file_instance in created])
+        return created
 
 
 class File(models.Model):
+    PROCESSING_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete = models.CASCADE)
     insurance_company = models.CharField( max_length = 300)
     file_name = models.CharField( max_length = 200)
-    file  = models.FileField( upload_to = 'insurance_files')
+    file  = models.FileField( upload_to = 'insurance_files', storage = insurance_storage)
+    blob = models.ForeignKey(Blob, on_delete = models.PROTECT, null = True, blank = True, related_name = "files")
     uploaded_at = models.DateTimeField( auto_now_add  = True)
+    # filled in by the processing pipeline (insurance.processing)
+    processing_status = models.CharField( max_length = 20, choices = PROCESSING_CHOICES, default = 'pending')
+    metadata = models.JSONField( default = dict, blank = True)
+    
+    objects = FileManager()
     
+    class Meta:
+        indexes = [
+            # per-user listings, newest first (insurance.pagination.FileCursorPagination)
+            models.Index(fields = ['user', 'uploaded_at'], name = 'insurance_file_user_idx'),
+        ]
     
+    def save(self, *args, **kwargs):
+        # new content goes through Blob.objects.acquire() instead of being written
+        # out by FileField; the reference is only kept if the row is saved too
+        with transaction.atomic():
+            adding = self._state.adding
+            if self.file and not self.file._committed:
+                self.blob = Blob.objects.acquire(self.file.file, self.file.name)
+                self.file.name = self.blob.name
+                self.file._committed = True
+            super().save(*args, **kwargs)
+            if adding:
+                ProcessingJob.objects.create(file = self)
+
     def __str__(self):
         return self.file_name
+
+
+# CHUNKED UPLOADS: one row per upload in progress; the chunks themselves live on
+# disk under INSURANCE_UPLOAD_DIR/<id>/ until the upload is finalized.
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key = True, default = uuid.uuid4, editable = False)
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = "upload_sessions")
+    insurance_company = models.CharField( max_length = 300)
+    file_name = models.CharField( max_length = 200)
+    original_name = models.CharField( max_length = 255)
+    total_size = models.BigIntegerField( null = True, blank = True)
+    chunk_size = models.PositiveIntegerField()
+    created_at = models.DateTimeField( auto_now_add = True)
+    updated_at = models.DateTimeField( auto_now = True, db_index = True)
+
+    @property
+    def directory(self):
+        return Path(settings.INSURANCE_UPLOAD_DIR) / str(self.id)
+
+    def chunk_path(self, index):
+        return self.directory / f"{index:06d}.chunk"
+
+    @property
+    def expected_chunks(self):
+        """How many chunks make up the upload, or None when its total size was not declared."""
+        if self.total_size is None:
+            return None
+        # an empty file is still sent as one (empty) chunk
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def accepts_chunk(self, index):
+        # without a declared size, no more chunks than the largest upload allowed needs
+        limit = self.expected_chunks or -(-settings.INSURANCE_UPLOAD_MAX_SIZE // self.chunk_size)
+        return index < limit
+
+    def received_chunks(self):
+        if not self.directory.exists():
+            return []
+        return sorted(int(path.stem) for path in self.directory.glob("*.chunk"))
+
+    def received_bytes(self):
+        if not self.directory.exists():
+            return 0
+        return sum(path.stat().st_size for path in self.directory.glob("*.chunk"))
+
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def __str__(self):
+        return f"{self.original_name} ({self.id})"
+
+
+# DELETE QUEUE: stored files nothing points at any more, removed by insurance.gc.drain_pending()
+# from `manage.py gc_insurance_storage` and the processing worker
+class PendingBlobDeletion(models.Model):
+    name = models.CharField( max_length = 255, unique = True)
+    queued_at = models.DateTimeField( auto_now_add = True)
+
+    def __str__(self):
+        return self.name
+
+
+# PROCESSING QUEUE: one job per uploaded File, claimed by `manage.py process_insurance_files`.
+# A running job holds a lease; if its worker dies the lease runs out and another worker
+# picks the job up again, so a restart never loses work.
+class ProcessingJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    file = models.ForeignKey(File, on_delete = models.CASCADE, related_name = "processing_jobs")
+    status = models.CharField( max_length = 20, choices = STATUS_CHOICES, default = 'queued')
+    attempts = models.PositiveIntegerField( default = 0)
+    run_after = models.DateTimeField( default = timezone.now)
+    locked_by = models.CharField( max_length = 100, blank = True)
+    locked_until = models.DateTimeField( null = True, blank = True)
+    last_error = models.TextField( blank = True)
+    created_at = models.DateTimeField( auto_now_add = True)
+    finished_at = models.DateTimeField( null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['status', 'run_after'], name = 'insurance_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_id}: {self.status}"
+
+
+# text pulled out of a document; kept off the File row so listings don't load it.
+# The owner is copied here so the full-text index (insurance.search) can scope by it.
+class ExtractedText(models.Model):
+    file = models.OneToOneField(File, on_delete = models.CASCADE, primary_key = True, related_name = "extracted_text")
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = "+")
+    content = models.TextField()
+
+    def __str__(self):
+        return f"Text of {self.file_id}"
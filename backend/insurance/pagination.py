@@ -0,0 +1,41 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class FileCursorPagination(CursorPagination):
+    """
+    Newest first, walked with a (uploaded_at, id) cursor: each page is a range
+    scan on the (user, uploaded_at) index however many files exist.
+    """
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-uploaded_at', '-id')
+
+
+def filter_files(queryset, params):
+    """?insurance_company=, and ?uploaded_after= / ?uploaded_before= as ISO dates or datetimes."""
+    insurance_company = params.get('insurance_company')
+    if insurance_company:
+        queryset = queryset.filter(insurance_company__iexact = insurance_company)
+
+    for param, lookup in (('uploaded_after', 'uploaded_at__gte'), ('uploaded_before', 'uploaded_at__lt')):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            parsed = parse_datetime(value) or parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({param: "Use an ISO 8601 date or datetime."})
+        if not isinstance(parsed, datetime.datetime):
+            parsed = datetime.datetime.combine(parsed, datetime.time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        queryset = queryset.filter(**{lookup: parsed})
+    return queryset
@@ -0,0 +1,212 @@
+"""
+Post-processing of uploaded insurance files.
+
+Every new File gets a ProcessingJob row (see File.save); the worker command
+`manage.py process_insurance_files` claims jobs from that table and runs the
+stages listed in INSURANCE_PROCESSING_STAGES over them. A stage is a plain
+function `stage(file_instance, context)` returning a dict that is merged into
+File.metadata; `context` is shared by the stages of one job so later stages
+can reuse earlier results (the extracted text, for instance).
+
+Stages that need an optional library (pypdf, Pillow) record that they were
+skipped instead of failing when it is not installed.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ExtractedText, File, ProcessingJob
+
+
+logger = logging.getLogger(__name__)
+
+READ_BLOCK_SIZE = 64 * 1024
+PDF_MAGIC = b'%PDF-'
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp'}
+
+
+def _extension(file_instance):
+    return os.path.splitext(file_instance.file.name)[1].lower()
+
+
+def _is_pdf(file_instance):
+    with file_instance.file.storage.open(file_instance.file.name, 'rb') as fileobj:
+        return fileobj.read(len(PDF_MAGIC)) == PDF_MAGIC
+
+
+# STAGES
+
+def checksum(file_instance, context):
+    digest = hashlib.sha256()
+    size = 0
+    with file_instance.file.storage.open(file_instance.file.name, 'rb') as fileobj:
+        for block in iter(lambda: fileobj.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+            size += len(block)
+    return {'sha256': digest.hexdigest(), 'size': size}
+
+
+PAGE_RE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+
+def page_count(file_instance, context):
+    if not _is_pdf(file_instance):
+        return {'page_count': 1 if _extension(file_instance) in IMAGE_EXTENSIONS else None}
+    try:
+        import pypdf
+    except ImportError:
+        pypdf = None
+
+    if pypdf is not None:
+        with file_instance.file.storage.open(file_instance.file.name, 'rb') as fileobj:
+            reader = pypdf.PdfReader(fileobj)
+            context['pdf_pages'] = [page.extract_text() or '' for page in reader.pages]
+            return {'page_count': len(reader.pages)}
+
+    # No pypdf: count page objects. Good enough for the uncompressed object
+    # streams most scanners write; a count of 0 means we could not tell.
+    pages = 0
+    tail = b''
+    with file_instance.file.storage.open(file_instance.file.name, 'rb') as fileobj:
+        for block in iter(lambda: fileobj.read(READ_BLOCK_SIZE), b''):
+            window = tail + block
+            pages += len(PAGE_RE.findall(window)) - len(PAGE_RE.findall(tail))
+            tail = window[-32:]
+    return {'page_count': pages or None}
+
+
+def extract_text(file_instance, context):
+    if _extension(file_instance) in {'.txt', '.csv'}:
+        with file_instance.file.storage.open(file_instance.file.name, 'rb') as fileobj:
+            text = fileobj.read(settings.INSURANCE_PROCESSING_MAX_TEXT).decode('utf-8', 'replace')
+    elif 'pdf_pages' in context:
+        text = '\n'.join(context['pdf_pages'])
+    elif _is_pdf(file_instance):
+        return {'text_extracted': False, 'text_skipped': 'pypdf is not installed'}
+    else:
+        return {'text_extracted': False}
+
+    text = text[:settings.INSURANCE_PROCESSING_MAX_TEXT]
+    context['text'] = text
+    # saving it is what puts the file in the search index (insurance.search)
+    ExtractedText.objects.update_or_create(
+        file = file_instance, defaults = {'content': text, 'user_id': file_instance.user_id},
+    )
+    return {'text_extracted': True, 'text_length': len(text)}
+
+
+def thumbnail(file_instance, context):
+    if _extension(file_instance) not in IMAGE_EXTENSIONS:
+        return {'thumbnail': None}
+    try:
+        from PIL import Image
+    except ImportError:
+        return {'thumbnail': None, 'thumbnail_skipped': 'Pillow is not installed'}
+
+    storage = file_instance.file.storage
+    with storage.open(file_instance.file.name, 'rb') as fileobj:
+        image = Image.open(fileobj)
+        image.thumbnail(settings.INSURANCE_THUMBNAIL_SIZE)
+        out = io.BytesIO()
+        image.convert('RGB').save(out, 'JPEG', quality = 80)
+
+    key = file_instance.blob.sha256 if file_instance.blob_id else f"file-{file_instance.id}"
+    name = f"insurance_previews/{key}.jpg"
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(out.getvalue()))
+    return {'thumbnail': name}
+
+
+def get_stages():
+    return [import_string(path) for path in settings.INSURANCE_PROCESSING_STAGES]
+
+
+# QUEUE
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next(worker, lease = None):
+    """
+    Claim the oldest runnable job for `worker`, or return None.
+
+    Claiming is a conditional UPDATE on the row's current state, so two
+    workers racing for the same job can't both win, on any database. Jobs
+    whose lease has run out (their worker died) are runnable again.
+    """
+    lease = lease or timedelta(seconds = settings.INSURANCE_PROCESSING_LEASE_SECONDS)
+    now = timezone.now()
+    runnable = (
+        Q(status = 'queued', run_after__lte = now)
+        | Q(status = 'running', locked_until__lt = now)
+    )
+    for job in ProcessingJob.objects.filter(runnable).order_by('run_after', 'id').only('id', 'status', 'locked_until')[:10]:
+        claimed = ProcessingJob.objects.filter(
+            pk = job.pk, status = job.status, locked_until = job.locked_until,
+        ).update(
+            status = 'running', locked_by = worker, locked_until = now + lease,
+            attempts = F('attempts') + 1,
+        )
+        if claimed:
+            return ProcessingJob.objects.select_related('file', 'file__blob').get(pk = job.pk)
+    return None
+
+
+def run_job(job, stages = None):
+    file_instance = job.file
+    File.objects.filter(pk = file_instance.pk).update(processing_status = 'processing')
+
+    metadata = dict(file_instance.metadata)
+    context = {}
+    try:
+        for stage in stages or get_stages():
+            metadata.update(stage(file_instance, context) or {})
+    except Exception as e:
+        logger.exception("Processing file %s failed", file_instance.pk)
+        _fail(job, e)
+        return False
+
+    metadata['processed_at'] = timezone.now().isoformat()
+    with transaction.atomic():
+        File.objects.filter(pk = file_instance.pk).update(processing_status = 'done', metadata = metadata)
+        ProcessingJob.objects.filter(pk = job.pk, locked_by = job.locked_by).update(
+            status = 'done', finished_at = timezone.now(), locked_until = None, last_error = '',
+        )
+    return True
+
+
+def _fail(job, error):
+    max_attempts = settings.INSURANCE_PROCESSING_MAX_ATTEMPTS
+    if job.attempts >= max_attempts:
+        with transaction.atomic():
+            File.objects.filter(pk = job.file_id).update(processing_status = 'failed')
+            ProcessingJob.objects.filter(pk = job.pk, locked_by = job.locked_by).update(
+                status = 'failed', finished_at = timezone.now(), locked_until = None, last_error = repr(error),
+            )
+        return
+    # retry with a growing delay: 30s, 2m, 8m, ...
+    delay = timedelta(seconds = 30 * 4 ** (job.attempts - 1))
+    with transaction.atomic():
+        File.objects.filter(pk = job.file_id).update(processing_status = 'pending')
+        ProcessingJob.objects.filter(pk = job.pk, locked_by = job.locked_by).update(
+            status = 'queued', run_after = timezone.now() + delay, locked_until = None, last_error = repr(error),
+        )
+
+
+def release(worker):
+    """Hand the jobs `worker` still holds back to the queue, e.g. on shutdown."""
+    return ProcessingJob.objects.filter(status = 'running', locked_by = worker).update(
+        status = 'queued', locked_until = None, attempts = F('attempts') - 1,
+    )
@@ -0,0 +1,116 @@
+"""
+Full-text search over the text of insurance documents, with SQLite FTS5.
+
+insurance_file_fts is an external-content index over the text the processing
+pipeline extracts (insurance_extractedtext, keyed by file id), so nothing is
+stored twice and indexing never runs on the request path. Like chat search,
+it indexes an `owner` column ("u<user_id>") to scope a query to the caller's
+files inside the index. Triggers add, replace and remove entries as
+ExtractedText rows come and go; deleting a File cascades to its text.
+
+Django rebuilds a SQLite table (dropping its triggers) when a migration alters
+it; run `manage.py rebuild_insurance_search` after such a migration.
+"""
+from django.db import connection
+
+from chat.search import as_datetime, fts_match_expression, highlight
+
+
+INDEX_TABLE = 'insurance_file_fts'
+
+SOURCE_VIEW_SQL = """
+CREATE VIEW IF NOT EXISTS insurance_file_search AS
+SELECT file_id AS id, content, 'u' || user_id AS owner
+FROM insurance_extractedtext
+"""
+
+INDEX_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS insurance_file_fts USING fts5(
+    content, owner,
+    content='insurance_file_search', content_rowid='id',
+    tokenize='porter unicode61'
+)
+"""
+
+TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS insurance_file_fts_insert AFTER INSERT ON insurance_extractedtext BEGIN
+        INSERT INTO insurance_file_fts(rowid, content, owner)
+        VALUES (new.file_id, new.content, 'u' || new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS insurance_file_fts_delete AFTER DELETE ON insurance_extractedtext BEGIN
+        INSERT INTO insurance_file_fts(insurance_file_fts, rowid, content, owner)
+        VALUES ('delete', old.file_id, old.content, 'u' || old.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS insurance_file_fts_update
+    AFTER UPDATE OF content, user_id ON insurance_extractedtext BEGIN
+        INSERT INTO insurance_file_fts(insurance_file_fts, rowid, content, owner)
+        VALUES ('delete', old.file_id, old.content, 'u' || old.user_id);
+        INSERT INTO insurance_file_fts(rowid, content, owner)
+        VALUES (new.file_id, new.content, 'u' || new.user_id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS insurance_file_fts_insert",
+    "DROP TRIGGER IF EXISTS insurance_file_fts_delete",
+    "DROP TRIGGER IF EXISTS insurance_file_fts_update",
+    "DROP TABLE IF EXISTS insurance_file_fts",
+    "DROP VIEW IF EXISTS insurance_file_search",
+]
+
+SEARCH_SQL = """
+SELECT f.id, f.file_name, f.insurance_company, f.uploaded_at,
+       snippet(insurance_file_fts, 0, char(1), char(2), '…', 16),
+       bm25(insurance_file_fts, 1.0, 0.0)
+FROM insurance_file_fts
+JOIN insurance_file f ON f.id = insurance_file_fts.rowid
+WHERE insurance_file_fts MATCH %s
+ORDER BY bm25(insurance_file_fts, 1.0, 0.0)
+LIMIT %s
+"""
+
+
+def install_search_index(db_connection=connection, rebuild=True):
+    with db_connection.cursor() as cursor:
+        cursor.execute(SOURCE_VIEW_SQL)
+        cursor.execute(INDEX_SQL)
+        for statement in TRIGGERS_SQL:
+            cursor.execute(statement)
+        if rebuild:
+            cursor.execute(f"INSERT INTO {INDEX_TABLE}({INDEX_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(db_connection=connection):
+    with db_connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+def search_files(user_id, text, limit):
+    expression = fts_match_expression(text)
+    if expression is None:
+        return []
+    match = f'owner : "u{int(user_id)}" AND content : ({expression})'
+
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL, [match, limit])
+        rows = cursor.fetchall()
+
+    return [
+        {
+            'id': file_id,
+            'file_name': file_name,
+            'insurance_company': insurance_company,
+            'uploaded_at': as_datetime(uploaded_at),
+            'snippet': highlight(snippet_text),
+            # bm25 is lower for better matches; flip it so higher means more relevant
+            'score': round(-rank, 4),
+        }
+        for file_id, file_name, insurance_company, uploaded_at, snippet_text, rank in rows
+    ]
@@ -1,5 +1,6 @@
+from django.urls import reverse
 from rest_framework import serializers 
-from .models import File
+from .models import File, UploadSession
 
 
 
@@ -9,5 +10,31 @@ class FileSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = File
-        fields = [ 'id', 'user', 'insurance_company', 'file_name', 'file', 'uploaded_at']
-        read_only_fields = ['uploaded_at']
\ No newline at end of file
+        fields = [ 'id', 'user', 'insurance_company', 'file_name', 'file', 'uploaded_at', 'processing_status', 'metadata']
+        read_only_fields = ['uploaded_at', 'processing_status', 'metadata']
+
+    def to_representation(self, instance):
+        # link to FileDownloadView, which checks access and handles ranges and
+        # compressed blobs, not to the storage, which nothing serves
+        data = super().to_representation(instance)
+        url = reverse('doc-download', kwargs = {'fileId': instance.id})
+        request = self.context.get('request')
+        data['file'] = request.build_absolute_uri(url) if request is not None else url
+        return data
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    upload_id = serializers.UUIDField( source = 'id', read_only = True)
+    received_chunks = serializers.SerializerMethodField()
+    received_bytes = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [ 'upload_id', 'insurance_company', 'file_name', 'original_name', 'total_size',
+                   'chunk_size', 'received_chunks', 'received_bytes', 'created_at', 'updated_at']
+        read_only_fields = ['chunk_size', 'created_at', 'updated_at']
+
+    def get_received_chunks(self, obj):
+        return obj.received_chunks()
+
+    def get_received_bytes(self, obj):
+        return obj.received_bytes()
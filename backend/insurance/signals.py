@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Blob, File, PendingBlobDeletion
+
+
+# post_delete also covers queryset deletes and rows cascaded from a deleted user
+@receiver(post_delete, sender = File)
+def release_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        Blob.objects.release(instance.blob_id)
+    elif instance.file and not File.objects.filter(file = instance.file.name).exists():
+        # stored before deduplication and not shared
+        PendingBlobDeletion.objects.get_or_create(name = instance.file.name)
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+from .compression import Gzip, Zstd, get_codec, should_compress, zstandard
+
+
+HASH_BLOCK_SIZE = 64 * 1024
+
+# every suffix a stored blob may carry, whichever codec is configured now
+KNOWN_CODECS = [Gzip()] + ([Zstd()] if zstandard is not None else [])
+
+
+def sha256_of(content):
+    """Hex SHA-256 of a Django File, read in blocks and rewound afterwards."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for block in content.chunks(HASH_BLOCK_SIZE):
+        digest.update(block)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct document once, at cas/<first two hex digits>/<sha256><ext>.
+
+    Since a name is derived from the content, a name that already exists
+    holds exactly these bytes: saving it again is a no-op instead of a
+    renamed copy. Legacy names (insurance_files/...) sit in the same
+    location and keep resolving.
+
+    With INSURANCE_STORAGE_COMPRESSION set, blobs are compressed on write
+    (see insurance.compression) and decompressed as a stream on open.
+    """
+
+    prefix = 'cas'
+
+    def blob_name(self, sha256, original_name=''):
+        extension = os.path.splitext(original_name)[1].lower()[:10]
+        return f"{self.prefix}/{sha256[:2]}/{sha256}{extension}"
+
+    def get_available_name(self, name, max_length=None):
+        if name.startswith(self.prefix + '/'):
+            return name
+        return super().get_available_name(name, max_length)
+
+    # COMPRESSION: blobs may sit on disk as <name><codec suffix>; every public
+    # method takes and returns the logical, uncompressed name
+
+    @property
+    def codec(self):
+        return get_codec(settings.INSURANCE_STORAGE_COMPRESSION)
+
+    def _compressed(self, name):
+        """(codec, path) of the compressed copy of `name`, or (None, None)."""
+        path = self.path(name)
+        for codec in KNOWN_CODECS:
+            if os.path.exists(path + codec.suffix):
+                return codec, path + codec.suffix
+        return None, None
+
+    def is_compressed(self, name):
+        return self._compressed(name)[0] is not None
+
+    def logical_name(self, stored_name):
+        for codec in KNOWN_CODECS:
+            if stored_name.startswith(self.prefix + '/') and stored_name.endswith(codec.suffix):
+                return stored_name[:-len(codec.suffix)]
+        return stored_name
+
+    def exists(self, name):
+        return super().exists(name) or self.is_compressed(name)
+
+    def size(self, name):
+        codec, path = self._compressed(name)
+        if codec is None:
+            return super().size(name)
+        return codec.original_size(path)
+
+    def _open(self, name, mode='rb'):
+        codec, path = self._compressed(name)
+        if codec is None:
+            return super()._open(name, mode)
+        # decompresses as it is read; seeking forward decompresses and discards
+        opened = DjangoFile(codec.open(path), name)
+        opened.size = codec.original_size(path)
+        return opened
+
+    def delete(self, name):
+        super().delete(name)
+        _, path = self._compressed(name)
+        if path is not None:
+            os.remove(path)
+
+    def _save(self, name, content):
+        if not name.startswith(self.prefix + '/'):
+            return super()._save(name, content)
+
+        full_path = self.path(name)
+        if self.exists(name):
+            # reused: make it young again so the GC age threshold protects it
+            os.utime(self._compressed(name)[1] or full_path)
+            return name
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok = True)
+
+        codec = self.codec
+        if codec is not None and should_compress(name) and self._store_compressed(codec, name, content):
+            return name
+
+        # Write next to the target and rename into place, so a reader never
+        # sees half a blob and two requests storing the same bytes can't collide.
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite = True)
+        else:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            fd, incoming = tempfile.mkstemp(dir = directory, prefix = '.incoming-')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    for chunk in content.chunks(HASH_BLOCK_SIZE):
+                        out.write(chunk)
+                os.replace(incoming, full_path)
+            finally:
+                if os.path.exists(incoming):
+                    os.unlink(incoming)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def _store_compressed(self, codec, name, source):
+        """
+        Compress `source` into place as name + codec suffix. Returns False,
+        leaving nothing behind, when that would not save at least
+        INSURANCE_STORAGE_MIN_SAVING of the size.
+        """
+        full_path = self.path(name)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        size = source.size
+        fd, incoming = tempfile.mkstemp(dir = os.path.dirname(full_path), prefix = '.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                codec.compress(source, out, size)
+            compressed_size = os.path.getsize(incoming)
+            if compressed_size > size * (1 - settings.INSURANCE_STORAGE_MIN_SAVING):
+                return False
+            os.replace(incoming, full_path + codec.suffix)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path + codec.suffix, self.file_permissions_mode)
+            return True
+        finally:
+            if os.path.exists(incoming):
+                os.unlink(incoming)
+            if hasattr(source, 'seek'):
+                source.seek(0)
+
+    def compress_existing(self, name, codec):
+        """
+        Compress a blob stored before compression was enabled. Returns the
+        (stored size before, after); the same numbers when it was not worth it.
+        """
+        full_path = self.path(name)
+        before = os.path.getsize(full_path)
+        with DjangoFile(open(full_path, 'rb'), name) as source:
+            if not self._store_compressed(codec, name, source):
+                return before, before
+        # readers find the compressed copy first, so there is no window without one
+        os.remove(full_path)
+        return before, os.path.getsize(full_path + codec.suffix)
+
+
+cas_storage = ContentAddressedStorage()
+
+
+# FileField(storage=...) takes a callable, which keeps the storage out of migrations
+def insurance_storage():
+    return cas_storage
@@ -1,3 +1,595 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from userauth.models import User
+from .compression import Gzip
+from .downloads import STREAM_BLOCK_SIZE, RangeNotSatisfiable, parse_range
+from .gc import drain_pending, sweep_storage
+from .models import Blob, File, PendingBlobDeletion, ProcessingJob, UploadSession
+from .processing import claim_next, release, run_job
+from .storage import cas_storage
+
+
+class TemporaryStorageMixin:
+    # uploads and stored blobs go to a throwaway directory per test
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=directory, INSURANCE_UPLOAD_DIR=f'{directory}/uploads')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('patient', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, original_name='policy.txt', client=None):
+        """Store `content` through the upload endpoints, in one chunk; returns the File id."""
+        client = client or self.client
+        response = client.post('/insurance/uploads/', {
+            'insurance_company': 'Acme', 'file_name': 'Policy', 'original_name': original_name,
+            'total_size': len(content), 'chunk_size': len(content),
+        }, format='json')
+        upload_id = response.data['upload_id']
+        client.put(
+            f'/insurance/uploads/{upload_id}/chunks/0/', content, content_type='application/octet-stream',
+        )
+        response = client.post(f'/insurance/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+
+class ChunkedUploadTests(TemporaryStorageMixin, TestCase):
+    def start(self, total_size):
+        response = self.client.post('/insurance/uploads/', {
+            'insurance_company': 'Acme', 'file_name': 'Policy', 'original_name': 'policy.txt',
+            'total_size': total_size, 'chunk_size': 4,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['upload_id']
+
+    def put_chunk(self, upload_id, index, data):
+        return self.client.put(
+            f'/insurance/uploads/{upload_id}/chunks/{index}/', data, content_type='application/octet-stream',
+        )
+
+    def test_expected_chunks(self):
+        self.assertEqual(UploadSession(total_size=10, chunk_size=4).expected_chunks, 3)
+        self.assertEqual(UploadSession(total_size=8, chunk_size=4).expected_chunks, 2)
+        self.assertEqual(UploadSession(total_size=0, chunk_size=4).expected_chunks, 1)
+        self.assertIsNone(UploadSession(chunk_size=4).expected_chunks)
+
+    def test_chunk_past_the_end_is_rejected(self):
+        upload_id = self.start(10)
+        self.assertEqual(self.put_chunk(upload_id, 3, b'xx').status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 999999, b'xx').status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 2, b'xx').status_code, 200)
+
+    def test_undeclared_size_is_bounded_by_the_upload_limit(self):
+        upload_id = self.start(None)
+        with self.settings(INSURANCE_UPLOAD_MAX_SIZE=16):
+            self.assertEqual(self.put_chunk(upload_id, 4, b'xx').status_code, 400)
+            self.assertEqual(self.put_chunk(upload_id, 3, b'xx').status_code, 200)
+
+    def test_missing_trailing_chunks_are_reported(self):
+        upload_id = self.start(10)
+        self.put_chunk(upload_id, 0, b'abcd')
+
+        response = self.client.post(f'/insurance/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('[1, 2]', response.data['error'])
+
+    def test_complete_upload(self):
+        upload_id = self.start(10)
+        for index, data in enumerate((b'abcd', b'efgh', b'ij')):
+            self.assertEqual(self.put_chunk(upload_id, index, data).status_code, 200)
+
+        response = self.client.post(f'/insurance/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(UploadSession.objects.exists())
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_whole_file(self):
+        for header in (None, '', 'bytes=-', 'items=0-5', 'bytes=0-1,5-6', 'bytes=a-b'):
+            self.assertIsNone(parse_range(header, 100), header)
+
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-500', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=99-99', 100), (99, 99))
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=100-', 'bytes=150-200', 'bytes=9-5', 'bytes=-0'):
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range(header, 100)
+
+
+class DownloadTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # several stream blocks of incompressible bytes
+        self.content = bytes(range(256)) * (STREAM_BLOCK_SIZE * 3 // 256) + b'tail'
+        self.url = f'/insurance/file/{self.upload(self.content)}/download/'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.body(response), self.content)
+
+    def test_streams_in_bounded_blocks(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        blocks = list(response.streaming_content)
+        self.assertGreater(len(blocks), 3)
+        self.assertLessEqual(max(len(block) for block in blocks), STREAM_BLOCK_SIZE)
+        self.assertEqual(b''.join(blocks), self.content)
+
+    def test_partial_content(self):
+        size = len(self.content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{size}')
+        self.assertEqual(self.body(response), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b'tail')
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"something-else"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_others_are_refused(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('stranger', password='x'))
+        self.assertEqual(client.get(self.url).status_code, 403)
+
+
+class LargeDownloadTests(TemporaryStorageMixin, TestCase):
+    size = 256 * 1024 * 1024
+
+    def setUp(self):
+        super().setUp()
+        file_id = self.upload(b'placeholder')
+        file_instance = File.objects.select_related('blob').get(pk=file_id)
+        # grow the stored blob into a sparse file: large on paper, nothing on disk
+        with open(cas_storage.path(file_instance.file.name), 'r+b') as stored:
+            stored.truncate(self.size)
+        Blob.objects.filter(pk=file_instance.blob_id).update(size=self.size)
+        self.url = f'/insurance/file/{file_id}/download/'
+
+    def stream(self, **headers):
+        response = self.client.get(self.url, **headers)
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        received = 0
+        for block in response.streaming_content:
+            received += len(block)
+        peak = tracemalloc.get_traced_memory()[1]
+        response.close()
+        return response, received, peak
+
+    def test_memory_stays_flat_over_the_whole_file(self):
+        response, received, peak = self.stream()
+        self.assertEqual(response['Content-Length'], str(self.size))
+        self.assertEqual(received, self.size)
+        self.assertLess(peak, 8 * STREAM_BLOCK_SIZE)
+
+    def test_memory_stays_flat_over_a_large_range(self):
+        response, received, peak = self.stream(HTTP_RANGE=f'bytes={self.size // 4}-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(received, self.size - self.size // 4)
+        self.assertLess(peak, 8 * STREAM_BLOCK_SIZE)
+
+
+@override_settings(INSURANCE_STORAGE_COMPRESSION='gzip')
+class CompressedDownloadTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = b'policy number 12345, covered. ' * 10000
+        self.file_id = self.upload(self.content)
+
+    def test_detail_links_to_the_download_view(self):
+        response = self.client.get(f'/insurance/file/{self.file_id}/')
+        self.assertEqual(response.data['file'], f'http://testserver/insurance/file/{self.file_id}/download/')
+
+    def test_size_comes_from_the_blob_not_the_gzip_trailer(self):
+        url = f'/insurance/file/{self.file_id}/download/'
+        # ISIZE wraps at 4 GiB; the download must not depend on it
+        with mock.patch.object(Gzip, 'original_size', return_value=1):
+            response = self.client.get(url)
+            self.assertEqual(response['Content-Length'], str(len(self.content)))
+            self.assertEqual(b''.join(response.streaming_content), self.content)
+
+            response = self.client.get(url, HTTP_RANGE='bytes=-20')
+            self.assertEqual(response['Content-Range'], f'bytes {len(self.content) - 20}-{len(self.content) - 1}/{len(self.content)}')
+            self.assertEqual(b''.join(response.streaming_content), self.content[-20:])
+
+
+class BlobReferenceTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.stranger = APIClient()
+        self.stranger.force_authenticate(User.objects.create_user('stranger', password='x'))
+
+    def test_same_bytes_share_one_blob(self):
+        first = self.upload(b'Same policy.')
+        second = self.upload(b'Same policy.', client=self.stranger)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(set(File.objects.values_list('blob_id', flat=True)), {blob.pk})
+        self.assertEqual(File.objects.get(pk=first).file.name, File.objects.get(pk=second).file.name)
+        self.assertTrue(cas_storage.exists(blob.name))
+
+    def test_acquire_many_takes_one_reference_per_upload(self):
+        blobs = Blob.objects.acquire_many([
+            (ContentFile(b'a'), 'a.txt'), (ContentFile(b'b'), 'b.txt'), (ContentFile(b'a'), 'a.txt'),
+        ])
+        self.assertEqual(blobs[0], blobs[2])
+        self.assertEqual(
+            dict(Blob.objects.values_list('pk', 'ref_count')), {blobs[0].pk: 2, blobs[1].pk: 1},
+        )
+        self.assertEqual([blob.ref_count for blob in blobs], [2, 1, 2])
+
+    def test_acquire_many_queries_do_not_grow_with_the_batch(self):
+        counts = []
+        for size in (2, 20):
+            with CaptureQueriesContext(connection) as queries:
+                Blob.objects.acquire_many([(ContentFile(f'{size} {n}'.encode()), 'x.txt') for n in range(size)])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_deleting_one_file_keeps_the_blob(self):
+        first = self.upload(b'Same policy.')
+        second = self.upload(b'Same policy.', client=self.stranger)
+
+        self.assertEqual(self.client.delete(f'/insurance/file/delete/{first}/').status_code, 204)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertFalse(PendingBlobDeletion.objects.exists())
+        self.assertEqual(self.stranger.get(f'/insurance/file/{second}/download/').status_code, 200)
+
+    def test_deleting_the_last_file_queues_the_bytes(self):
+        first = self.upload(b'Same policy.')
+        second = self.upload(b'Same policy.', client=self.stranger)
+        name = Blob.objects.get().name
+
+        self.client.delete(f'/insurance/file/delete/{first}/')
+        # queryset deletes release too (post_delete)
+        File.objects.filter(pk=second).delete()
+
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(list(PendingBlobDeletion.objects.values_list('name', flat=True)), [name])
+        # the bytes stay until insurance.gc drains the queue
+        self.assertTrue(cas_storage.exists(name))
+
+
+class GarbageCollectionTests(TemporaryStorageMixin, TestCase):
+    def stored_name(self, file_id):
+        return File.objects.get(pk=file_id).file.name
+
+    def write(self, name, hours_old):
+        path = os.path.join(cas_storage.location, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out:
+            out.write(b'orphan')
+        modified = time.time() - hours_old * 3600
+        os.utime(path, (modified, modified))
+        return path
+
+    def test_drain_deletes_unreferenced_bytes(self):
+        file_id = self.upload(b'Old policy.')
+        name = self.stored_name(file_id)
+        File.objects.filter(pk=file_id).delete()
+
+        self.assertEqual(drain_pending(dry_run=True), (1, 0))
+        self.assertTrue(cas_storage.exists(name))
+        self.assertEqual(drain_pending(), (1, 0))
+        self.assertFalse(cas_storage.exists(name))
+        self.assertFalse(PendingBlobDeletion.objects.exists())
+
+    def test_drain_keeps_bytes_uploaded_again(self):
+        file_id = self.upload(b'Old policy.')
+        name = self.stored_name(file_id)
+        File.objects.filter(pk=file_id).delete()
+        # the same bytes come back before the queue is drained
+        again = self.upload(b'Old policy.')
+
+        self.assertEqual(drain_pending(), (0, 1))
+        self.assertFalse(PendingBlobDeletion.objects.exists())
+        self.assertEqual(self.stored_name(again), name)
+        self.assertEqual(self.client.get(f'/insurance/file/{again}/download/').status_code, 200)
+
+    def test_sweep_removes_old_orphans_only(self):
+        referenced = os.path.join(cas_storage.location, self.stored_name(self.upload(b'Live policy.')))
+        os.utime(referenced, (time.time() - 48 * 3600,) * 2)
+        old_orphan = self.write('cas/ab/' + 'ab' * 32 + '.txt', hours_old=48)
+        new_orphan = self.write('insurance_files/recent.pdf', hours_old=1)
+        old_temp = self.write('cas/cd/.incoming-abc123', hours_old=48)
+        new_temp = self.write('cas/cd/.incoming-def456', hours_old=1)
+
+        stats = sweep_storage(older_than=timedelta(hours=24), dry_run=True)
+        self.assertEqual((stats['scanned'], stats['too_recent'], stats['orphaned']), (5, 2, 2))
+        self.assertTrue(all(os.path.exists(path) for path in (referenced, old_orphan, new_orphan, old_temp, new_temp)))
+
+        self.assertEqual(sweep_storage(older_than=timedelta(hours=24))['orphaned'], 2)
+        self.assertEqual(
+            [os.path.exists(path) for path in (referenced, old_orphan, new_orphan, old_temp, new_temp)],
+            [True, False, True, False, True],
+        )
+
+
+def broken_stage(file_instance, context):
+    raise ValueError('unreadable')
+
+
+class BatchUploadTests(TemporaryStorageMixin, TestCase):
+    url = '/insurance/files/batch/'
+
+    def post(self, *contents, **data):
+        files = [SimpleUploadedFile(f'doc{number}.txt', content) for number, content in enumerate(contents)]
+        return self.client.post(self.url, {'insurance_company': 'Acme', 'files': files, **data})
+
+    def test_all_stored(self):
+        response = self.post(b'first', b'second', file_names=['Card', 'Policy'])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201])
+        self.assertEqual([result['data']['file_name'] for result in response.data['results']], ['Card', 'Policy'])
+        self.assertEqual(set(File.objects.values_list('insurance_company', flat=True)), {'Acme'})
+        self.assertEqual(ProcessingJob.objects.count(), 2)
+
+    def test_names_line_up_with_files_past_a_rejected_one(self):
+        # a missing or blank name falls back to the upload's own name
+        response = self.post(b'first', b'', b'third', file_names=['Card', 'Empty', ''])
+        self.assertEqual(response.status_code, 207)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201, 400, 201])
+        self.assertEqual(results[1]['error'], 'Empty file.')
+        self.assertEqual((results[0]['data']['file_name'], results[2]['data']['file_name']), ('Card', 'doc2.txt'))
+        self.assertEqual(File.objects.count(), 2)
+
+    def test_nothing_stored(self):
+        self.assertEqual(self.client.post(self.url, {'insurance_company': 'Acme'}).status_code, 400)
+        response = self.post(b'')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['status'], 400)
+        with self.settings(INSURANCE_UPLOAD_MAX_SIZE=4):
+            self.assertEqual(self.post(b'too large').data['results'][0]['status'], 413)
+        self.assertFalse(File.objects.exists())
+
+    @override_settings(INSURANCE_BATCH_MAX_FILES=2)
+    def test_too_many_files(self):
+        response = self.post(b'one', b'two', b'three')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 2', response.data['error'])
+        self.assertFalse(File.objects.exists())
+
+    def test_one_insert_per_table(self):
+        runs = []
+        for size in (2, 10):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post(*[f'{size} {n}'.encode() for n in range(size)]).status_code, 201)
+            statements = [query['sql'] for query in queries.captured_queries]
+            inserted = sorted(sql.split('"')[1] for sql in statements if sql.startswith('INSERT'))
+            runs.append((inserted, len(statements)))
+        self.assertEqual(runs[0][0], ['insurance_blob', 'insurance_file', 'insurance_processingjob'])
+        self.assertEqual(runs[0], runs[1])
+
+
+class FileListTests(TemporaryStorageMixin, TestCase):
+    url = '/insurance/files/create/'
+
+    def setUp(self):
+        super().setUp()
+        self.stranger = User.objects.create_user('stranger', password='x')
+
+    def make(self, uploaded_at, insurance_company='Acme', user=None):
+        file_instance = File(
+            user=user or self.user, insurance_company=insurance_company, file_name='Policy',
+            file=SimpleUploadedFile('policy.txt', f'{insurance_company} {uploaded_at}'.encode()),
+        )
+        file_instance.save()
+        File.objects.filter(pk=file_instance.pk).update(uploaded_at=uploaded_at)
+        return file_instance.pk
+
+    def ids(self, params=None):
+        response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.data['results']]
+
+    def test_lists_only_the_callers_files_newest_first(self):
+        older = self.make(datetime(2024, 1, 10, tzinfo=dt_timezone.utc))
+        newer = self.make(datetime(2024, 2, 10, tzinfo=dt_timezone.utc))
+        self.make(datetime(2024, 3, 10, tzinfo=dt_timezone.utc), user=self.stranger)
+
+        self.assertEqual(self.ids(), [newer, older])
+
+    def test_filters(self):
+        january = self.make(datetime(2024, 1, 10, tzinfo=dt_timezone.utc), 'Acme')
+        february = self.make(datetime(2024, 2, 10, 12, tzinfo=dt_timezone.utc), 'Globex')
+        march = self.make(datetime(2024, 3, 10, tzinfo=dt_timezone.utc), 'acme')
+
+        self.assertEqual(self.ids({'insurance_company': 'ACME'}), [march, january])
+        self.assertEqual(self.ids({'uploaded_after': '2024-02-01'}), [march, february])
+        self.assertEqual(self.ids({'uploaded_before': '2024-02-10'}), [january])
+        self.assertEqual(self.ids({'uploaded_after': '2024-02-10T12:00:00Z', 'uploaded_before': '2024-03-10'}), [february])
+        self.assertEqual(self.ids({'insurance_company': 'acme', 'uploaded_after': '2024-02-01'}), [march])
+
+    def test_bad_dates_are_rejected(self):
+        for param, value in (('uploaded_after', 'yesterday'), ('uploaded_before', '2024-13-45')):
+            response = self.client.get(self.url, {param: value})
+            self.assertEqual(response.status_code, 400, value)
+            self.assertIn(param, response.data)
+
+    def test_cursor_walks_every_file_once(self):
+        same_time = datetime(2024, 1, 10, tzinfo=dt_timezone.utc)
+        # ties on uploaded_at are broken by id
+        expected = sorted((self.make(same_time) for _ in range(3)), reverse=True)
+        expected = [self.make(datetime(2024, 2, 10, tzinfo=dt_timezone.utc))] + expected
+
+        seen, pages = [], []
+        url = f'{self.url}?limit=3'
+        while url:
+            response = self.client.get(url)
+            pages.append(len(response.data['results']))
+            seen.extend(result['id'] for result in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(pages, [3, 1])
+        self.assertEqual(seen, expected)
+
+
+class ProcessingQueueTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.file_id = self.upload(b'Dental cover up to 500 a year.')
+        self.job = ProcessingJob.objects.get(file_id=self.file_id)
+
+    def fail_once(self):
+        job = claim_next('worker-a')
+        self.assertEqual(job.pk, self.job.pk)
+        with self.assertLogs('insurance.processing', 'ERROR'):
+            self.assertFalse(run_job(job, stages=[broken_stage]))
+        self.job.refresh_from_db()
+
+    def make_runnable(self):
+        ProcessingJob.objects.filter(pk=self.job.pk).update(run_after=timezone.now())
+
+    def test_claim_leases_the_job_to_one_worker(self):
+        job = claim_next('worker-a', lease=timedelta(minutes=5))
+        self.assertEqual((job.pk, job.status, job.locked_by, job.attempts), (self.job.pk, 'running', 'worker-a', 1))
+        self.assertAlmostEqual((job.locked_until - timezone.now()).total_seconds(), 300, delta=5)
+        self.assertIsNone(claim_next('worker-b'))
+
+    def test_expired_lease_is_taken_over(self):
+        claim_next('worker-a')
+        ProcessingJob.objects.filter(pk=self.job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        job = claim_next('worker-b')
+        self.assertEqual((job.pk, job.locked_by, job.attempts), (self.job.pk, 'worker-b', 2))
+        self.assertTrue(run_job(job))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'done')
+
+    def test_failures_are_retried_with_a_growing_delay(self):
+        for delay in (30, 120):
+            self.fail_once()
+            self.assertEqual(self.job.status, 'queued')
+            self.assertEqual(self.job.last_error, "ValueError('unreadable')")
+            self.assertAlmostEqual((self.job.run_after - timezone.now()).total_seconds(), delay, delta=5)
+            self.assertIsNone(claim_next('worker-b'))
+            self.assertEqual(File.objects.get(pk=self.file_id).processing_status, 'pending')
+            self.make_runnable()
+
+    @override_settings(INSURANCE_PROCESSING_MAX_ATTEMPTS=2)
+    def test_gives_up_after_the_last_attempt(self):
+        self.fail_once()
+        self.make_runnable()
+        self.fail_once()
+
+        self.assertEqual(self.job.status, 'failed')
+        self.assertIsNotNone(self.job.finished_at)
+        self.assertEqual(File.objects.get(pk=self.file_id).processing_status, 'failed')
+        self.make_runnable()
+        self.assertIsNone(claim_next('worker-b'))
+
+    def test_release_hands_held_jobs_back(self):
+        claim_next('worker-a')
+        self.assertEqual(release('worker-b'), 0)
+        self.assertEqual(release('worker-a'), 1)
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts, self.job.locked_until), ('queued', 0, None))
+        self.assertEqual(claim_next('worker-b').attempts, 1)
+
+
+class FileSearchTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.stranger = APIClient()
+        self.stranger.force_authenticate(User.objects.create_user('stranger', password='x'))
+
+    def process(self):
+        # what process_insurance_files does: extracting the text is what indexes it
+        while (job := claim_next('test-worker')) is not None:
+            self.assertTrue(run_job(job))
+
+    def search(self, query, client=None):
+        response = (client or self.client).get('/insurance/files/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def indexed(self, query):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM insurance_file_fts WHERE insurance_file_fts MATCH %s", [query])
+            return cursor.fetchone()[0]
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/insurance/files/search/').status_code, 400)
+
+    def test_only_the_callers_files_are_found(self):
+        own = self.upload(b'Dental cover up to 500 a year.')
+        self.upload(b'Dental cover for the whole family.', client=self.stranger)
+        self.process()
+
+        self.assertEqual([result['id'] for result in self.search('dental')], [own])
+        self.assertEqual(len(self.search('dental', client=self.stranger)), 1)
+        self.assertEqual(self.search('family'), [])
+
+    def test_better_matches_rank_first(self):
+        passing = self.upload(b'Travel cover, luggage, delays, and one line on dental emergencies abroad.')
+        focused = self.upload(b'Dental plan: dental checkups, dental surgery and dental x-rays.')
+        # bm25 only scores a term above zero when fewer than half of the documents have it
+        for number in range(3):
+            self.upload(f'Home insurance, policy {number}.'.encode(), client=self.stranger)
+        self.process()
+
+        results = self.search('dental')
+        self.assertEqual([result['id'] for result in results], [focused, passing])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertIn('<mark>', results[0]['snippet'])
+
+    def test_deleting_a_file_removes_it_from_the_index(self):
+        file_id = self.upload(b'Vision cover for glasses and lenses.')
+        self.process()
+        self.assertEqual(self.indexed('vision'), 1)
+
+        self.assertEqual(self.client.delete(f'/insurance/file/delete/{file_id}/').status_code, 204)
+        self.assertEqual(self.indexed('vision'), 0)
+        self.assertEqual(self.search('vision'), [])
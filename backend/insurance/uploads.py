@@ -0,0 +1,86 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChunkTooLarge(Exception):
+    pass
+
+
+class IncompleteUpload(Exception):
+    pass
+
+
+class AssembledUpload(DjangoFile):
+    """
+    A finished upload on local disk. Exposing temporary_file_path() lets
+    FileSystemStorage move it into place instead of copying it again.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def write_chunk(session, index, stream, max_size):
+    """
+    Stream a request body into chunk `index` of `session`, never holding more
+    than one read block in memory. The chunk only appears under its final
+    name once it is complete, so a dropped connection leaves nothing behind
+    that assemble() could mistake for data; re-sending a chunk replaces it.
+    """
+    session.directory.mkdir(parents = True, exist_ok = True)
+    final_path = session.chunk_path(index)
+    partial_path = final_path.with_suffix('.partial')
+
+    size = 0
+    try:
+        with open(partial_path, 'wb') as out:
+            while True:
+                block = stream.read(READ_BLOCK_SIZE) if stream is not None else b''
+                if not block:
+                    break
+                size += len(block)
+                if size > max_size:
+                    raise ChunkTooLarge(f"A chunk can be at most {max_size} bytes.")
+                out.write(block)
+        os.replace(partial_path, final_path)
+    finally:
+        if partial_path.exists():
+            partial_path.unlink()
+    return size
+
+
+def assemble(session):
+    """Concatenate the chunks of `session`, in order, into one file next to them."""
+    received = session.received_chunks()
+    if not received:
+        raise IncompleteUpload("No chunks were uploaded.")
+    expected = session.expected_chunks if session.expected_chunks is not None else received[-1] + 1
+    missing = sorted(set(range(expected)) - set(received))
+    if missing:
+        raise IncompleteUpload(f"Missing chunks: {missing[:20]}")
+    if session.total_size is not None and session.received_bytes() != session.total_size:
+        raise IncompleteUpload(
+            f"Received {session.received_bytes()} bytes, expected {session.total_size}."
+        )
+
+    assembled_path = session.directory / 'assembled'
+    with open(assembled_path, 'wb') as out:
+        for index in received:
+            with open(session.chunk_path(index), 'rb') as chunk:
+                shutil.copyfileobj(chunk, out, READ_BLOCK_SIZE)
+    return AssembledUpload(open(assembled_path, 'rb'), name = session.original_name)
+
+
+def chunk_size_for(requested):
+    limit = settings.INSURANCE_UPLOAD_MAX_CHUNK_SIZE
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return limit
+    return max(1, min(requested, limit))
@@ -1,12 +1,27 @@
 from django.urls import path
-from .views import FileListCreateView, FileListView, FileDeleteView, FileDetailView
+from .views import (
+    FileListCreateView, FileBatchCreateView, FileListView, FileDeleteView, FileDetailView, FileDownloadView, FileSearchView,
+    UploadSessionCreateView, UploadSessionDetailView, UploadChunkView, UploadCompleteView,
+)
 
 urlpatterns = [
     path('files/create/', FileListCreateView.as_view(), name='file-list-create'),
+
+    path('files/batch/', FileBatchCreateView.as_view(), name='file-batch-create'),
     
     path('files_list/<int:user_id>/', FileListView.as_view(), name='file-list'),
 
     path("file/<int:fileId>/", FileDetailView.as_view(), name="doc-detail"),
 
+    path("file/<int:fileId>/download/", FileDownloadView.as_view(), name="doc-download"),
+
+    path("files/search/", FileSearchView.as_view(), name="file-search"),
+
     path('file/delete/<int:pk>/', FileDeleteView.as_view(), name='file-delete'),
+
+    # chunked, resumable uploads
+    path('uploads/', UploadSessionCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:upload_id>/', UploadSessionDetailView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:upload_id>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload-chunk'),
+    path('uploads/<uuid:upload_id>/complete/', UploadCompleteView.as_view(), name='upload-complete'),
 ]
\ No newline at end of file
@@ -3,16 +3,29 @@ from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from .models import File
-from .serializers import FileSerializer
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.shortcuts import get_object_or_404
+from userauth.authentication import ClaimsJWTAuthentication
+from .models import File, UploadSession
+from .serializers import FileSerializer, UploadSessionSerializer
+from .pagination import FileCursorPagination, filter_files
+from .search import search_files
+from .downloads import can_download, download_response
+from .uploads import ChunkTooLarge, IncompleteUpload, assemble, chunk_size_for, write_chunk
 
 
 
 class FileListCreateView(generics.ListCreateAPIView):
-    queryset = File.objects.all()
     serializer_class = FileSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FileCursorPagination
     parser_class = ( MultiPartParser, FormParser)
     
+    # the caller's own files only
+    def get_queryset(self):
+        return filter_files( File.objects.filter(user = self.request.user), self.request.query_params)
+    
     
     def create(self, request, *args, **kwargs):
         insurance_company = request.data.get('insurance_company', '')
@@ -37,26 +50,121 @@ class FileListCreateView(generics.ListCreateAPIView):
         return Response( serializer.data, status = status.HTTP_201_CREATED)
         
         
+# BATCH UPLOAD: several documents in one multipart request, as repeated `files` parts.
+# `file_names` may repeat alongside them, in the same order; `insurance_company` is shared.
+class FileBatchCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = ( MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        # Every part goes straight to a temporary file on disk, even small ones, so
+        # memory stays flat however many files or bytes the request carries; storage
+        # then moves or compresses each from disk.
+        request._request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
+
+        uploads = request.FILES.getlist('files')
+        if not uploads:
+            return Response( {"error": "No files were sent."}, status = status.HTTP_400_BAD_REQUEST)
+        if len(uploads) > settings.INSURANCE_BATCH_MAX_FILES:
+            return Response(
+                {"error": f"A batch can hold at most {settings.INSURANCE_BATCH_MAX_FILES} files."},
+                status = status.HTTP_400_BAD_REQUEST
+            )
+
+        insurance_company = request.data.get('insurance_company', '')
+        file_names = request.data.getlist('file_names')
+
+        results = [None] * len(uploads)
+        pending = []
+        for index, upload in enumerate(uploads):
+            if not upload.size:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST, "error": "Empty file."}
+                continue
+            if upload.size > settings.INSURANCE_UPLOAD_MAX_SIZE:
+                results[index] = {
+                    "index": index, "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    "error": f"Files can be at most {settings.INSURANCE_UPLOAD_MAX_SIZE} bytes.",
+                }
+                continue
+            file_name = file_names[index] if index < len(file_names) and file_names[index] else upload.name
+            pending.append((index, File(
+                user = request.user,
+                insurance_company = insurance_company,
+                file_name = file_name[:200],
+                file = upload,
+            )))
+
+        created = File.objects.bulk_store([file_instance for _, file_instance in pending]) if pending else []
+
+        for (index, _), file_instance in zip(pending, created):
+            data = FileSerializer( file_instance, context = {'request': request}).data
+            results[index] = {"index": index, "status": status.HTTP_201_CREATED, "data": data}
+
+        if not created:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(created) < len(uploads):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response( {"results": results}, status = response_status)
+
+
 # LIST OF ALL INSURANCE FILES
 class FileListView(generics.ListAPIView):
     serializer_class = FileSerializer
+    authentication_classes = [ ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = FileCursorPagination
     
     def get_queryset(self):
         user_id  = self.kwargs['user_id']
-        return File.objects.filter(user_id = user_id)
+        return filter_files( File.objects.filter(user_id = user_id), self.request.query_params)
     
 # DETAILED VIEW OF ONE FILE
 class FileDetailView(APIView):
+    authentication_classes = [ ClaimsJWTAuthentication]
+
     def get(self, request, fileId, *args, **kwargs):
         try:
             uploaded_file = File.objects.get(id = fileId)
-            serializer = FileSerializer( uploaded_file)
+            serializer = FileSerializer( uploaded_file, context = {'request': request})
             return Response( serializer.data, status = status.HTTP_200_OK)
         except File.DoesNotExist:
             return Response(
                 {"error": "Insurance not found"}, status = status.HTTP_404_NOT_FOUND
             )
+
+# DOWNLOAD: streams the bytes, with Range and conditional GET support
+class FileDownloadView(APIView):
+    authentication_classes = [ ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, fileId, *args, **kwargs):
+        uploaded_file = get_object_or_404( File.objects.select_related('blob'), id = fileId)
+        if not can_download( request.user, uploaded_file):
+            return Response(
+                {"error": "You do not have permission to download this file."},
+                status = status.HTTP_403_FORBIDDEN
+            )
+        return download_response( request, uploaded_file)
+
+# SEARCH: ranked full-text search over the text of the caller's own documents
+class FileSearchView(APIView):
+    authentication_classes = [ ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response( {"error": "q is required."}, status = status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', FileCursorPagination.page_size))
+        except ValueError:
+            return Response( {"error": "limit must be an integer."}, status = status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, FileCursorPagination.max_page_size))
+
+        return Response( {"results": search_files( request.user.id, query, limit)}, status = status.HTTP_200_OK)
+
 # FILE DELETE VIEW
 class FileDeleteView(generics.DestroyAPIView):
     queryset = File.objects.all()
@@ -66,7 +174,7 @@ class FileDeleteView(generics.DestroyAPIView):
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         
-        if instance.user != request.user:
+        if instance.user_id != request.user.id:
             return Response(
                 {"error": "You do not have permission to delete this file."},
                 status=status.HTTP_403_FORBIDDEN
@@ -78,5 +186,103 @@ class FileDeleteView(generics.DestroyAPIView):
             status=status.HTTP_204_NO_CONTENT
         )
 
-            
-            
+
+# CHUNKED UPLOADS
+# POST uploads/ opens a session, each chunk is PUT to uploads/<id>/chunks/<n>/ as the raw
+# request body, and POST uploads/<id>/complete/ turns the chunks into a File. After a dropped
+# connection, GET uploads/<id>/ lists the chunks that arrived so only the rest are re-sent.
+class UploadSessionCreateView(generics.CreateAPIView):
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer( data = request.data)
+        serializer.is_valid( raise_exception = True)
+
+        total_size = serializer.validated_data.get('total_size')
+        if total_size is not None and total_size > settings.INSURANCE_UPLOAD_MAX_SIZE:
+            return Response(
+                {"error": f"Files can be at most {settings.INSURANCE_UPLOAD_MAX_SIZE} bytes."},
+                status = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        upload = serializer.save(
+            user = request.user,
+            chunk_size = chunk_size_for( request.data.get('chunk_size')),
+        )
+        return Response( self.get_serializer( upload).data, status = status.HTTP_201_CREATED)
+
+
+class UploadSessionDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        upload = get_object_or_404( UploadSession, id = upload_id, user = request.user)
+        return Response( UploadSessionSerializer( upload).data, status = status.HTTP_200_OK)
+
+    # abort
+    def delete(self, request, upload_id, *args, **kwargs):
+        upload = get_object_or_404( UploadSession, id = upload_id, user = request.user)
+        upload.discard()
+        upload.delete()
+        return Response( status = status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, upload_id, index, *args, **kwargs):
+        upload = get_object_or_404( UploadSession, id = upload_id, user = request.user)
+        if not upload.accepts_chunk( index):
+            return Response(
+                {"error": f"Chunk {index} is past the end of the upload."},
+                status = status.HTTP_400_BAD_REQUEST
+            )
+
+        # request.stream is read block by block; request.data is never touched, so the
+        # chunk is not parsed or buffered in memory
+        try:
+            size = write_chunk( upload, index, request.stream, upload.chunk_size)
+        except ChunkTooLarge as e:
+            return Response( {"error": str(e)}, status = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        if upload.received_bytes() > settings.INSURANCE_UPLOAD_MAX_SIZE:
+            upload.chunk_path( index).unlink()
+            return Response(
+                {"error": f"Files can be at most {settings.INSURANCE_UPLOAD_MAX_SIZE} bytes."},
+                status = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        # keeps an active upload clear of purge_upload_sessions
+        upload.save( update_fields = ['updated_at'])
+        return Response( {"index": index, "size": size}, status = status.HTTP_200_OK)
+
+
+class UploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id, *args, **kwargs):
+        upload = get_object_or_404( UploadSession, id = upload_id, user = request.user)
+
+        try:
+            assembled = assemble( upload)
+        except IncompleteUpload as e:
+            return Response(
+                {"error": str(e), "received_chunks": upload.received_chunks()},
+                status = status.HTTP_409_CONFLICT
+            )
+
+        with assembled:
+            file_instance = File(
+                user = request.user,
+                insurance_company = upload.insurance_company,
+                file_name = upload.file_name,
+                file = assembled
+            )
+            file_instance.save()
+
+        upload.discard()
+        upload.delete()
+
+        serializer = FileSerializer( file_instance, context = {'request': request})
+        return Response( serializer.data, status = status.HTTP_201_CREATED)
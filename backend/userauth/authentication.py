@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+UserStatus = namedtuple('UserStatus', ['is_active', 'is_staff', 'is_superuser', 'role', 'password_hash'])
+
+
+class UserStatusCache:
+    """
+    The few User columns a token can't vouch for, per user id, kept in this
+    process for `ttl` seconds: whether the account is active, its staff flags,
+    its role (the token's role claim is as old as the token, up to
+    ACCESS_TOKEN_LIFETIME), and the hash simplejwt's CHECK_REVOKE_TOKEN
+    compares to revoke tokens on a password change.
+
+    A save or delete of the User drops its entry in the process that made it
+    (userauth.signals); other processes see the change within `ttl`.
+    """
+
+    def __init__(self, ttl=30, max_users=10000):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The UserStatus of `user_id`, or None if there is no such user."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        status = self.load(user_id)
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, status)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return status
+
+    def load(self, user_id):
+        row = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id}
+        ).values('is_active', 'is_staff', 'is_superuser', 'role', 'password').first()
+        if row is None:
+            return None
+        return UserStatus(
+            row['is_active'], row['is_staff'], row['is_superuser'], row['role'], get_md5_hash_password(row['password']),
+        )
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'users': len(self._entries),
+            'ttl': self.ttl,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_status_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserStatusCache(**getattr(settings, 'JWT_USER_STATUS_CACHE', {}))
+    return _cache
+
+
+class ClaimsUser(TokenUser):
+    """
+    request.user built from the access token: id and username are its claims
+    (see MyTokenObtainPairSerializer), the flags and role come from the
+    status cache. It is not a model instance, so views using it must only read
+    request.user, not assign it to foreign keys.
+    """
+
+    def __init__(self, token, status):
+        super().__init__(token)
+        self.status = status
+
+    @property
+    def is_active(self):
+        return self.status.is_active
+
+    @property
+    def is_staff(self):
+        return self.status.is_staff
+
+    @property
+    def is_superuser(self):
+        return self.status.is_superuser
+
+    @property
+    def role(self):
+        return self.status.role
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWTAuthentication without the User query on every request, for read
+    endpoints. Tokens are validated the same way; the active and password
+    checks JWTAuthentication.get_user makes on the User row are made on the
+    cached UserStatus instead.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        status = get_user_status_cache().get(user_id)
+        if status is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not status.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != status.password_hash:
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return ClaimsUser(validated_token, status)
@@ -0,0 +1,179 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives, in `bits` bits."""
+
+    def __init__(self, capacity, false_positive_rate=0.01):
+        capacity = max(capacity, 1000)
+        self.bits = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing: position i = h1 + i * h2, from one 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class BlacklistFilter:
+    """
+    A Bloom filter of blacklisted refresh token jtis, in front of the
+    token_blacklist query simplejwt makes on every refresh. A jti the filter
+    has never seen is not blacklisted and needs no query; the rest (real
+    entries and the ~1% false positives) are checked against the table.
+
+    Tokens blacklisted by this process are added at once. Those blacklisted
+    by other workers are picked up every `sync_seconds`, by reading the rows
+    past the highest BlacklistedToken id already loaded, less `sync_overlap`
+    ids: a transaction can commit after one that took a later id, and the
+    overlap re-reads the recent ids it may have been missing from. Until a
+    sync, a check can miss them. Token rotation does not depend on the check
+    though: BlacklistingRefreshToken.blacklist() refuses a token whose
+    blacklist row already exists, so a rotated-out refresh token is never
+    accepted twice.
+
+    The filter is rebuilt from scratch every `rebuild_seconds`, sized to the
+    table, so tokens removed by prune_token_blacklist stop taking up bits.
+    Rebuilds and syncs read the table outside the lock: meanwhile other
+    threads keep checking against the current filter (or, before the first
+    one exists, against the table), and the new filter is swapped in with
+    whatever add() saw during the read.
+    """
+
+    def __init__(self, false_positive_rate=0.01, sync_seconds=5, rebuild_seconds=60 * 60, sync_overlap=1000):
+        self.false_positive_rate = false_positive_rate
+        self.sync_seconds = sync_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.sync_overlap = sync_overlap
+        self._filter = None
+        self._high_water_mark = 0
+        self._synced_at = self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._added = []  # jtis add()ed while a rebuild reads the table
+        self.skipped = 0
+        self.checked = 0
+
+    def _rows(self, after_id=0):
+        return (
+            BlacklistedToken.objects.filter(id__gt=after_id)
+            .order_by('id').values_list('id', 'token__jti').iterator(chunk_size=5000)
+        )
+
+    def _rebuild(self, now):
+        rows = list(self._rows())
+        # room to grow by half before the false positive rate climbs
+        bloom = BloomFilter(int(len(rows) * 1.5), self.false_positive_rate)
+        for _, jti in rows:
+            bloom.add(jti)
+        with self._lock:
+            for jti in self._added:
+                bloom.add(jti)
+            self._filter = bloom
+            self._high_water_mark = rows[-1][0] if rows else 0
+            self._built_at = self._synced_at = now
+
+    def _sync(self, now):
+        rows = list(self._rows(max(0, self._high_water_mark - self.sync_overlap)))
+        with self._lock:
+            for _, jti in rows:
+                self._filter.add(jti)
+            if rows:
+                self._high_water_mark = max(self._high_water_mark, rows[-1][0])
+            self._synced_at = now
+
+    def _refresh(self, now):
+        """Rebuild or sync if due, unless another thread already is; never holds the lock while querying."""
+        with self._lock:
+            if self._refreshing:
+                return
+            rebuild = self._filter is None or now - self._built_at >= self.rebuild_seconds
+            if not rebuild and now - self._synced_at < self.sync_seconds:
+                return
+            self._refreshing = True
+        try:
+            if rebuild:
+                self._rebuild(now)
+            else:
+                self._sync(now)
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._added = []
+
+    def might_contain(self, jti):
+        self._refresh(time.monotonic())
+        bloom = self._filter
+        # no filter yet (first build in progress elsewhere, or failed): ask the table
+        found = bloom is None or jti in bloom
+        if found:
+            self.checked += 1
+        else:
+            self.skipped += 1
+        return found
+
+    def add(self, jti):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if self._refreshing:
+                self._added.append(jti)
+
+    def stats(self):
+        lookups = self.skipped + self.checked
+        return {
+            'skipped': self.skipped,
+            'checked': self.checked,
+            'skip_rate': self.skipped / lookups if lookups else None,
+            'bits': self._filter.bits if self._filter is not None else None,
+            'high_water_mark': self._high_water_mark,
+        }
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_blacklist_filter():
+    global _filter
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                _filter = BlacklistFilter(**getattr(settings, 'TOKEN_BLACKLIST_FILTER', {}))
+    return _filter
+
+
+class BlacklistingRefreshToken(RefreshToken):
+    """RefreshToken with its blacklist check behind BlacklistFilter."""
+
+    def check_blacklist(self):
+        if get_blacklist_filter().might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        blacklisted, created = super().blacklist()
+        if not created:
+            # already blacklisted: a replay the filter had not caught up with yet
+            raise TokenError(_("Token is blacklisted"))
+        get_blacklist_filter().add(self.payload[api_settings.JTI_CLAIM])
+        return blacklisted, created
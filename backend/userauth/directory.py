@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+
+
+class PhysicianDirectory:
+    """
+    The physician list served by list_physicians, kept as ready-to-send JSON.
+
+    The directory's version is read from the table itself: the number of
+    physicians and the newest updated_at, which every save, create and
+    delete moves. One aggregate query checks it, at most every
+    `check_seconds` per process, so a change made through any worker is
+    served everywhere within that window, whatever the cache backend.
+    changed(), called on every Physician save or delete (userauth.signals),
+    makes this process check again at once.
+
+    The JSON is cached per version, in the `alias` cache and in this
+    process, so a hit is no ORM or JSON work; the version is also the
+    response's ETag.
+
+    queryset.update() and raw SQL do not touch updated_at; such writes must
+    set it themselves.
+    """
+
+    def __init__(self, alias='default', timeout=24 * 60 * 60, check_seconds=5):
+        self.backend = caches[alias]
+        self.timeout = timeout
+        self.check_seconds = check_seconds
+        self._checked = None  # (monotonic time, version) of the last check
+        self._local = None  # (version, etag, body) last served by this process
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def entry_key(version):
+        return f"userauth:physicians:{version}"
+
+    @staticmethod
+    def etag_for(version):
+        return f'W/"physicians-{version}"'
+
+    def version(self):
+        now = time.monotonic()
+        checked = self._checked
+        if checked is not None and now - checked[0] < self.check_seconds:
+            return checked[1]
+
+        from .models import Physician
+
+        state = Physician.objects.aggregate(count=Count('pk'), updated_at=Max('updated_at'))
+        updated_at = state['updated_at']
+        version = f"{state['count']}-{int(updated_at.timestamp() * 1_000_000) if updated_at else 0}"
+        self._checked = (now, version)
+        return version
+
+    def changed(self):
+        # this process serves its own writes at once; the others within check_seconds
+        self._checked = None
+
+    def current_etag(self):
+        return self.etag_for(self.version())
+
+    def get(self):
+        """(etag, body) of the current directory, building it on a miss."""
+        version = self.version()
+        local = self._local
+        if local is not None and local[0] == version:
+            self.hits += 1
+            return local[1], local[2]
+
+        body = self.backend.get(self.entry_key(version))
+        if body is not None:
+            self.shared_hits += 1
+        else:
+            # the version is read before the query, so a change committed
+            # meanwhile moves the version on and this entry is never served as current
+            self.misses += 1
+            body = self.build()
+            self.backend.set(self.entry_key(version), body, self.timeout)
+
+        etag = self.etag_for(version)
+        with self._lock:
+            self._local = (version, etag, body)
+        return etag, body
+
+    def build(self):
+        from .models import Physician
+
+        physicians = Physician.objects.order_by('user_id').values("user_id", "first_name", "last_name", "specialisation")
+        return json.dumps(list(physicians), cls=DjangoJSONEncoder).encode()
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else None,
+            'version': self._checked[1] if self._checked is not None else None,
+            'check_seconds': self.check_seconds,
+        }
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_physician_directory():
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                _directory = PhysicianDirectory(**getattr(settings, 'PHYSICIAN_DIRECTORY_CACHE', {}))
+    return _directory
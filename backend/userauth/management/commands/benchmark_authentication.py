@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from userauth.authentication import ClaimsJWTAuthentication, get_user_status_cache
+from userauth.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare the per-request cost of JWTAuthentication and ClaimsJWTAuthentication."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username to issue the token for. Defaults to the first active user.")
+        parser.add_argument('--iterations', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True).order_by('id')
+        user = users.filter(username=options['user']).first() if options['user'] else users.first()
+        if user is None:
+            raise CommandError("No active user to issue a token for.")
+
+        # same claims as MyTokenObtainPairSerializer, without recording an outstanding refresh token
+        token = AccessToken.for_user(user)
+        token['username'] = user.username
+        token['role'] = user.role
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {token}")
+        iterations = options['iterations']
+
+        self.stdout.write(f"{iterations} authentications as {user.username}")
+        self.stdout.write(f"{'authentication':<26}{'us/request':>12}{'queries/request':>17}")
+        for authentication in (JWTAuthentication(), ClaimsJWTAuthentication()):
+            authentication.authenticate(request)  # warm up
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    authentication.authenticate(request)
+                elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{type(authentication).__name__:<26}{elapsed / iterations * 1e6:>12.1f}"
+                f"{len(queries) / iterations:>17.3f}"
+            )
+        self.stdout.write(f"status cache: {get_user_status_cache().stats()}")
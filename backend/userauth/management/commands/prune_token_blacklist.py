@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired refresh tokens from the outstanding and blacklisted token tables, "
+        "in small batches so refreshes are never blocked for long. Run it daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0, help="Seconds to pause between batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Count what would be deleted.")
+
+    def handle(self, *args, **options):
+        # an expired token can't be refreshed, blacklisted or not, so its rows are dead weight
+        now = aware_utcnow()
+        expired = OutstandingToken.objects.filter(expires_at__lte=now)
+        if options['dry_run']:
+            blacklisted = BlacklistedToken.objects.filter(token__expires_at__lte=now).count()
+            self.stdout.write(f"Would delete {expired.count()} outstanding tokens, {blacklisted} of them blacklisted.")
+            return
+
+        outstanding_deleted = blacklisted_deleted = 0
+        while True:
+            ids = list(expired.order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            with transaction.atomic():
+                # blacklist rows first, so the outstanding delete has nothing left to cascade to
+                blacklisted_deleted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+                outstanding_deleted += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {outstanding_deleted} expired outstanding tokens and {blacklisted_deleted} blacklist entries."
+        ))
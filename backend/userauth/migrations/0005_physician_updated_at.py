@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userauth', '0004_patientillness_physician'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='physician',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -18,6 +18,8 @@ class Physician(models.Model):
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     specialisation = models.CharField(max_length=50, null=True, blank=True)
+    # with the row count, the version of the physician directory (userauth.directory)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Physician"
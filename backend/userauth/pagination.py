@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CaseloadCursorPagination(CursorPagination):
+    """
+    A physician's patients in user id order: each page is a range scan on the
+    patient.physician index, however large the caseload.
+    """
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+    ordering = 'user_id'
@@ -0,0 +1,98 @@
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right
+
+from .directory import get_physician_directory
+
+
+def _terms(*names):
+    return tuple(sorted({word for name in names if name for word in name.lower().split()}))
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        term, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(term), int(user_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor.')
+
+
+class PhysicianSearchIndex:
+    """
+    Prefix search over physician names, in memory.
+
+    Every word of a physician's first and last name is an entry (word, user_id)
+    in a sorted list, so the physicians whose names start with a prefix are a
+    contiguous run found with one bisect. There is one such list for the whole
+    directory and one per specialisation, so filtering by specialisation is
+    the same bisect over a shorter list rather than a scan.
+
+    The index is built from the JSON of the physician directory cache
+    (userauth.directory) and rebuilt when that moves to a new version.
+    """
+
+    def __init__(self, etag, rows):
+        self.etag = etag
+        self.physicians = {}
+        entries = {None: []}
+        for row in rows:
+            terms = _terms(row['first_name'], row['last_name'])
+            self.physicians[row['user_id']] = (row, terms)
+            specialisation = (row['specialisation'] or '').strip().lower() or None
+            for term in terms:
+                entries[None].append((term, row['user_id']))
+                if specialisation is not None:
+                    entries.setdefault(specialisation, []).append((term, row['user_id']))
+        for bucket in entries.values():
+            bucket.sort()
+        self.entries = entries
+
+    def search(self, query = '', specialisation = None, limit = 20, after = None):
+        """
+        Up to `limit` physicians every word of `query` is a prefix of a name
+        of, in name order, and the position to pass as `after` for the next
+        page (None on the last one).
+        """
+        tokens = _terms(query)
+        # look up by the longest word, the most selective; check the others per match
+        lookup = max(tokens, key = len) if tokens else ''
+        others = [token for token in tokens if token != lookup]
+        entries = self.entries.get(specialisation.strip().lower() if specialisation else None, [])
+
+        start = bisect_left(entries, (lookup,)) if after is None else bisect_right(entries, after)
+        results = []
+        for position in range(start, len(entries)):
+            term, user_id = entries[position]
+            if not term.startswith(lookup):
+                break
+            row, terms = self.physicians[user_id]
+            # a physician matching on several words is listed once, at the first of them
+            if next(t for t in terms if t.startswith(lookup)) != term:
+                continue
+            if not all(any(t.startswith(token) for t in terms) for token in others):
+                continue
+            if len(results) == limit:
+                return results, last
+            results.append(row)
+            last = entries[position]
+        return results, None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_physician_index():
+    """The search index for the current directory version, rebuilt if it has changed."""
+    global _index
+    etag, body = get_physician_directory().get()
+    if _index is None or _index.etag != etag:
+        with _index_lock:
+            if _index is None or _index.etag != etag:
+                _index = PhysicianSearchIndex(etag, json.loads(body))
+    return _index
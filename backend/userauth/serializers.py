@@ -143,4 +143,13 @@ class PatientSerializer(serializers.ModelSerializer):
         instance.age_category = validated_data.get('age_category', instance.age_category)
         
         instance.save()
-        return instance
\ No newline at end of file
+        return instance
+
+
+# One row of a physician's caseload: no nested physician, it is the same for every row
+class CaseloadPatientSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Patient
+        fields = ['user_id', 'user', 'first_name', 'last_name', 'age_category']
@@ -0,0 +1,23 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import get_user_status_cache
+from .directory import get_physician_directory
+from .models import Physician, User
+
+
+# after commit, so a request can't cache the old rows under the new version
+@receiver(post_save, sender = Physician)
+@receiver(post_delete, sender = Physician)
+def physician_directory_changed(sender, instance, **kwargs):
+    transaction.on_commit(get_physician_directory().changed)
+
+
+# drops the cached active/staff/password state read by ClaimsJWTAuthentication
+@receiver(post_save, sender = User)
+@receiver(post_delete, sender = User)
+def user_status_changed(sender, instance, **kwargs):
+    # read now: a delete clears instance.pk before the commit
+    user_id = instance.pk
+    transaction.on_commit(lambda: get_user_status_cache().invalidate(user_id))
@@ -1,3 +1,372 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import authentication, blacklist, directory, search
+from .authentication import ClaimsJWTAuthentication
+from .blacklist import BlacklistFilter, BloomFilter
+from .directory import PhysicianDirectory
+from .search import PhysicianSearchIndex
+from .models import Patient, Physician, User
+
+
+def create_physician(username, first_name, last_name, specialisation=None):
+    return Physician.objects.create(
+        user=User.objects.create_user(username, password='x'),
+        first_name=first_name, last_name=last_name, specialisation=specialisation,
+    )
+
+
+class PhysicianDirectoryTests(TestCase):
+    def setUp(self):
+        # the directory is per process; start every test from an empty one
+        directory._directory = None
+        search._index = None
+        self.ada = create_physician('ada', 'Ada', 'Lovelace', 'cardiology')
+
+    def test_list_and_not_modified(self):
+        client = APIClient()
+        response = client.get('/user/physicians/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['first_name'] for row in response.json()], ['Ada'])
+
+        response = client.get('/user/physicians/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_made_elsewhere_show_after_the_check_window(self):
+        physicians = PhysicianDirectory(check_seconds=0)
+        etag, _ = physicians.get()
+
+        # as another worker would: no signal reaches this process
+        Physician.objects.filter(pk=self.ada.pk).update(first_name='Augusta', updated_at=timezone.now())
+        new_etag, body = physicians.get()
+        self.assertNotEqual(new_etag, etag)
+        self.assertIn(b'Augusta', body)
+
+        create_physician('grace', 'Grace', 'Hopper')
+        self.assertIn(b'Grace', physicians.get()[1])
+        Physician.objects.filter(pk=self.ada.pk).delete()
+        self.assertNotIn(b'Augusta', physicians.get()[1])
+
+    def test_version_is_checked_once_per_window(self):
+        physicians = PhysicianDirectory(check_seconds=60)
+        physicians.get()
+        with self.assertNumQueries(0):
+            physicians.get()
+        physicians.changed()
+        with self.assertNumQueries(1):
+            physicians.get()
+
+    def test_saves_in_this_process_show_at_once(self):
+        physicians = directory.get_physician_directory()
+        physicians.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_physician('grace', 'Grace', 'Hopper', 'cardiology')
+
+        self.assertIn(b'Grace', physicians.get()[1])
+        results, _ = search.get_physician_index().search('gra', 'cardiology')
+        self.assertEqual([row['first_name'] for row in results], ['Grace'])
+
+
+def physician_row(user_id, first_name, last_name, specialisation=None):
+    return {'user_id': user_id, 'first_name': first_name, 'last_name': last_name, 'specialisation': specialisation}
+
+
+class PhysicianSearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = PhysicianSearchIndex('v1', [
+            physician_row(1, 'Ada', 'Lovelace', 'Cardiology'),
+            physician_row(2, 'Alan', 'Turing', 'neurology'),
+            physician_row(3, 'Ada', 'Adams'),
+            physician_row(4, 'Grace', 'Hopper', 'cardiology'),
+            physician_row(5, 'Mary Ann', 'Lovelace', ' Cardiology '),
+        ])
+
+    def ids(self, *args, **kwargs):
+        return [row['user_id'] for row in self.index.search(*args, **kwargs)[0]]
+
+    def test_every_word_is_a_name_prefix(self):
+        self.assertEqual(self.ids('ada lov'), [1])
+        self.assertEqual(self.ids('LOVELACE ada'), [1])
+        self.assertEqual(self.ids('lov ma'), [5])
+        self.assertEqual(self.ids('ada turing'), [])
+
+    def test_each_physician_is_listed_once(self):
+        # Ada Adams matches "ada" on both names
+        self.assertEqual(self.ids('ada'), [1, 3])
+        self.assertEqual(self.ids(''), [1, 3, 2, 5, 4])
+
+    def test_specialisation_filter(self):
+        self.assertEqual(self.ids('', 'cardiology'), [1, 5, 4])
+        self.assertEqual(self.ids('lo', ' CARDIOLOGY'), [1, 5])
+        self.assertEqual(self.ids('turing', 'cardiology'), [])
+        self.assertEqual(self.ids('', 'dermatology'), [])
+
+    def test_pages_resume_after_the_cursor(self):
+        seen = []
+        after = None
+        while True:
+            results, after = self.index.search('', limit=2, after=after)
+            seen.extend(row['user_id'] for row in results)
+            if after is None:
+                break
+        self.assertEqual(seen, [1, 3, 2, 5, 4])
+
+
+class PhysicianSearchViewTests(TestCase):
+    url = '/user/physicians/search/'
+
+    def setUp(self):
+        directory._directory = None
+        search._index = None
+        for username, first_name, last_name in (('ada', 'Ada', 'Lovelace'), ('adam', 'Adam', 'Smith'), ('alan', 'Alan', 'Turing')):
+            create_physician(username, first_name, last_name, 'cardiology')
+
+    def test_next_links_walk_every_match(self):
+        seen = []
+        response = self.client.get(self.url, {'q': 'a', 'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['first_name'] for row in response.json()['results'])
+            if response.json()['next'] is None:
+                break
+            response = self.client.get(response.json()['next'])
+        self.assertEqual(seen, ['Ada', 'Adam', 'Alan'])
+
+    def test_bad_parameters(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'limit': 'many'}, {'limit': 0}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+
+class PhysicianCaseloadTests(TestCase):
+    def setUp(self):
+        self.physician = create_physician('doctor', 'Ada', 'Doc')
+        self.client = APIClient()
+        self.client.force_authenticate(self.physician.user)
+        self.profile_url = f'/user/physician/{self.physician.user_id}/'
+        self.patients = []
+
+    def add_patients(self, count):
+        # without passwords: hashing hundreds of them would dominate the test
+        start = len(self.patients)
+        users = User.objects.bulk_create([User(username=f'patient{number}') for number in range(start, start + count)])
+        Patient.objects.bulk_create([
+            Patient(user=user, physician=self.physician, first_name='Pat', last_name=user.username, age_category='adult')
+            for user in users
+        ])
+        self.patients.extend(user.pk for user in users)
+
+    def test_profile_embeds_the_first_page_and_the_count(self):
+        self.add_patients(60)
+        create_physician('other', 'Bo', 'Doc')
+
+        response = self.client.get(self.profile_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['patient_count'], 60)
+        self.assertEqual([patient['user']['id'] for patient in response.data['patients']], self.patients[:50])
+        self.assertTrue(response.data['patients_next'].startswith(
+            f'http://testserver/user/physician/{self.physician.user_id}/caseload/?cursor='
+        ))
+
+    def test_next_link_continues_on_the_caseload_endpoint(self):
+        self.add_patients(120)
+
+        seen = [patient['user']['id'] for patient in self.client.get(self.profile_url).data['patients']]
+        url = self.client.get(self.profile_url).data['patients_next']
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(patient['user_id'] for patient in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, self.patients)
+
+    def test_small_caseload_has_no_next_link(self):
+        self.add_patients(3)
+        response = self.client.get(self.profile_url)
+        self.assertEqual((response.data['patient_count'], len(response.data['patients'])), (3, 3))
+        self.assertIsNone(response.data['patients_next'])
+
+    def test_query_count_does_not_depend_on_the_caseload(self):
+        counts = []
+        for count in (5, 200):
+            self.add_patients(count)
+            with CaptureQueriesContext(connection) as profile:
+                self.client.get(self.profile_url)
+            with CaptureQueriesContext(connection) as caseload:
+                self.client.get(f'{self.profile_url}caseload/')
+            counts.append((len(profile), len(caseload)))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication._cache = None
+        self.user = User.objects.create_user('patient', password='first')
+
+    def authenticate(self, token=None):
+        token = token or self.token()
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def token(self):
+        token = AccessToken.for_user(self.user)
+        token['role'] = self.user.role
+        return token
+
+    def save_user(self):
+        # as a view would: the signal drops the cached status once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+    def test_user_comes_from_the_token_and_cached_status(self):
+        user = self.authenticate()
+        self.assertEqual((user.id, user.role, user.is_active, user.is_staff), (self.user.pk, 'patient', True, False))
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_inactive_user_is_rejected_once_the_change_commits(self):
+        token = self.token()
+        self.authenticate(token)
+
+        self.user.is_active = False
+        self.save_user()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User is inactive'):
+            self.authenticate(token)
+
+    def test_unsignalled_changes_wait_for_the_ttl(self):
+        token = self.token()
+        self.authenticate(token)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertTrue(self.authenticate(token).is_active)
+        authentication.get_user_status_cache().invalidate(self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    # modules hold on to the api_settings they imported, so override_settings can't reach them
+    @mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True)
+    def test_password_change_revokes_tokens(self):
+        token = self.token()
+        self.authenticate(token)
+
+        self.user.set_password('second')
+        self.save_user()
+        with self.assertRaisesMessage(AuthenticationFailed, 'password has been changed'):
+            self.authenticate(token)
+        self.assertEqual(self.authenticate().id, self.user.pk)
+
+    def test_role_follows_the_user_not_the_token(self):
+        token = self.token()
+        self.user.role = 'physician'
+        self.save_user()
+        self.assertEqual(self.authenticate(token).role, 'physician')
+
+    def test_deleted_user_is_rejected(self):
+        token = self.token()
+        self.authenticate(token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User not found'):
+            self.authenticate(token)
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives_and_few_false_positives(self):
+        bloom = BloomFilter(5000, 0.01)
+        members = [f'jti-{number}' for number in range(5000)]
+        for member in members:
+            bloom.add(member)
+
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(f'other-{number}' in bloom for number in range(10000))
+        self.assertLess(false_positives, 10000 * 0.02)
+
+
+class BlacklistFilterTests(TestCase):
+    def setUp(self):
+        blacklist._filter = None
+        self.user = User.objects.create_user('patient', password='x')
+
+    def blacklist_token(self, jti, **fields):
+        token = OutstandingToken.objects.create(
+            user=self.user, jti=jti, token=jti, expires_at=timezone.now() + datetime.timedelta(days=1),
+        )
+        return BlacklistedToken.objects.create(token=token, **fields)
+
+    def test_blacklisted_tokens_are_never_skipped(self):
+        for number in range(50):
+            self.blacklist_token(f'jti-{number}')
+        bloom = BlacklistFilter(sync_seconds=0)
+
+        self.assertTrue(all(bloom.might_contain(f'jti-{number}') for number in range(50)))
+        self.blacklist_token('later')
+        self.assertTrue(bloom.might_contain('later'))
+
+    def test_sync_rereads_ids_committed_out_of_order(self):
+        first = self.blacklist_token('first')
+        self.blacklist_token('third', id=first.id + 2)
+        bloom = BlacklistFilter(sync_seconds=0, sync_overlap=10)
+        bloom.might_contain('first')
+
+        # a transaction that took the id in between commits only now
+        self.blacklist_token('second', id=first.id + 1)
+        self.assertTrue(bloom.might_contain('second'))
+
+    def test_tokens_added_during_a_rebuild_are_kept(self):
+        bloom = BlacklistFilter()
+        rows = bloom._rows
+
+        def rows_while_blacklisting(*args):
+            # another thread blacklists a token while this one reads the table
+            bloom.add('meanwhile')
+            return rows(*args)
+
+        with mock.patch.object(bloom, '_rows', rows_while_blacklisting):
+            self.assertFalse(bloom.might_contain('unknown'))
+        self.assertTrue(bloom.might_contain('meanwhile'))
+
+    def test_checks_go_to_the_table_while_the_first_build_runs(self):
+        bloom = BlacklistFilter()
+        bloom._refreshing = True
+        self.assertTrue(bloom.might_contain('anything'))
+        self.assertIsNone(bloom._filter)
+
+    def test_replayed_rotated_token_is_refused(self):
+        client = APIClient()
+        refresh = client.post('/user/token/', {'username': 'patient', 'password': 'x'}).data['refresh']
+
+        response = client.post('/user/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['refresh'], refresh)
+
+        self.assertEqual(client.post('/user/token/refresh/', {'refresh': refresh}).status_code, 401)
+        self.assertEqual(client.post('/user/token/refresh/', {'refresh': response.data['refresh']}).status_code, 200)
+
+
+class PruneTokenBlacklistTests(TestCase):
+    def test_deletes_only_expired_tokens(self):
+        user = User.objects.create_user('patient', password='x')
+        now = timezone.now()
+        for jti, expires_in, blacklisted in (
+            ('expired', -1, True), ('expired-live', -1, False), ('valid', 1, True), ('valid-live', 1, False),
+        ):
+            token = OutstandingToken.objects.create(
+                user=user, jti=jti, token=jti, expires_at=now + datetime.timedelta(days=expires_in),
+            )
+            if blacklisted:
+                BlacklistedToken.objects.create(token=token)
+
+        call_command('prune_token_blacklist', batch_size=1, stdout=mock.MagicMock())
+
+        self.assertEqual(sorted(OutstandingToken.objects.values_list('jti', flat=True)), ['valid', 'valid-live'])
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token__jti', flat=True)), ['valid'])
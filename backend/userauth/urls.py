@@ -1,10 +1,6 @@
 from django.urls import path
 from . import views
-from .views import MyTokenObtainPairView, UserRegisterView
-
-from rest_framework_simplejwt.views import (
-    TokenRefreshView,
-)
+from .views import MyTokenObtainPairView, MyTokenRefreshView, UserRegisterView
 
 
 urlpatterns = [
@@ -13,7 +9,7 @@ urlpatterns = [
     # Authentication routes
     path('register/', UserRegisterView.as_view(), name='user-register'),
     path('token/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/refresh/', MyTokenRefreshView.as_view(), name='token_refresh'),
     
     # Profile creation routes for:
     # physician
@@ -28,11 +24,15 @@ urlpatterns = [
 
     # getting the list of physician routes:
     path('physicians/', views.list_physicians, name='list_physicians'),
+    path('physicians/search/', views.search_physicians, name='search_physicians'),
+    path('physicians/stats/', views.physician_directory_stats, name='physician_directory_stats'),
     
     
     # Getting profile information
     path('patient/<int:user_id>/', views.PatientProfileView.as_view(), name='patient'),
     path('physician/<int:user_id>/', views.PhysicianProfileView.as_view(), name='physician'),
+    # the physician's patients, cursor-paginated
+    path('physician/<int:user_id>/caseload/', views.PhysicianCaseloadView.as_view(), name='physician-caseload'),
 
     # A list of patients belonging to a specific physician
     path('physician-patient/<int:user_id>/patients/', views.PhysicianPatientsListView.as_view(), name='physician-patient'),
@@ -21,21 +21,34 @@ from rest_framework.generics import RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import NotFound
 from .models import Physician, Patient, PatientIllness
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 
 from rest_framework.views import APIView
 from .serializers import UserRegistrationSerializer
 from rest_framework.permissions import AllowAny
 
+from django.db.models import Count
+from django.urls import reverse
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from rest_framework.permissions import IsAdminUser
+from rest_framework.utils.urls import replace_query_param
+
 from .models import User, Patient, PatientIllness,Physician
+from .authentication import ClaimsJWTAuthentication
+from .blacklist import BlacklistingRefreshToken
+from .directory import get_physician_directory
+from .pagination import CaseloadCursorPagination
+from .search import decode_cursor, encode_cursor, get_physician_index
 from .serializers import (
     UserSerializer,
     UserRegistrationSerializer,
     PatientSerializer,
     PhysicianSerializer,
-    PatientIllnessSerializer
+    PatientIllnessSerializer,
+    CaseloadPatientSerializer
 )
 
 # TOKEN OBTAIN VIEW
@@ -52,6 +65,15 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
+
+# TOKEN REFRESH VIEW: blacklist lookups go through the Bloom filter in userauth.blacklist
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = BlacklistingRefreshToken
+
+
+class MyTokenRefreshView(TokenRefreshView):
+    serializer_class = MyTokenRefreshSerializer
+
 @api_view(['GET'])
 def getRoutes(request):
     routes = [
@@ -189,19 +211,68 @@ class CreatePatientAPIView(APIView):
         
         
 def list_physicians(request):
-    physicians = Physician.objects.filter().values("user_id", "first_name", "last_name", "specialisation")
-    return JsonResponse(list(physicians), safe=False)
+    # Served pre-serialized from the directory cache; clients holding the current version get a 304
+    directory = get_physician_directory()
+    etag, body = directory.get()
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+
+    conditional = get_conditional_response(request, etag=etag, response=response)
+    if conditional is not response:
+        directory.not_modified += 1
+    return conditional
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_physicians(request):
+    # Autocomplete for the physician picker: ?q= name prefixes, ?specialisation=, ?limit=, ?cursor=
+    params = request.query_params
+    try:
+        limit = int(params.get('limit') or settings.PHYSICIAN_SEARCH_PAGE_SIZE)
+    except ValueError:
+        return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1:
+        return Response({"error": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+    limit = min(limit, settings.PHYSICIAN_SEARCH_MAX_PAGE_SIZE)
+
+    after = None
+    if params.get('cursor'):
+        try:
+            after = decode_cursor(params['cursor'])
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    results, last = get_physician_index().search(
+        params.get('q', ''), params.get('specialisation'), limit=limit, after=after
+    )
+    next_url = None
+    if last is not None:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(last))
+    return Response({"results": results, "next": next_url}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def physician_directory_stats(request):
+    # Hit/miss counters of this worker's physician directory cache
+    return Response(get_physician_directory().stats(), status=status.HTTP_200_OK)
 
 
 
 
 class PhysicianProfileView(RetrieveAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request, *args, **kwargs):
         user_id = self.kwargs.get('user_id')
         try:
-            physician = Physician.objects.select_related('user').get(user_id=user_id)
+            # the patient count comes from the same query as the profile
+            physician = Physician.objects.select_related('user').annotate(
+                patient_count=Count('patients')
+            ).get(user_id=user_id)
             
             # Build the response structure exactly as expected by frontend
             response_data = {
@@ -223,17 +294,25 @@ class PhysicianProfileView(RetrieveAPIView):
                 }
             }
             
-            # Add patients data if needed
-            patients = Patient.objects.filter(physician=physician).select_related('user')
-            if patients.exists():
-                response_data['patients'] = [{
-                    'first_name': p.first_name,
-                    'last_name': p.last_name,
-                    'user': {
-                        'username': p.user.username,
-                        'id': physician.user.id,
-                    }
-                } for p in patients]
+            # Only the first page of patients; the rest is on the caseload endpoint,
+            # starting at patients_next
+            paginator = CaseloadCursorPagination()
+            patients = paginator.paginate_queryset(
+                Patient.objects.filter(physician=physician).select_related('user'), request, view=self
+            )
+            paginator.base_url = request.build_absolute_uri(
+                reverse('physician-caseload', kwargs={'user_id': physician.user_id})
+            )
+            response_data['patient_count'] = physician.patient_count
+            response_data['patients'] = [{
+                'first_name': p.first_name,
+                'last_name': p.last_name,
+                'user': {
+                    'username': p.user.username,
+                    'id': p.user.id,
+                }
+            } for p in patients]
+            response_data['patients_next'] = paginator.get_next_link()
             
             return Response(response_data)
             
@@ -242,6 +321,7 @@ class PhysicianProfileView(RetrieveAPIView):
         
         
 class PatientProfileView(RetrieveAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request, *args, **kwargs):
@@ -283,8 +363,8 @@ class PatientProfileView(RetrieveAPIView):
             }
             
             # Get all illnesses for this patient
-            illnesses = PatientIllness.objects.filter(user_id=user_id).order_by('-created_at')
-            if illnesses.exists():
+            illnesses = PatientIllness.objects.filter(user_id=user_id).select_related('physician').order_by('-created_at')
+            if illnesses:
                 response_data['patient_illnesses'] = [
                     {
                         'title': illness.title,
@@ -373,6 +453,7 @@ class PatientIllnessUpdateView(RetrieveUpdateAPIView):
 # List of illness for Speficic patient
 class IllnessListView(ListAPIView):
     serializer_class = PatientIllnessSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
@@ -382,12 +463,13 @@ class IllnessListView(ListAPIView):
         if not self.request.user.is_staff and str(self.request.user.id) != str(patient_id):
             raise PermissionDenied("You can only view your own illness records")
             
-        return PatientIllness.objects.filter(user_id=patient_id).order_by('-created_at')
+        return PatientIllness.objects.filter(user_id=patient_id).select_related('user').order_by('-created_at')
     
  
 
 class PhysicianPatientsListView(ListAPIView):
    
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = PatientSerializer
 
@@ -401,11 +483,22 @@ class PhysicianPatientsListView(ListAPIView):
             return Patient.objects.none()  # Return empty queryset if physician not found
 
         # Update the prefetch_related to 'patient_illness' or correct field name
-        return Patient.objects.filter(physician=physician).select_related("user", "physician")
+        return Patient.objects.filter(physician=physician).select_related("user", "physician__user")
+
+# A physician's caseload, a page at a time (the profile embeds only the first page)
+class PhysicianCaseloadView(ListAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = CaseloadPatientSerializer
+    pagination_class = CaseloadCursorPagination
+
+    def get_queryset(self):
+        return Patient.objects.filter(physician_id=self.kwargs.get("user_id")).select_related("user")
 
 class PhysicianIllnessListView(ListAPIView):
     
     # Getting all the ilnesses assigned to a specific physician
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = PatientIllnessSerializer
     
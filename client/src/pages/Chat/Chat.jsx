@@ -1,4 +1,4 @@
-import { useState, useEffect, useContext } from 'react';
+import { useState, useEffect, useLayoutEffect, useContext, useRef } from 'react';
 import axios from 'axios';
 import AuthContext from '../../context/AuthContext';
 import PropTypes from 'prop-types';
@@ -12,6 +12,11 @@ const Chat = ({ chatInfo, patientData }) => {
   const [sending, setSending] = useState(false);
   const [physicianID, setPhysicianID] = useState();
   const [patientID, setPatientID] = useState();
+  // cursor of the next older page; null once the start of the conversation is loaded
+  const [before, setBefore] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const messagesRef = useRef(null);
+  const scrollAnchor = useRef(null);
 
   useEffect(() => {
 
@@ -52,7 +57,8 @@ const Chat = ({ chatInfo, patientData }) => {
             Authorization: `Bearer ${authTokens.access}`,
           },
         });
-        setMessages(response.data);
+        setMessages(response.data.results);
+        setBefore(response.data.before);
 
         // console.log("Chat Message data", response.data)
         
@@ -66,6 +72,46 @@ const Chat = ({ chatInfo, patientData }) => {
     fetchMessages();
   }, [user, authTokens, patientID, physicianID]);
 
+  // Keep the message the user was reading in place when older ones are added above it
+  useLayoutEffect(() => {
+    const container = messagesRef.current;
+    if (container && scrollAnchor.current !== null) {
+      container.scrollTop = container.scrollHeight - scrollAnchor.current;
+      scrollAnchor.current = null;
+    }
+  }, [messages]);
+
+  const loadOlder = async () => {
+    if (!before || loadingOlder) return;
+
+    const patient_id = user.role === 'patient' ? user.user_id : patientID;
+    const physician_id = user.role === 'physician' ? user.user_id : physicianID;
+
+    setLoadingOlder(true);
+    try {
+      const url = `http://localhost:8000/chat/chat_messages/${patient_id}/${physician_id}/`;
+      const response = await axios.get(url, {
+        params: { before },
+        headers: {
+          Authorization: `Bearer ${authTokens.access}`,
+        },
+      });
+      const container = messagesRef.current;
+      if (container) {
+        scrollAnchor.current = container.scrollHeight - container.scrollTop;
+      }
+      setMessages((current) => {
+        const loaded = new Set(current.map((message) => message.id));
+        return [...response.data.results.filter((message) => !loaded.has(message.id)), ...current];
+      });
+      setBefore(response.data.before);
+    } catch (err) {
+      setError(err.response?.data?.detail || err.message);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     if (!content || !user || !authTokens) return;
@@ -138,7 +184,19 @@ const Chat = ({ chatInfo, patientData }) => {
       )}
 
       {/* Messages Container */}
-      <div className="h-96 overflow-y-auto p-4 bg-gray-50">
+      <div ref={messagesRef} className="h-96 overflow-y-auto p-4 bg-gray-50">
+        {before && (
+          <div className="flex justify-center mb-4">
+            <button
+              type="button"
+              onClick={loadOlder}
+              disabled={loadingOlder}
+              className="text-sm text-green-700 hover:text-green-900 disabled:text-gray-400"
+            >
+              {loadingOlder ? 'Loading...' : 'Load older messages'}
+            </button>
+          </div>
+        )}
         {messages.length > 0 ? (
           <div className="space-y-4">
             {messages.map((message) => (
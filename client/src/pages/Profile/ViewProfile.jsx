@@ -164,7 +164,7 @@ const ViewProfile = () => {
                     <div className="bg-gray-50 p-4 rounded-lg">
                       <h4 className="text-sm font-medium text-gray-500 mb-1">Patients</h4>
                       <p className="text-lg font-medium text-gray-800">
-                        {profileData.patients?.length || 0} under care
+                        {profileData.patient_count ?? profileData.patients?.length ?? 0} under care
                       </p>
                     </div>
                   </div>
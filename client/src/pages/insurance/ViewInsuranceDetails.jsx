@@ -2,6 +2,7 @@ import { useState, useEffect, useContext } from "react";
 import axios from "axios";
 import { useParams, useNavigate } from "react-router-dom";
 import AuthContext from "../../context/AuthContext";
+import downloadFile from "../../utils/downloadFile";
 import Header from '../../components/Header';
 import { FiDownload, FiTrash2, FiArrowLeft } from "react-icons/fi";
 
@@ -117,14 +118,15 @@ const ViewInsuranceDetails = () => {
                 </p>
               </div>
               
-              <a
-                href={insurance.file}
-                download
+              <button
+                onClick={() =>
+                  downloadFile(insurance.file, authTokens.access).catch(() => setError("Could not download the file"))
+                }
                 className="flex items-center px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors"
               >
                 <FiDownload className="mr-2" />
                 Download File
-              </a>
+              </button>
             </div>
 
             {/* File Preview Placeholder */}
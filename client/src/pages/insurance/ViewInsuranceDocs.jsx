@@ -1,6 +1,7 @@
 import { useState, useEffect, useContext } from "react";
 import axios from "axios";
 import AuthContext from "../../context/AuthContext";
+import downloadFile from "../../utils/downloadFile";
 import { Link } from "react-router-dom";
 import { useNavigate } from "react-router-dom";
 
@@ -10,6 +11,20 @@ const ViewInsuranceDocs = ({ user_id }) => {
   const [insuranceData, setInsuranceData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // cursor URL of the next (older) page, null on the last one
+  const [nextPage, setNextPage] = useState(null);
+
+  const loadMore = async () => {
+    try {
+      const response = await axios.get(nextPage, {
+        headers: { Authorization: `Bearer ${authTokens.access}` },
+      });
+      setInsuranceData((current) => [...current, ...response.data.results]);
+      setNextPage(response.data.next);
+    } catch (err) {
+      setError(err.response ? err.response.data.error : "An error occurred");
+    }
+  };
 
   useEffect(() => {
     const fetchInsuranceData = async () => {
@@ -20,7 +35,8 @@ const ViewInsuranceDocs = ({ user_id }) => {
             headers: { Authorization: `Bearer ${authTokens.access}` },
           }
         );
-        setInsuranceData(response.data);
+        setInsuranceData(response.data.results);
+        setNextPage(response.data.next);
         // console.log("Insurance data", response.data)
       } catch (err) {
         setError(err.response ? err.response.data.error : "An error occurred");
@@ -96,16 +112,17 @@ const ViewInsuranceDocs = ({ user_id }) => {
                 </div>
 
                 <div className="mt-6 flex space-x-3">
-                  <a
-                    href={insurance.file}
-                    download
+                  <button
+                    onClick={() =>
+                      downloadFile(insurance.file, authTokens.access).catch(() => setError("Could not download the file"))
+                    }
                     className="flex-1 flex items-center justify-center px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors"
                   >
                     <svg className="w-5 h-5 mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                       <path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M4 16v1a3 3 0 003 3h10a3 3 0 003-3v-1m-4-4l-4 4m0 0l-4-4m4 4V4" />
                     </svg>
                     Download
-                  </a>
+                  </button>
 
                   {user.role === 'patient' && (
                     <Link
@@ -123,6 +140,14 @@ const ViewInsuranceDocs = ({ user_id }) => {
               </div>
             </div>
           ))}
+          {nextPage && (
+            <button
+              onClick={loadMore}
+              className="col-span-full mx-auto px-6 py-2 bg-gray-100 text-gray-700 rounded-lg hover:bg-gray-200 transition-colors"
+            >
+              Load more
+            </button>
+          )}
         </div>
       ) : (
         <div className="text-center py-12 bg-gray-50 rounded-xl">
@@ -0,0 +1,22 @@
+import axios from "axios";
+
+// The download endpoint needs the bearer token, which a plain <a href> can't send:
+// fetch the file, then hand it to the browser under the name the server gave it.
+const downloadFile = async (url, accessToken) => {
+  const response = await axios.get(url, {
+    headers: { Authorization: `Bearer ${accessToken}` },
+    responseType: "blob",
+  });
+  const disposition = response.headers["content-disposition"] || "";
+  const match = disposition.match(/filename\*=utf-8''([^;]+)/i) || disposition.match(/filename="([^"]+)"/i);
+
+  const link = document.createElement("a");
+  link.href = URL.createObjectURL(response.data);
+  link.download = match ? decodeURIComponent(match[1]) : "insurance-document";
+  document.body.appendChild(link);
+  link.click();
+  link.remove();
+  URL.revokeObjectURL(link.href);
+};
+
+export default downloadFile;